@@ -0,0 +1,82 @@
+"""
+Benchmark : temps de démarrage et mémoire (RSS) du processus web ASGI.
+
+Chaque mesure se fait dans un sous-processus neuf qui importe
+`myproject.asgi:application` et charge toutes les vues (résolution des URLs),
+comme un worker gunicorn/uvicorn au démarrage. Le script échoue (code 1) si
+yt_dlp est chargé côté web, ou si un seuil passé en option est dépassé.
+
+Usage : python benchmarks/bench_asgi_startup.py [--runs 5] [--max-ms 1500] [--max-rss-mb 120]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, resource, sys, time
+start = time.perf_counter()
+from myproject.asgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns  # importe books.views et ses dépendances
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "startup_ms": elapsed * 1000,
+    "rss_mb": rss_kb / 1024,
+    "yt_dlp_loaded": "yt_dlp" in sys.modules,
+    "modules": len(sys.modules),
+}))
+'''
+
+# Même mesure en forçant l'import de yt_dlp : coût évité par le web
+PROBE_WITH_YT_DLP = PROBE.replace('get_resolver().url_patterns', 'get_resolver().url_patterns; import yt_dlp')
+
+
+def run_probe(code):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=env)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def summarize(label, results):
+    startup = statistics.median(r['startup_ms'] for r in results)
+    rss = statistics.median(r['rss_mb'] for r in results)
+    print(f"{label:<28} démarrage {startup:8.1f} ms   RSS {rss:7.1f} Mo   modules {results[0]['modules']}")
+    return startup, rss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    args = parser.parse_args()
+
+    web = [run_probe(PROBE) for _ in range(args.runs)]
+    with_yt_dlp = [run_probe(PROBE_WITH_YT_DLP) for _ in range(args.runs)]
+
+    startup, rss = summarize('Web (application ASGI)', web)
+    summarize('Web + import yt_dlp', with_yt_dlp)
+
+    failures = []
+    if any(r['yt_dlp_loaded'] for r in web):
+        failures.append("yt_dlp est importé par le processus web")
+    if args.max_ms and startup > args.max_ms:
+        failures.append(f"démarrage {startup:.0f} ms > {args.max_ms:.0f} ms")
+    if args.max_rss_mb and rss > args.max_rss_mb:
+        failures.append(f"RSS {rss:.0f} Mo > {args.max_rss_mb:.0f} Mo")
+
+    for failure in failures:
+        print(f"RÉGRESSION : {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark : export en flux des DownloadStat (books/export.py) sur une table synthétique.
+
+Insère N lignes synthétiques (URL https://bench.invalid/..., réutilisées
+d'un lancement à l'autre avec --keep), puis mesure pour chaque format le
+débit de export_chunks et la mémoire maximale du processus (ru_maxrss).
+Les exports en flux passent en premier : la mémoire maximale n'augmente
+pas avec eux. --naive mesure ensuite le chargement du queryset en liste,
+pour comparaison.
+
+À lancer sur une base de développement PostgreSQL (curseurs serveur) : les
+lignes insérées échappent aux agrégats horaires tant qu'elles ne sont pas
+supprimées.
+
+Usage : python benchmarks/bench_export.py [--rows 2000000] [--chunk-size 2000] [--naive] [--keep]
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from books.export import export_chunks  # noqa: E402
+from books.models import DownloadStat  # noqa: E402
+
+MARKER = 'https://bench.invalid/'
+INSERT_BATCH = 10000
+PLATFORMS = ('Facebook', 'YouTube', 'TikTok', 'Instagram', 'Twitter')
+QUALITIES = ('360p', '480p', '720p', '1080p')
+
+
+def max_rss_mb():
+    # Kio sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(rows):
+    existing = DownloadStat.objects.filter(url_telechargement__startswith=MARKER).count()
+    start = timezone.now() - timedelta(days=365)
+    for offset in range(existing, rows, INSERT_BATCH):
+        DownloadStat.objects.bulk_create([
+            DownloadStat(
+                url_telechargement=f"{MARKER}video/{index}",
+                adresse_ip=f"10.{index % 256}.{index // 256 % 256}.{index // 65536 % 256}",
+                horodatage=start + timedelta(seconds=index * 15),
+                statut_telechargement=index % 7 != 0,
+                agent_utilisateur='Mozilla/5.0 (bench)',
+                qualite_video=QUALITIES[index % len(QUALITIES)],
+                taille_fichier=index * 1024,
+                origine_video=PLATFORMS[index % len(PLATFORMS)],
+                direct_url=f"https://cdn.bench.invalid/{index}.mp4?expire=1700000000&signature={'f' * 64}",
+                pays_ip='FR',
+                message_erreur=None if index % 7 else 'Video unavailable',
+            )
+            for index in range(offset, min(offset + INSERT_BATCH, rows))
+        ])
+    return max(rows, existing)
+
+
+def run(queryset, output, compress, chunk_size):
+    started = time.perf_counter()
+    size = 0
+    for data in export_chunks(queryset, output, compress, chunk_size):
+        size += len(data)
+    return time.perf_counter() - started, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--naive', action='store_true', help="Mesure aussi list(queryset) (charge toute la table).")
+    parser.add_argument('--keep', action='store_true', help="Garde les lignes synthétiques pour le lancement suivant.")
+    args = parser.parse_args()
+
+    if connection.vendor != 'postgresql':
+        print(f"Base {connection.vendor} : pas de curseur serveur, la mémoire mesurée n'est pas représentative.")
+    started = time.perf_counter()
+    rows = seed(args.rows)
+    print(f"{rows} lignes synthétiques prêtes en {time.perf_counter() - started:.1f} s")
+    queryset = DownloadStat.objects.filter(url_telechargement__startswith=MARKER).order_by('pk')
+
+    print(f"{'export':<14} {'durée (s)':>10} {'lignes/s':>10} {'Mo produits':>12} {'RSS max (Mo)':>13}")
+    try:
+        for output in ('csv', 'ndjson'):
+            for compress in (False, True):
+                duration, size = run(queryset, output, compress, args.chunk_size)
+                label = output + (' + gzip' if compress else '')
+                print(f"{label:<14} {duration:10.1f} {rows / duration:10.0f} {size / 1e6:12.1f} {max_rss_mb():13.0f}")
+        if args.naive:
+            started = time.perf_counter()
+            loaded = list(queryset)
+            duration = time.perf_counter() - started
+            print(f"{'list(qs)':<14} {duration:10.1f} {len(loaded) / duration:10.0f} {'-':>12} {max_rss_mb():13.0f}")
+            del loaded
+    finally:
+        if not args.keep:
+            DownloadStat.objects.filter(url_telechargement__startswith=MARKER).delete()
+
+
+if __name__ == '__main__':
+    main()
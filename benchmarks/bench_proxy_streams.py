@@ -0,0 +1,212 @@
+"""
+Benchmark : nombre de téléchargements simultanés relayés par un seul worker web.
+
+Un faux CDN local (application ASGI servie par uvicorn) envoie des fichiers
+à débit limité par flux, comme un CDN de plateforme. Le proxy
+(downloads/proxy/, application ASGI Django, un seul worker gunicorn/uvicorn
+comme en production) est
+sollicité par paliers de téléchargements simultanés ; pour chaque palier on
+mesure le temps jusqu'au premier octet, la durée et le débit agrégé.
+Un dernier test coupe un client après le premier bloc et vérifie que le
+faux CDN voit la requête source s'interrompre.
+
+Usage : python benchmarks/bench_proxy_streams.py [--levels 10,50,100,200] [--size-kb 2048] [--rate-kbps 1024]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK = 64 * 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# --- Faux CDN ---
+
+CDN_STATS = {'active': 0, 'completed': 0, 'aborted': 0}
+
+
+async def fake_cdn(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/stats':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(CDN_STATS).encode()})
+        return
+
+    params = dict(pair.split('=') for pair in scope['query_string'].decode().split('&') if pair)
+    size = int(params.get('size', 1024 * 1024))
+    rate = int(params.get('rate', 1024 * 1024))  # octets/s par flux
+
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch())
+    CDN_STATS['active'] += 1
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'video/mp4'), (b'content-length', str(size).encode())],
+        })
+        sent = 0
+        payload = b'\0' * CHUNK
+        while sent < size:
+            if disconnected.is_set():
+                CDN_STATS['aborted'] += 1
+                return
+            part = payload[:min(CHUNK, size - sent)]
+            await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+            sent += len(part)
+            await asyncio.sleep(len(part) / rate)
+        await send({'type': 'http.response.body'})
+        CDN_STATS['completed'] += 1
+    finally:
+        CDN_STATS['active'] -= 1
+        watcher.cancel()
+
+
+def run_cdn(port):
+    import uvicorn
+    uvicorn.run(fake_cdn, host='127.0.0.1', port=port, log_level='warning', lifespan='off')
+
+
+def start_proxy(port, extra_env=None):
+    env = dict(os.environ, **(extra_env or {}))
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    env['DJANGO_ALLOWED_HOSTS'] = '127.0.0.1'
+    # On mesure le relais depuis la source, pas le cache disque
+    env.setdefault('PROXY_CACHE_MAX_BYTES', '0')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'myproject.asgi:application', '-k', 'uvicorn.workers.UvicornWorker',
+         '--workers', '1', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=ROOT, env=env,
+    )
+
+
+async def wait_ready(url):
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} ne répond pas")
+
+
+# --- Client ---
+
+# Le proxy est derrière nginx en production (SECURE_SSL_REDIRECT)
+HEADERS = {'X-Forwarded-Proto': 'https'}
+
+
+async def download(client, url):
+    start = time.perf_counter()
+    ttfb = None
+    received = 0
+    async with client.stream('GET', url, headers=HEADERS) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            received += len(chunk)
+    return ttfb, time.perf_counter() - start, received
+
+
+async def run_level(proxy_url, concurrency, size):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(download(client, proxy_url) for _ in range(concurrency)), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+    ok = [r for r in results if not isinstance(r, BaseException) and r[2] == size]
+    ttfbs = sorted(r[0] for r in ok) or [0]
+    total_bytes = sum(r[2] for r in ok)
+    print(
+        f"{concurrency:>5} flux   ok {len(ok):>4}/{concurrency:<4} "
+        f"TTFB médian {statistics.median(ttfbs) * 1000:7.1f} ms  p95 {ttfbs[int(len(ttfbs) * 0.95) - 1 if len(ttfbs) > 1 else 0] * 1000:7.1f} ms   "
+        f"durée {elapsed:6.2f} s   débit agrégé {total_bytes / elapsed / 1024 / 1024:7.1f} Mo/s"
+    )
+    return len(ok) == concurrency
+
+
+async def check_disconnect(proxy_url, cdn_url):
+    async with httpx.AsyncClient() as client:
+        before = (await client.get(f"{cdn_url}/stats")).json()
+        async with client.stream('GET', proxy_url, headers=HEADERS) as response:
+            async for _ in response.aiter_raw():
+                break
+        # Fermeture du flux client avant la fin : la source doit être coupée
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            after = (await client.get(f"{cdn_url}/stats")).json()
+            if after['aborted'] > before['aborted']:
+                return True
+    return False
+
+
+async def main_async(args, proxy_port, cdn_port):
+    cdn_url = f"http://127.0.0.1:{cdn_port}"
+    size = args.size_kb * 1024
+    source = f"{cdn_url}/video.mp4?size={size}&rate={args.rate_kbps * 1024}"
+    proxy_url = f"http://127.0.0.1:{proxy_port}/api/downloads/proxy/?{urlencode({'url': source})}"
+    await wait_ready(f"{cdn_url}/stats")
+    await wait_ready(f"http://127.0.0.1:{proxy_port}/")
+
+    print(f"Fichier {args.size_kb} Ko à {args.rate_kbps} Ko/s par flux (durée idéale {size / (args.rate_kbps * 1024):.1f} s)")
+    # Premier appel : chargement des vues et ouverture du pool de connexions
+    async with httpx.AsyncClient(timeout=120) as client:
+        await download(client, proxy_url)
+
+    all_ok = True
+    for level in args.levels:
+        all_ok &= await run_level(proxy_url, level, size)
+
+    aborted = await check_disconnect(proxy_url, cdn_url)
+    print(f"Déconnexion client propagée à la source : {'oui' if aborted else 'NON'}")
+    return all_ok and aborted
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=lambda v: [int(x) for x in v.split(',')], default=[10, 50, 100, 200])
+    parser.add_argument('--size-kb', type=int, default=2048)
+    parser.add_argument('--rate-kbps', type=int, default=1024)
+    args = parser.parse_args()
+
+    cdn_port, proxy_port = free_port(), free_port()
+    cdn = multiprocessing.Process(target=run_cdn, args=(cdn_port,), daemon=True)
+    cdn.start()
+    proxy = start_proxy(proxy_port)
+    try:
+        ok = asyncio.run(main_async(args, proxy_port, cdn_port))
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        cdn.terminate()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
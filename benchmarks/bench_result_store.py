@@ -0,0 +1,102 @@
+"""
+Benchmark : latence d'un poll de statut de tâche selon le stockage des résultats.
+
+Compare le mode 'database' (django_celery_results, base de DATABASES) et le
+mode 'redis' (books.result_backend.CompactRedisBackend, TTL natif). Pour
+chaque mode, N résultats sont écrits comme par un worker (store_result),
+puis relus comme le fait TaskStatusView : un AsyncResult neuf par poll.
+Les résultats écrits sont supprimés à la fin.
+
+Usage : python benchmarks/bench_result_store.py [--tasks 200] [--polls 2000] [--redis-url redis://localhost:6379/0]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from celery.result import AsyncResult  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from myproject.celery import app  # noqa: E402
+
+# Résultat typique de async_extract_metadata_and_save
+RESULT = {
+    "download_url": "https://scontent.xx.fbcdn.net/v/t42.1790-2/video.mp4?_nc_cat=1&oe=6712AB34&oh=" + "f" * 64,
+    "format": "720p",
+    "download_id": 123456,
+}
+
+
+def make_backend(mode, redis_url):
+    if mode == 'database':
+        from django_celery_results.backends import DatabaseBackend
+
+        return DatabaseBackend(app=app)
+    from books.result_backend import CompactRedisBackend
+
+    return CompactRedisBackend(app=app, url=redis_url)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': samples[len(samples) // 2],
+        'p95': samples[int(len(samples) * 0.95)],
+        'p99': samples[int(len(samples) * 0.99)],
+        'mean': statistics.mean(samples),
+    }
+
+
+def run(mode, backend, tasks, polls):
+    task_ids = [f"bench-{uuid.uuid4()}" for _ in range(tasks)]
+    writes = []
+    for task_id in task_ids:
+        start = time.perf_counter()
+        backend.store_result(task_id, RESULT, 'SUCCESS')
+        writes.append(time.perf_counter() - start)
+
+    reads = []
+    for index in range(polls):
+        task_id = task_ids[index % tasks]
+        start = time.perf_counter()
+        status = AsyncResult(task_id, backend=backend).status
+        reads.append(time.perf_counter() - start)
+        assert status == 'SUCCESS', status
+
+    for task_id in task_ids:
+        backend.forget(task_id)
+    return percentiles(writes), percentiles(reads)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--polls', type=int, default=2000)
+    parser.add_argument('--redis-url', default=settings.TASK_RESULT_REDIS_URL)
+    args = parser.parse_args()
+
+    modes = ['database'] + (['redis'] if args.redis_url else [])
+    print(f"{'mode':<10} {'opération':<18} {'p50':>9} {'p95':>9} {'p99':>9} {'moyenne':>9}  (ms)")
+    for mode in modes:
+        try:
+            writes, reads = run(mode, make_backend(mode, args.redis_url), args.tasks, args.polls)
+        except Exception as e:
+            print(f"{mode:<10} indisponible : {e}")
+            continue
+        for label, stats in (('fin de tâche', writes), ('poll de statut', reads)):
+            print(f"{mode:<10} {label:<18} " + ' '.join(f"{stats[key] * 1000:9.3f}" for key in ('p50', 'p95', 'p99', 'mean')))
+    if not args.redis_url:
+        print("Mode redis ignoré : ni --redis-url ni TASK_RESULT_REDIS_URL / REDIS_URL.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark : téléchargement par segments Range parallèles face à un CDN qui
+bride chaque connexion.
+
+Un faux CDN local limite le débit par connexion et sert les Range. Le même
+gros fichier est téléchargé via downloads/proxy/ (un worker gunicorn/uvicorn)
+en flux unique puis avec PROXY_SEGMENT_PARALLELISM connexions ; le contenu
+reçu est vérifié octet par octet. Un dernier passage utilise une source qui
+ignore Range, pour vérifier le repli sur un flux unique.
+
+Usage : python benchmarks/bench_segmented_fetch.py [--size-mb 16] [--rate-kbps 2048] [--parallelism 1,4,8]
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_proxy_streams import HEADERS, free_port, start_proxy, wait_ready  # noqa: E402
+
+BLOCK = 64 * 1024
+
+
+def content(size):
+    """Contenu déterministe (vérifiable) du fichier servi par le faux CDN."""
+    pattern = hashlib.sha256(b'bench').digest() * (BLOCK // 32)
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+async def throttled_cdn(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    params = dict(pair.split('=') for pair in scope['query_string'].decode().split('&') if pair)
+    size = int(params['size'])
+    rate = int(params['rate'])  # octets/s par connexion
+    ranges = params.get('ranges', '1') == '1'
+    body = content(size)
+
+    start, end, status = 0, size - 1, 200
+    range_header = dict(scope['headers']).get(b'range', b'').decode()
+    if ranges and range_header.startswith('bytes='):
+        first, last = range_header[len('bytes='):].split('-')
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        status = 206
+
+    headers = [(b'content-type', b'video/mp4'), (b'content-length', str(end - start + 1).encode())]
+    if ranges:
+        headers.append((b'accept-ranges', b'bytes'))
+    if status == 206:
+        headers.append((b'content-range', f"bytes {start}-{end}/{size}".encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    if scope['method'] == 'HEAD':
+        await send({'type': 'http.response.body'})
+        return
+    position = start
+    while position <= end:
+        part = body[position:min(position + BLOCK, end + 1)]
+        await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        position += len(part)
+        await asyncio.sleep(len(part) / rate)
+    await send({'type': 'http.response.body'})
+
+
+def run_cdn(port):
+    import uvicorn
+    uvicorn.run(throttled_cdn, host='127.0.0.1', port=port, log_level='warning', lifespan='off')
+
+
+async def timed_download(proxy_port, source):
+    url = f"http://127.0.0.1:{proxy_port}/api/downloads/proxy/?{urlencode({'url': source})}"
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=300) as client:
+        async with client.stream('GET', url, headers=HEADERS) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_raw():
+                digest.update(chunk)
+    return time.perf_counter() - start, digest.hexdigest()
+
+
+def measure(label, parallelism, cdn_port, source, size):
+    proxy_port = free_port()
+    proxy = start_proxy(proxy_port, {
+        'PROXY_SEGMENT_PARALLELISM': str(parallelism),
+        'PROXY_SEGMENT_MIN_SIZE': str(1024 * 1024),
+        'PROXY_CACHE_MAX_BYTES': '0',
+    })
+    try:
+        async def run():
+            await wait_ready(f"http://127.0.0.1:{proxy_port}/")
+            return await timed_download(proxy_port, source)
+        elapsed, digest = asyncio.run(run())
+    finally:
+        proxy.terminate()
+        proxy.wait()
+    ok = digest == hashlib.sha256(content(size)).hexdigest()
+    print(f"{label:<34} {elapsed:7.2f} s   {size / elapsed / 1024 / 1024:6.2f} Mo/s   contenu {'OK' if ok else 'CORROMPU'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=16)
+    parser.add_argument('--rate-kbps', type=int, default=2048)
+    parser.add_argument('--parallelism', type=lambda v: [int(x) for x in v.split(',')], default=[1, 4, 8])
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    cdn_port = free_port()
+    cdn = multiprocessing.Process(target=run_cdn, args=(cdn_port,), daemon=True)
+    cdn.start()
+    try:
+        asyncio.run(wait_ready(f"http://127.0.0.1:{cdn_port}/?size=1&rate=1"))
+        source = f"http://127.0.0.1:{cdn_port}/video.mp4?size={size}&rate={args.rate_kbps * 1024}"
+        print(f"Fichier {args.size_mb} Mo, CDN bridé à {args.rate_kbps} Ko/s par connexion")
+        ok = True
+        for parallelism in args.parallelism:
+            label = 'flux unique' if parallelism == 1 else f"{parallelism} segments en parallèle"
+            ok &= measure(label, parallelism, cdn_port, source, size)
+        ok &= measure('source sans Range (repli)', max(args.parallelism), cdn_port, f"{source}&ranges=0", size)
+    finally:
+        cdn.terminate()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark : construction d'un YoutubeDL à chaque appel vs réutilisation via le pool.
+
+Aucune requête réseau : on mesure le coût fixe (création de l'instance,
+registre d'extracteurs, sessions) plus la sélection de format locale sur un
+dict d'infos synthétique, comme le fait extract_video_metadata sur un cache hit.
+
+Usage : python benchmarks/bench_ydl_pool.py [iterations]
+"""
+import copy
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import yt_dlp  # noqa: E402
+
+from books.ydl_pool import YDL_PROFILES, pooled_ydl, set_ydl_format, warm_pool  # noqa: E402
+
+INFO = yt_dlp.YoutubeDL.sanitize_info({
+    'id': 'bench',
+    'title': 'bench',
+    'extractor': 'generic',
+    'extractor_key': 'Generic',
+    'webpage_url': 'https://example.com/video/1',
+    'duration': 30,
+    'formats': [
+        {'format_id': f'v{h}', 'url': f'https://cdn.example.com/v{h}.mp4', 'height': h,
+         'vcodec': 'avc1', 'acodec': 'none', 'ext': 'mp4', 'format_note': f'{h}p'}
+        for h in (144, 240, 360, 480, 720, 1080)
+    ] + [
+        {'format_id': 'a', 'url': 'https://cdn.example.com/a.m4a', 'vcodec': 'none', 'acodec': 'mp4a', 'ext': 'm4a'},
+    ],
+}, remove_private_keys=True)
+
+FORMAT = 'bestvideo[height=720]+bestaudio/best[height=720]'
+
+
+def per_call(iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with yt_dlp.YoutubeDL({**YDL_PROFILES['metadata'], 'format': FORMAT, 'forcejson': False}) as ydl:
+            ydl.process_ie_result(copy.deepcopy(INFO), download=False)
+    return time.perf_counter() - start
+
+
+def pooled(iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with pooled_ydl('metadata') as ydl:
+            ydl.params['forcejson'] = False
+            set_ydl_format(ydl, FORMAT)
+            ydl.process_ie_result(copy.deepcopy(INFO), download=False)
+    return time.perf_counter() - start
+
+
+def cold_import():
+    """Coût du premier import de yt_dlp + première instance, payé par un worker non préchauffé."""
+    code = 'import time; t = time.perf_counter(); import yt_dlp; yt_dlp.YoutubeDL({"quiet": True}); print(time.perf_counter() - t)'
+    return float(subprocess.check_output([sys.executable, '-c', code]).decode())
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    warm_pool()
+
+    cold = cold_import()
+    construct = per_call(iterations)
+    reuse = pooled(iterations)
+
+    print(f"Import yt_dlp + 1re instance (worker froid) : {cold * 1000:8.1f} ms")
+    print(f"Construction à chaque appel              : {construct / iterations * 1000:8.2f} ms/appel")
+    print(f"Instance du pool                         : {reuse / iterations * 1000:8.2f} ms/appel")
+    print(f"Gain                                     : x{construct / reuse:.1f}")
+
+
+if __name__ == '__main__':
+    main()
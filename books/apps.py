@@ -4,3 +4,13 @@ from django.apps import AppConfig # type: ignore
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from prometheus_client import REGISTRY
+        from .metrics import CircuitBreakerCollector, StatBufferCollector
+
+        for collector in (CircuitBreakerCollector(), StatBufferCollector()):
+            try:
+                REGISTRY.register(collector)
+            except ValueError:
+                pass  # Déjà enregistré (ready() appelé plusieurs fois)
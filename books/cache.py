@@ -0,0 +1,158 @@
+# cache.py
+"""
+Cache partagé (entre workers Celery et processus web) des dicts d'infos yt-dlp.
+
+Les entrées sont indexées par URL canonique de la vidéo et expirent en même
+temps que les URLs directes signées qu'elles contiennent (paramètres
+`expire=`, `x-expires=` ou `oe=`). La borne LRU/taille est assurée par le
+backend de cache (MAX_ENTRIES en local, maxmemory-policy côté Redis).
+
+Les erreurs définitives (vidéo privée, supprimée...) y sont aussi mises en
+cache négatif pour un temps, afin qu'un lien mort échoue immédiatement.
+
+La matrice des formats (une entrée par résolution, avec URL directe) est
+stockée à côté, sous un handle dérivé de l'URL canonique.
+"""
+import hashlib
+import logging
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Paramètres d'expiration en secondes depuis epoch (YouTube, TikTok...)
+DECIMAL_EXPIRY_PARAMS = ('expire', 'expires', 'x-expires')
+# Paramètres d'expiration en hexadécimal (CDN Facebook / Instagram)
+HEX_EXPIRY_PARAMS = ('oe',)
+
+
+def get_extraction_cache():
+    return caches[settings.EXTRACTION_CACHE_ALIAS]
+
+
+def url_digest(canonical_url):
+    """Identifiant stable d'une vidéo (sert aussi de handle de matrice de formats)."""
+    return hashlib.sha1(canonical_url.encode('utf-8')).hexdigest()
+
+
+def info_cache_key(canonical_url):
+    return f"ytdlp:info:{url_digest(canonical_url)}"
+
+
+def failure_cache_key(canonical_url):
+    return f"ytdlp:failure:{url_digest(canonical_url)}"
+
+
+def matrix_cache_key(handle):
+    return f"ytdlp:matrix:{handle}"
+
+
+def parse_url_expiry(url):
+    """
+    Retourne le timestamp d'expiration d'une URL signée, ou None si l'URL
+    ne porte pas d'expiration connue.
+    """
+    if not url:
+        return None
+    params = parse_qs(urlsplit(url).query)
+    for name in DECIMAL_EXPIRY_PARAMS:
+        for value in params.get(name, []):
+            if value.isdigit():
+                return int(value)
+    for name in HEX_EXPIRY_PARAMS:
+        for value in params.get(name, []):
+            try:
+                return int(value, 16)
+            except ValueError:
+                continue
+    return None
+
+
+def info_expiry(info):
+    """Plus proche expiration parmi toutes les URLs directes du dict d'infos."""
+    urls = [info.get('url')] + [fmt.get('url') for fmt in info.get('formats') or []]
+    expiries = [expiry for expiry in map(parse_url_expiry, urls) if expiry]
+    return min(expiries) if expiries else None
+
+
+def compute_info_ttl(info, now=None):
+    """
+    Durée de vie (secondes) d'une entrée : jusqu'à l'expiration des URLs signées,
+    moins une marge, bornée par EXTRACTION_CACHE_MAX_TTL.
+    """
+    expiry = info_expiry(info)
+    if expiry is None:
+        return settings.EXTRACTION_CACHE_DEFAULT_TTL
+    now = now or time.time()
+    ttl = int(expiry - now - settings.EXTRACTION_CACHE_EXPIRY_MARGIN)
+    return min(ttl, settings.EXTRACTION_CACHE_MAX_TTL)
+
+
+def get_cached_info(canonical_url):
+    try:
+        return get_extraction_cache().get(info_cache_key(canonical_url))
+    except Exception as e:
+        # Le cache n'est qu'une optimisation : on retombe sur yt-dlp
+        logger.warning(f"Cache d'extraction indisponible: {str(e)}")
+        return None
+
+
+def set_cached_info(canonical_url, info):
+    ttl = compute_info_ttl(info)
+    if ttl <= 0:
+        return
+    try:
+        get_extraction_cache().set(info_cache_key(canonical_url), info, timeout=ttl)
+    except Exception as e:
+        logger.warning(f"Impossible d'écrire dans le cache d'extraction: {str(e)}")
+
+
+def get_cached_failure(canonical_url):
+    """Message de la dernière erreur définitive pour cette URL (cache négatif), ou None."""
+    try:
+        return get_extraction_cache().get(failure_cache_key(canonical_url))
+    except Exception as e:
+        logger.warning(f"Cache d'extraction indisponible: {str(e)}")
+        return None
+
+
+def set_cached_failure(canonical_url, message):
+    try:
+        get_extraction_cache().set(
+            failure_cache_key(canonical_url), message, timeout=settings.EXTRACTION_NEGATIVE_CACHE_TTL
+        )
+    except Exception as e:
+        logger.warning(f"Impossible d'écrire dans le cache d'extraction: {str(e)}")
+
+
+def get_cached_matrix(handle):
+    """Matrice des formats d'une vidéo (voir utils.build_format_matrix), ou None."""
+    try:
+        return get_extraction_cache().get(matrix_cache_key(handle))
+    except Exception as e:
+        logger.warning(f"Cache d'extraction indisponible: {str(e)}")
+        return None
+
+
+def set_cached_matrix(handle, matrix, info):
+    """La matrice expire avec les URLs signées du dict d'infos dont elle est tirée."""
+    ttl = compute_info_ttl(info)
+    if ttl <= 0:
+        return
+    try:
+        get_extraction_cache().set(matrix_cache_key(handle), matrix, timeout=ttl)
+    except Exception as e:
+        logger.warning(f"Impossible d'écrire dans le cache d'extraction: {str(e)}")
+
+
+def drop_cached_extraction(canonical_url):
+    """Oublie le dict d'infos et la matrice d'une vidéo dont les URLs signées ont expiré avant l'heure."""
+    try:
+        get_extraction_cache().delete_many([
+            info_cache_key(canonical_url), matrix_cache_key(url_digest(canonical_url))
+        ])
+    except Exception as e:
+        logger.warning(f"Impossible d'écrire dans le cache d'extraction: {str(e)}")
@@ -0,0 +1,120 @@
+# circuit_breaker.py
+"""
+Disjoncteur par plateforme autour des extractions yt-dlp.
+
+Les succès / échecs sont comptés dans des fenêtres glissantes du cache partagé,
+donc agrégés sur tous les workers. Au-delà du seuil d'échec, le disjoncteur
+s'ouvre : les nouvelles tâches sont rejetées immédiatement. À l'expiration de
+la période d'ouverture, il passe semi-ouvert et laisse passer quelques
+requêtes d'essai : un succès le referme, un échec le rouvre.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Valeurs exposées dans la métrique Prometheus
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """La plateforme est temporairement désactivée par le disjoncteur."""
+
+    def __init__(self, message, platform=None, retry_after=None):
+        super().__init__(message)
+        self.platform = platform
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, platform):
+        self.platform = platform
+        self.prefix = f"breaker:{platform.lower()}"
+
+    def _key(self, name):
+        return f"{self.prefix}:{name}"
+
+    def state(self):
+        if cache.get(self._key('open_until')):
+            return OPEN
+        if cache.get(self._key('tripped')):
+            return HALF_OPEN
+        return CLOSED
+
+    def retry_after(self):
+        """Secondes restantes avant le passage en semi-ouvert."""
+        open_until = cache.get(self._key('open_until'))
+        return max(1, int(open_until - time.time())) if open_until else 0
+
+    def allow_request(self):
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        # Semi-ouvert : seul un nombre limité de requêtes d'essai passe
+        trials_key = self._key('trials')
+        cache.add(trials_key, 0, timeout=settings.CIRCUIT_BREAKER_OPEN_DURATION)
+        return cache.incr(trials_key) <= settings.CIRCUIT_BREAKER_HALF_OPEN_TRIALS
+
+    def check(self):
+        """Lève CircuitOpenError si la requête doit être rejetée."""
+        if not self.allow_request():
+            retry_after = self.retry_after() or settings.CIRCUIT_BREAKER_OPEN_DURATION
+            raise CircuitOpenError(
+                f"{self.platform} downloads are temporarily unavailable. Please try again in {retry_after} seconds.",
+                self.platform,
+                retry_after,
+            )
+
+    def record_success(self):
+        self._count('total')
+        if self.state() == HALF_OPEN:
+            logger.info(f"Disjoncteur {self.platform} refermé")
+            self.reset()
+
+    def record_failure(self):
+        self._count('total')
+        self._count('failures')
+        state = self.state()
+        if state == HALF_OPEN or (state == CLOSED and self._should_trip()):
+            self.trip()
+
+    def trip(self):
+        open_until = time.time() + settings.CIRCUIT_BREAKER_OPEN_DURATION
+        cache.set(self._key('open_until'), open_until, timeout=settings.CIRCUIT_BREAKER_OPEN_DURATION)
+        cache.set(self._key('tripped'), True, timeout=None)
+        cache.delete(self._key('trials'))
+        logger.warning(f"Disjoncteur {self.platform} ouvert pour {settings.CIRCUIT_BREAKER_OPEN_DURATION}s")
+
+    def reset(self):
+        cache.delete_many(
+            [self._key('open_until'), self._key('tripped'), self._key('trials')]
+            + self._bucket_keys('total') + self._bucket_keys('failures')
+        )
+
+    def _bucket_keys(self, name):
+        bucket_size = settings.CIRCUIT_BREAKER_BUCKET_SIZE
+        current = int(time.time() // bucket_size)
+        count = max(1, settings.CIRCUIT_BREAKER_WINDOW // bucket_size)
+        return [self._key(f"{name}:{bucket}") for bucket in range(current - count + 1, current + 1)]
+
+    def _count(self, name):
+        key = self._bucket_keys(name)[-1]
+        cache.add(key, 0, timeout=settings.CIRCUIT_BREAKER_WINDOW + settings.CIRCUIT_BREAKER_BUCKET_SIZE)
+        cache.incr(key)
+
+    def _should_trip(self):
+        total = sum(cache.get_many(self._bucket_keys('total')).values())
+        failures = sum(cache.get_many(self._bucket_keys('failures')).values())
+        return (
+            total >= settings.CIRCUIT_BREAKER_MIN_REQUESTS
+            and failures / total >= settings.CIRCUIT_BREAKER_FAILURE_RATE
+        )
@@ -0,0 +1,371 @@
+# content_cache.py
+"""
+Cache disque des vidéos relayées par le proxy (PROXY_CACHE_DIR, sous MEDIA_ROOT).
+
+Les entrées sont indexées par une identité tirée du serveur, jamais des
+paramètres du client : pour un handle, la vidéo et le format demandé du
+DownloadStat enregistré (stables d'une extraction à l'autre ; le libellé
+de qualité, souvent 'unknown', ne distingue pas les formats) ; pour une URL
+directe, ou un handle enregistré sans format, l'URL complète, requête comprise (la vidéo y est souvent désignée
+par la requête : /videoplayback?id=..., download.php?id=...). Disposition
+sur disque :
+
+    <key[:2]>/<key>        corps complet (servi par nginx ou par la vue)
+    <key[:2]>/<key>.json   type et taille
+    <key[:2]>/<key>.part   corps en cours d'écriture
+
+Le premier client d'une vidéo absente la remplit en même temps qu'il la
+reçoit ; le .part (créé en O_EXCL) sert de verrou entre processus et est
+renommé atomiquement une fois complet. Les clients suivants lisent le .part
+à mesure qu'il grossit.
+
+La taille totale est tenue dans le cache partagé (somme des entrées
+écrites) : le disque n'est parcouru que quand elle dépasse
+PROXY_CACHE_MAX_BYTES, ou qu'elle est inconnue, et l'éviction LRU (mtime
+rafraîchi à chaque lecture) redescend alors à PROXY_CACHE_EVICT_TARGET du
+budget. Les lectures, écritures et parcours du disque passent par un thread
+(sync_to_async, thread_sensitive=False), jamais par la boucle d'événements.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from contextlib import aclosing
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .proxy import iter_from_offset
+from .utils import canonicalize_video_url
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Plage demandée hors du fichier (réponse 416)
+UNSATISFIABLE = object()
+
+# Taille totale des entrées écrites, et verrou du parcours d'éviction
+TOTAL_BYTES_KEY = 'proxycache:bytes'
+EVICTION_LOCK_KEY = 'proxycache:evicting'
+EVICTION_LOCK_TTL = 5 * 60
+
+
+def content_key(direct_url, handle=None):
+    """
+    Clé d'un corps de vidéo. Un handle (books/refresh.py) donne une clé
+    stable malgré le renouvellement de la signature ; une URL directe seule
+    n'est réutilisée que pour la même URL exacte.
+    """
+    if handle is not None and handle.requested_format:
+        identity = f"stat|{canonicalize_video_url(handle.video_url)}|{handle.requested_format}"
+    else:
+        parts = urlsplit(direct_url)
+        identity = f"url|{parts._replace(netloc=parts.netloc.lower(), fragment='').geturl()}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def parse_range(header, size):
+    """
+    Retourne (début, fin incluse) pour un en-tête Range à plage unique,
+    None s'il faut servir le fichier entier, UNSATISFIABLE pour un 416.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffixe : les N derniers octets
+        length = int(last)
+        if length == 0:
+            return UNSATISFIABLE
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return UNSATISFIABLE
+    return start, end
+
+
+class CacheEntry:
+    def __init__(self, key):
+        self.key = key
+        self.relative_path = f"{key[:2]}/{key}"
+        self.path = os.path.join(settings.PROXY_CACHE_DIR, self.relative_path)
+        self.part_path = f"{self.path}.part"
+        self.meta_path = f"{self.path}.json"
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def etag(self, meta):
+        return f'"{self.key[:16]}-{meta["size"]}"'
+
+    def hit(self):
+        """Métadonnées si le corps complet est en cache (et le marque récemment utilisé)."""
+        if not os.path.exists(self.path):
+            return None
+        meta = self.read_meta()
+        if meta is None:
+            return None
+        try:
+            os.utime(self.path)
+        except OSError:
+            pass
+        return meta
+
+    def filling_meta(self):
+        """Métadonnées si un autre client remplit l'entrée en ce moment, None sinon."""
+        try:
+            stalled_for = time.time() - os.stat(self.part_path).st_mtime
+        except FileNotFoundError:
+            return None
+        if stalled_for > settings.PROXY_CACHE_STALL_TIMEOUT:
+            # Écrivain mort (processus tué) : l'entrée est libérée
+            self._remove(self.part_path, self.meta_path)
+            return None
+        return self.read_meta()
+
+    async def is_uncacheable(self):
+        return bool(await cache.aget(f"proxycache:skip:{self.key}"))
+
+    async def mark_uncacheable(self):
+        """Évite de retenter le remplissage (taille inconnue ou trop grande)."""
+        await cache.aset(f"proxycache:skip:{self.key}", True, timeout=settings.PROXY_CACHE_SKIP_TTL)
+
+    def is_cacheable(self, upstream):
+        """Seules les réponses complètes, non compressées et de taille connue sont gardées."""
+        length = upstream.headers.get('content-length', '')
+        return (
+            upstream.status_code == 200
+            and length.isdigit()
+            and 0 < int(length) <= settings.PROXY_CACHE_MAX_OBJECT_BYTES
+            and 'content-encoding' not in upstream.headers
+        )
+
+    def claim(self):
+        """Réserve le remplissage de l'entrée pour ce processus ; None si déjà pris."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return None
+        return CacheWriter(self, fd)
+
+    def open_filling(self):
+        """Ouvre l'entrée en cours de remplissage, ou complète si elle vient d'être renommée ; None sinon."""
+        try:
+            return open(self.part_path, 'rb')
+        except FileNotFoundError:
+            pass
+        try:
+            return open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, *paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class CacheWriter:
+    """Écriture d'une entrée pendant qu'elle est relayée au premier client."""
+
+    def __init__(self, entry, fd):
+        self.entry = entry
+        self.fd = fd
+        self.size = None
+        self.written = 0
+
+    def start(self, content_type, size):
+        self.size = size
+        tmp_path = f"{self.entry.meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'content_type': content_type, 'size': size}, f)
+        os.replace(tmp_path, self.entry.meta_path)
+
+    def write(self, chunk):
+        if self.fd is None:
+            return
+        try:
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(self.fd, view):]
+            self.written += len(chunk)
+        except OSError as e:
+            # Disque plein... : le client continue d'être servi depuis la source
+            logger.warning(f"Écriture du cache proxy abandonnée: {str(e)}")
+            self.abort()
+
+    def owns_part(self):
+        """
+        True si le .part est toujours celui de cet écrivain : jugé mort après
+        PROXY_CACHE_STALL_TIMEOUT sans progression (client lent), il a pu être
+        supprimé et réservé par un autre client.
+        """
+        try:
+            current = os.stat(self.entry.part_path)
+        except FileNotFoundError:
+            return False
+        mine = os.fstat(self.fd)
+        return (mine.st_dev, mine.st_ino) == (current.st_dev, current.st_ino)
+
+    def commit(self):
+        if self.fd is None:
+            return
+        owned = self.owns_part()
+        os.close(self.fd)
+        self.fd = None
+        if not owned:
+            logger.info(f"Entrée {self.entry.key} reprise par un autre client, remplissage abandonné")
+            return
+        if self.written != self.size:
+            self.entry._remove(self.entry.part_path, self.entry.meta_path)
+            return
+        os.replace(self.entry.part_path, self.entry.path)
+        track_size(self.size)
+
+    def abort(self):
+        if self.fd is None:
+            return
+        owned = self.owns_part()
+        os.close(self.fd)
+        self.fd = None
+        if owned:
+            self.entry._remove(self.entry.part_path, self.entry.meta_path)
+
+
+def track_size(size):
+    """Ajoute une entrée écrite au total ; parcourt le disque si le budget est dépassé ou le total inconnu."""
+    max_bytes = settings.PROXY_CACHE_MAX_BYTES
+    try:
+        if cache.add(TOTAL_BYTES_KEY, 0, timeout=None):
+            # Premier remplissage depuis le démarrage du cache partagé : total à mesurer
+            evict()
+        elif cache.incr(TOTAL_BYTES_KEY, size) > max_bytes:
+            evict()
+    except Exception as e:
+        logger.warning(f"Taille du cache proxy non suivie: {str(e)}")
+
+
+def evict(max_bytes=None):
+    """
+    Supprime les entrées les moins récemment lues jusqu'à redescendre à
+    PROXY_CACHE_EVICT_TARGET du budget en octets, et recale le total suivi.
+    Retourne la taille restante (None si un autre processus évince déjà).
+    """
+    max_bytes = settings.PROXY_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not cache.add(EVICTION_LOCK_KEY, True, timeout=EVICTION_LOCK_TTL):
+        return None
+    try:
+        entries = []
+        total = 0
+        for root, _dirs, files in os.walk(settings.PROXY_CACHE_DIR):
+            for name in files:
+                if '.' in name:
+                    continue  # .json, .part, .tmp
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+        if total > max_bytes:
+            target = int(max_bytes * settings.PROXY_CACHE_EVICT_TARGET)
+            for _mtime, path, size in sorted(entries):
+                for victim in (path, f"{path}.json"):
+                    try:
+                        os.remove(victim)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                if total <= target:
+                    break
+        cache.set(TOTAL_BYTES_KEY, total, timeout=None)
+        return total
+    finally:
+        cache.delete(EVICTION_LOCK_KEY)
+
+
+async def iter_and_fill(chunks, writer):
+    """Relaie le corps de la source (itérateur asynchrone) en écrivant le cache au passage."""
+    write = sync_to_async(writer.write, thread_sensitive=False)
+    completed = False
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await write(chunk)
+                yield chunk
+        completed = True
+    finally:
+        if completed:
+            await sync_to_async(writer.commit, thread_sensitive=False)()
+        else:
+            await sync_to_async(writer.abort, thread_sensitive=False)()
+
+
+async def iter_file(f, start, length, chunk_size=None):
+    """
+    Lit une plage d'un fichier du cache déjà ouvert (ouvert par la vue : une
+    éviction ultérieure ne le coupe pas).
+    """
+    chunk_size = chunk_size or settings.PROXY_CHUNK_SIZE
+    read = sync_to_async(f.read, thread_sensitive=False)
+    with f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def iter_filling(entry, size, direct_url, chunk_size=None):
+    """
+    Lit une entrée en cours de remplissage à mesure qu'elle grossit. Si
+    l'écrivain abandonne, la suite est demandée à la source (Range).
+    """
+    chunk_size = chunk_size or settings.PROXY_CHUNK_SIZE
+    sent = 0
+    f = await sync_to_async(entry.open_filling, thread_sensitive=False)()
+    if f is not None:
+        read = sync_to_async(f.read, thread_sensitive=False)
+        with f:
+            last_progress = time.monotonic()
+            completed_seen = False
+            while sent < size:
+                chunk = await read(min(chunk_size, size - sent))
+                if chunk:
+                    sent += len(chunk)
+                    last_progress = time.monotonic()
+                    yield chunk
+                    continue
+                if os.path.exists(entry.path):
+                    # Renommé : tout est écrit, une dernière lecture suffit
+                    if completed_seen:
+                        break
+                    completed_seen = True
+                    continue
+                if not os.path.exists(entry.part_path) or time.monotonic() - last_progress > settings.PROXY_CACHE_STALL_TIMEOUT:
+                    break
+                await asyncio.sleep(settings.PROXY_CACHE_POLL_INTERVAL)
+
+    if sent < size:
+        logger.info(f"Remplissage du cache proxy interrompu, reprise depuis la source à l'octet {sent}")
+        async for chunk in iter_from_offset(direct_url, sent, chunk_size):
+            yield chunk
@@ -0,0 +1,117 @@
+# export.py
+"""
+Export brut des DownloadStat en CSV ou NDJSON, en flux (stats/export/).
+
+Les lignes sont lues par lots de STATS_EXPORT_CHUNK_SIZE avec
+QuerySet.iterator() sur un curseur serveur PostgreSQL, sérialisées et
+éventuellement compressées (gzip) lot par lot : la mémoire utilisée ne
+dépend pas du nombre de lignes exportées.
+
+La lecture se fait dans une transaction, ouverte le temps de l'export : le
+curseur n'est alors pas déclaré WITH HOLD (que PostgreSQL matérialise en
+entier au commit) et les lignes sont lues au fil de l'envoi, sur un
+instantané cohérent de la table.
+
+Les cellules CSV qui commencent par un caractère de formule (=, +, -, @,
+tabulation, retour chariot) sont préfixées d'une apostrophe : les URL,
+User-Agent et référents viennent des clients et ne doivent pas s'exécuter
+à l'ouverture de l'export dans un tableur.
+
+Sous ASGI, Django recopierait en liste un itérateur synchrone : chaque lot
+est donc produit par sync_to_async, toujours sur le même fil (et la même
+connexion, qui porte le curseur), et relayé par un générateur asynchrone.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .models import DownloadStat
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+EXPORT_FIELDS = [field.attname for field in DownloadStat._meta.concrete_fields]
+
+# Débuts de cellule interprétés comme une formule par les tableurs
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_cell(value):
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in rows:
+        writer.writerows([_csv_cell(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Aucune ligne : l'en-tête seul
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(rows):
+    for batch in rows:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_FIELDS, map(_plain, row))), ensure_ascii=False) + '\n' for row in batch
+        ).encode('utf-8')
+
+
+def _batches(queryset, chunk_size):
+    batch = []
+    for row in queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_chunks(queryset, output='csv', compress=False, chunk_size=None):
+    """Générateur synchrone des octets de l'export, un lot de lignes à la fois."""
+    chunk_size = chunk_size or settings.STATS_EXPORT_CHUNK_SIZE
+    serialize = _csv_chunks if output == 'csv' else _ndjson_chunks
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    with transaction.atomic(using=queryset.db):
+        for data in serialize(_batches(queryset, chunk_size)):
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+async def aexport_chunks(queryset, output='csv', compress=False, chunk_size=None):
+    """export_chunks pour StreamingHttpResponse sous ASGI."""
+    chunks = export_chunks(queryset, output, compress, chunk_size)
+    # Même fil pour tous les lots : la connexion et le curseur serveur y vivent
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # Client parti : ferme le curseur et la transaction sur leur fil
+        await sync_to_async(chunks.close, thread_sensitive=True)()
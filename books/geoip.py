@@ -0,0 +1,238 @@
+# geoip.py
+"""
+Géolocalisation hors ligne des adresses IP (pays), IPv4 et IPv6.
+
+Une base CSV de plages d'adresses (DB-IP, IP2Location LITE...) est
+convertie une fois (commande build_geoip_db) en un fichier binaire de
+tableaux triés : débuts et fins des plages, indice du pays. Chaque
+processus le projette en mémoire (mmap, pages partagées entre workers) au
+premier appel, puis une recherche est une dichotomie sur ces tableaux :
+quelques microsecondes, sans réseau.
+
+Format du fichier (petit-boutiste) : en-tête, codes pays (2 octets
+chacun), puis débuts / fins IPv4 (uint32), débuts / fins IPv6 (16 octets
+gros-boutistes, comparables comme des bytes), indices pays IPv4 et IPv6
+(uint16).
+"""
+import array
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_right
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'GEOIPDB1'
+# Signature, nombre de plages IPv4, IPv6, nombre de pays (aligné sur 4 octets)
+HEADER = struct.Struct('<8sIIHxx')
+
+# Adresses IPv6 qui portent une IPv4 (::ffff:a.b.c.d)
+IPV4_MAPPED = ipaddress.ip_network('::ffff:0:0/96')
+
+
+class GeoIPError(Exception):
+    """Fichier de géolocalisation absent ou invalide."""
+
+
+class _PackedKeys:
+    """Vue indexable (pour bisect) sur des clés binaires de largeur fixe."""
+
+    def __init__(self, buffer, width):
+        self.buffer = buffer
+        self.width = width
+
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    def __getitem__(self, index):
+        start = index * self.width
+        return bytes(self.buffer[start:start + self.width])
+
+
+def _uint_array(buffer, typecode):
+    if sys.byteorder == 'little':
+        return buffer.cast(typecode)
+    values = array.array(typecode, buffer)
+    values.byteswap()
+    return values
+
+
+class GeoIPDatabase:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise GeoIPError(f"{path}: empty file")
+        view = memoryview(self._mmap)
+        if len(view) < HEADER.size:
+            raise GeoIPError(f"{path}: truncated file")
+        magic, count4, count6, country_count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise GeoIPError(f"{path}: not a GeoIP database (run build_geoip_db)")
+
+        offset = HEADER.size
+        if len(view) < offset + _padded(2 * country_count) + 10 * count4 + 34 * count6:
+            raise GeoIPError(f"{path}: truncated file")
+        codes = bytes(view[offset:offset + 2 * country_count])
+        self.countries = [codes[i:i + 2].decode('ascii') for i in range(0, len(codes), 2)]
+        offset += _padded(2 * country_count)
+
+        def take(size):
+            nonlocal offset
+            chunk = view[offset:offset + size]
+            offset += size
+            return chunk
+
+        self.starts4 = _uint_array(take(4 * count4), 'I')
+        self.ends4 = _uint_array(take(4 * count4), 'I')
+        self.starts6 = _PackedKeys(take(16 * count6), 16)
+        self.ends6 = _PackedKeys(take(16 * count6), 16)
+        self.countries4 = _uint_array(take(2 * count4), 'H')
+        self.countries6 = _uint_array(take(2 * count6), 'H')
+
+    def __len__(self):
+        return len(self.starts4) + len(self.starts6)
+
+    def lookup(self, ip):
+        """Code ISO du pays de l'adresse `ip`, ou None (inconnue ou invalide)."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if address.version == 4:
+            value = int(address)
+            index = bisect_right(self.starts4, value) - 1
+            if index >= 0 and value <= self.ends4[index]:
+                return self.countries[self.countries4[index]]
+            return None
+        key = address.packed
+        index = bisect_right(self.starts6, key) - 1
+        if index >= 0 and key <= self.ends6[index]:
+            return self.countries[self.countries6[index]]
+        return None
+
+
+def _padded(size):
+    return (size + 3) // 4 * 4
+
+
+def _parse_address(value):
+    value = value.strip()
+    if value.isdigit():
+        # Adresses en entiers (IP2Location)
+        number = int(value)
+        return ipaddress.IPv4Address(number) if number <= 0xFFFFFFFF else ipaddress.IPv6Address(number)
+    return ipaddress.ip_address(value)
+
+
+def parse_ranges(rows):
+    """
+    Plages (début, fin, pays) d'un CSV, au choix `début,fin,pays[,...]`
+    (adresses ou entiers) ou `réseau/préfixe,pays[,...]`. Les lignes
+    illisibles (en-têtes...) et les pays inconnus sont ignorés.
+    """
+    for row in rows:
+        try:
+            if '/' in row[0]:
+                network = ipaddress.ip_network(row[0].strip(), strict=False)
+                start, end, country = network[0], network[-1], row[1]
+            else:
+                start, end, country = _parse_address(row[0]), _parse_address(row[1]), row[2]
+        except (IndexError, ValueError):
+            continue
+        country = country.strip().upper()
+        if len(country) != 2 or not country.isalpha() or country == 'ZZ' or start.version != end.version:
+            continue
+        if start.version == 6 and start in IPV4_MAPPED and end in IPV4_MAPPED:
+            # Plages IPv4 des fichiers IPv6 (IP2Location)
+            start, end = start.ipv4_mapped, end.ipv4_mapped
+        yield start, end, country
+
+
+def write_database(ranges, path):
+    """
+    Écrit le fichier binaire (remplacé atomiquement : les processus qui ont
+    l'ancien projeté le gardent jusqu'à leur redémarrage). Les plages qui
+    chevauchent la précédente sont ignorées. Retourne (plages IPv4, IPv6) ;
+    lève GeoIPError si aucune plage n'est utilisable.
+    """
+    countries = {}
+    by_version = {4: [], 6: []}
+    for start, end, country in ranges:
+        index = countries.setdefault(country, len(countries))
+        by_version[start.version].append((int(start), int(end), index))
+
+    sections = {}
+    for version, entries in by_version.items():
+        entries.sort()
+        kept = []
+        for start, end, index in entries:
+            if start > end or (kept and start <= kept[-1][1]):
+                continue
+            kept.append((start, end, index))
+        sections[version] = kept
+
+    ipv4, ipv6 = sections[4], sections[6]
+    if not ipv4 and not ipv6:
+        # Ne remplace pas une base valide par un fichier vide
+        raise GeoIPError("no usable IP range")
+    starts4 = array.array('I', (start for start, _, _ in ipv4))
+    ends4 = array.array('I', (end for _, end, _ in ipv4))
+    countries4 = array.array('H', (index for _, _, index in ipv4))
+    countries6 = array.array('H', (index for _, _, index in ipv6))
+    if sys.byteorder != 'little':
+        for values in (starts4, ends4, countries4, countries6):
+            values.byteswap()
+
+    codes = b''.join(code.encode('ascii') for code in countries)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(ipv4), len(ipv6), len(countries)))
+        f.write(codes.ljust(_padded(len(codes)), b'\0'))
+        f.write(starts4.tobytes())
+        f.write(ends4.tobytes())
+        f.write(b''.join(start.to_bytes(16, 'big') for start, _, _ in ipv6))
+        f.write(b''.join(end.to_bytes(16, 'big') for _, end, _ in ipv6))
+        f.write(countries4.tobytes())
+        f.write(countries6.tobytes())
+    os.replace(tmp_path, path)
+    return len(ipv4), len(ipv6)
+
+
+def build_database(csv_path, path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return write_database(parse_ranges(csv.reader(f)), path)
+
+
+_database = None
+_database_loaded = False
+
+
+def get_database():
+    """Base du processus, ouverte au premier appel ; None si le fichier manque."""
+    global _database, _database_loaded
+    if not _database_loaded:
+        _database_loaded = True
+        try:
+            _database = GeoIPDatabase(settings.GEOIP_DATABASE_PATH)
+            logger.info(f"Base de géolocalisation chargée: {len(_database)} plages")
+        except (OSError, GeoIPError) as e:
+            logger.warning(f"Géolocalisation des IP désactivée: {str(e)}")
+    return _database
+
+
+def country_for_ip(ip):
+    """Code ISO du pays de l'adresse, None si inconnu ou sans base."""
+    database = get_database()
+    return database.lookup(ip) if database is not None else None
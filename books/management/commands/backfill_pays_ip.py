@@ -0,0 +1,49 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from books.geoip import get_database
+from books.models import DownloadStat
+
+
+class Command(BaseCommand):
+    help = "Renseigne pays_ip des téléchargements enregistrés sans pays, par lots, puis recalcule les agrégats horaires."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Lignes lues et mises à jour par lot.")
+        parser.add_argument('--no-rollups', action='store_true', help="Ne recalcule pas les agrégats horaires concernés.")
+
+    def handle(self, *args, **options):
+        database = get_database()
+        if database is None:
+            raise CommandError("Base de géolocalisation introuvable (GEOIP_DATABASE_PATH, commande build_geoip_db).")
+
+        missing = DownloadStat.objects.filter(Q(pays_ip__isnull=True) | Q(pays_ip='')).order_by('pk')
+        last_pk = 0
+        scanned = updated = 0
+        first_day = last_day = None
+        while True:
+            batch = list(missing.filter(pk__gt=last_pk).only('pk', 'adresse_ip', 'horodatage')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            scanned += len(batch)
+            located = []
+            for stat in batch:
+                stat.pays_ip = database.lookup(stat.adresse_ip)
+                if stat.pays_ip:
+                    located.append(stat)
+                    day = stat.horodatage.date()
+                    first_day = day if first_day is None else min(first_day, day)
+                    last_day = day if last_day is None else max(last_day, day)
+            DownloadStat.objects.bulk_update(located, ['pays_ip'])
+            updated += len(located)
+            self.stdout.write(f"{scanned} lignes lues, {updated} localisées")
+
+        if updated and not options['no_rollups']:
+            # Les agrégats par pays de ces jours comptaient ces lignes sans pays
+            call_command(
+                'backfill_stat_rollups', since=f"{first_day:%Y-%m-%d}", until=f"{last_day:%Y-%m-%d}",
+                stdout=self.stdout, stderr=self.stderr,
+            )
+        self.stdout.write(self.style.SUCCESS(f"{updated} téléchargements localisés sur {scanned}."))
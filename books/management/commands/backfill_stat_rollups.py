@@ -0,0 +1,46 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from books.models import DownloadStat
+from books.rollups import day_start, hour_start, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recalcule les agrégats horaires des statistiques depuis DownloadStat (idempotent)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None, help="Premier jour recalculé (AAAA-MM-JJ). Par défaut : le plus ancien téléchargement.")
+        parser.add_argument('--until', default=None, help="Dernier jour recalculé (AAAA-MM-JJ, inclus). Par défaut : jusqu'à l'heure en cours, exclue.")
+        parser.add_argument('--chunk-hours', type=int, default=24, help="Heures recalculées par transaction.")
+
+    def parse_day(self, value):
+        try:
+            return day_start(datetime.datetime.strptime(value, '%Y-%m-%d').date())
+        except ValueError:
+            raise CommandError(f"Date invalide : {value} (format AAAA-MM-JJ).")
+
+    def handle(self, *args, **options):
+        first = DownloadStat.objects.aggregate(first=Min('horodatage'))['first']
+        if first is None:
+            self.stdout.write("Aucun téléchargement enregistré.")
+            return
+        # Pas avant le plus ancien téléchargement : les agrégats des partitions supprimées (rétention) restent
+        start = max(self.parse_day(options['since']), first) if options['since'] else first
+        if options['until']:
+            end = self.parse_day(options['until']) + datetime.timedelta(days=1)
+        else:
+            # L'heure en cours est tenue par les incréments, puis par rebuild-stat-rollups
+            end = hour_start(timezone.now())
+
+        chunk = datetime.timedelta(hours=max(options['chunk_hours'], 1))
+        chunk_start = hour_start(start)
+        total = 0
+        while chunk_start < end:
+            chunk_end = min(chunk_start + chunk, end)
+            total += rebuild_rollups(chunk_start, chunk_end)
+            self.stdout.write(f"{chunk_start:%Y-%m-%d %H:00} → {chunk_end:%Y-%m-%d %H:00}")
+            chunk_start = chunk_end
+        self.stdout.write(self.style.SUCCESS(f"{total} téléchargements agrégés."))
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.geoip import GeoIPError, build_database
+
+
+class Command(BaseCommand):
+    help = "Convertit une base CSV de plages d'IP (IPv4/IPv6 → pays) au format binaire de books/geoip.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="CSV `début,fin,pays` (adresses ou entiers) ou `réseau/préfixe,pays`.")
+        parser.add_argument('--output', default=None, help="Fichier produit. Par défaut : GEOIP_DATABASE_PATH.")
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.GEOIP_DATABASE_PATH
+        try:
+            count4, count6 = build_database(options['csv_path'], output)
+        except (OSError, GeoIPError) as e:
+            raise CommandError(f"{options['csv_path']} : {str(e)}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{output} : {count4} plages IPv4, {count6} plages IPv6. Redémarrez les workers pour le charger."
+        ))
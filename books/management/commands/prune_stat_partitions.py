@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.partitions import (
+    drop_expired_partitions, ensure_partitions, expired_partitions, is_partitioned, retention_cutoff,
+)
+
+
+class Command(BaseCommand):
+    help = "Détache et supprime les partitions de DownloadStat au-delà de la rétention, et crée celles des mois à venir."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-months', type=int, default=None,
+            help="Mois complets gardés avant le mois courant. Par défaut : DOWNLOAD_STATS_RETENTION_MONTHS.",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Liste les partitions concernées sans rien modifier.")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("La table de DownloadStat n'est pas partitionnée (PostgreSQL, migration books 0003).")
+        retention_months = options['retention_months']
+        if retention_months is None:
+            retention_months = settings.DOWNLOAD_STATS_RETENTION_MONTHS
+        if retention_months < 0:
+            raise CommandError("--retention-months doit être positif.")
+
+        if options['dry_run']:
+            expired = expired_partitions(retention_months) if retention_months else []
+            for name in expired:
+                self.stdout.write(f"À supprimer : {name}")
+            if retention_months:
+                self.stdout.write(f"Téléchargements antérieurs au {retention_cutoff(retention_months):%Y-%m-%d} à supprimer.")
+            return
+
+        created = ensure_partitions()
+        dropped = drop_expired_partitions(retention_months)
+        for name in created:
+            self.stdout.write(f"Créée : {name}")
+        for name in dropped:
+            self.stdout.write(f"Supprimée : {name}")
+        if not retention_months:
+            self.stdout.write("Rétention désactivée (0) : aucune partition supprimée.")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions créées, {len(dropped)} supprimées."))
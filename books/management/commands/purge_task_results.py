@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from books.task_results import purge_stored_results, result_retention
+
+
+class Command(BaseCommand):
+    help = "Purge par lots les résultats expirés de django_celery_results, puis compacte la table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=None,
+            help="Âge minimal (secondes) des résultats supprimés. Par défaut : rétention du mode TASK_RESULT_STORE.",
+        )
+        parser.add_argument('--batch-size', type=int, default=None, help="Lignes supprimées par requête.")
+        parser.add_argument('--vacuum', action='store_true', help="VACUUM ANALYZE de la table (PostgreSQL).")
+
+    def handle(self, *args, **options):
+        max_age = options['older_than'] if options['older_than'] is not None else result_retention()
+        deleted = purge_stored_results(max_age, options['batch_size'], vacuum=options['vacuum'])
+        self.stdout.write(self.style.SUCCESS(f"{deleted} résultats de plus de {max_age} secondes supprimés."))
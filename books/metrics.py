@@ -0,0 +1,171 @@
+# metrics.py
+"""
+Métriques Prometheus propres à l'application, exposées sur /metrics
+par django_prometheus (registre par défaut).
+
+Les métriques du proxy de téléchargement couvrent le flux lui-même, que
+django_prometheus ne voit pas : il mesure la vue jusqu'au retour de la
+StreamingHttpResponse, avant le premier octet relayé.
+"""
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge, Histogram
+from django.core.cache import cache
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, SummaryMetricFamily
+
+from .circuit_breaker import CircuitBreaker, STATE_VALUES
+from .stat_buffer import DROPPED_KEY, FLUSH_MICROSECONDS_KEY, FLUSHES_KEY, WRITTEN_KEY
+from .utils import detect_platform
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreakerCollector:
+    """
+    Lit l'état des disjoncteurs dans le cache partagé à chaque scrape,
+    pour refléter l'état commun à tous les workers.
+    """
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            'downloader_circuit_breaker_state',
+            "État du disjoncteur par plateforme (0 = fermé, 1 = semi-ouvert, 2 = ouvert)",
+            labels=['platform'],
+        )
+        for platform in settings.PLATFORM_QUEUES:
+            try:
+                gauge.add_metric([platform], STATE_VALUES[CircuitBreaker(platform).state()])
+            except Exception as e:
+                logger.warning(f"État du disjoncteur {platform} illisible: {str(e)}")
+        yield gauge
+
+
+class StatBufferCollector:
+    """
+    Écritures différées des statistiques (books/stat_buffer.py) : comptées
+    par les workers Celery dans le cache partagé, lues à chaque scrape.
+    rate(..._records_total) donne le débit d'ingestion, rate(_sum) / rate(_count)
+    la durée moyenne d'une écriture.
+    """
+
+    def collect(self):
+        try:
+            values = cache.get_many([WRITTEN_KEY, DROPPED_KEY, FLUSHES_KEY, FLUSH_MICROSECONDS_KEY])
+        except Exception as e:
+            logger.warning(f"Compteurs du tampon des statistiques illisibles: {str(e)}")
+            return
+        records = CounterMetricFamily(
+            'downloader_stat_buffer_records',
+            "Statistiques de téléchargement écrites par lots, ou abandonnées (base indisponible)",
+            labels=['outcome'],
+        )
+        records.add_metric(['written'], values.get(WRITTEN_KEY, 0))
+        records.add_metric(['dropped'], values.get(DROPPED_KEY, 0))
+        yield records
+        yield SummaryMetricFamily(
+            'downloader_stat_buffer_flush_seconds',
+            "Durée des écritures groupées (bulk_create) des statistiques",
+            count_value=values.get(FLUSHES_KEY, 0),
+            sum_value=values.get(FLUSH_MICROSECONDS_KEY, 0) / 1_000_000,
+        )
+
+
+# --- Proxy de téléchargement ---
+
+# Hôtes des CDN des plateformes (les URLs directes ne portent pas le domaine de la vidéo)
+CDN_PLATFORMS = (
+    ('googlevideo.com', 'YouTube'),
+    ('cdninstagram.com', 'Instagram'),
+    ('fbcdn.net', 'Facebook'),
+    ('tiktokcdn.com', 'TikTok'),
+    ('tiktokcdn-us.com', 'TikTok'),
+    ('tiktokv.com', 'TikTok'),
+    ('twimg.com', 'Twitter'),
+)
+
+PROXY_UPSTREAM_TTFB = Histogram(
+    'downloader_proxy_upstream_ttfb_seconds',
+    "Délai entre l'envoi de la requête à la source et la réception de ses en-têtes",
+    ['platform'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+PROXY_UPSTREAM_ERRORS = Counter(
+    'downloader_proxy_upstream_errors_total',
+    "Erreurs de la source : code HTTP, 'network' (injoignable), 'interrupted' (coupure en cours de flux) ou 'segment' (segment Range refusé)",
+    ['platform', 'code'],
+)
+PROXY_BYTES = Counter(
+    'downloader_proxy_bytes_total',
+    "Octets envoyés aux clients par le proxy",
+    ['platform', 'source'],
+)
+PROXY_ACTIVE_STREAMS = Gauge(
+    'downloader_proxy_active_streams',
+    "Flux en cours d'envoi par ce processus",
+    ['source'],
+)
+PROXY_STREAM_DURATION = Histogram(
+    'downloader_proxy_stream_duration_seconds',
+    "Durée des flux, du premier au dernier octet",
+    ['platform', 'outcome'],
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+PROXY_STREAM_THROUGHPUT = Histogram(
+    'downloader_proxy_stream_throughput_bytes_per_second',
+    "Débit moyen des flux terminés",
+    ['platform'],
+    buckets=tuple(2 ** n * 1024 for n in range(6, 18)),  # 64 Kio/s à 128 Mio/s
+)
+PROXY_CLIENT_ABORTS = Counter(
+    'downloader_proxy_client_aborts_total',
+    "Flux interrompus par la déconnexion du client",
+    ['platform', 'source'],
+)
+
+
+def proxy_platform(direct_url, video_url=None):
+    """Plateforme d'un flux relayé, d'après l'URL de la vidéo si connue, sinon l'hôte du CDN."""
+    if video_url:
+        return detect_platform(video_url)
+    host = (urlsplit(direct_url or '').hostname or '').lower()
+    if host.startswith('instagram.'):
+        return 'Instagram'  # instagram.fxxx-1.fna.fbcdn.net
+    for suffix, platform in CDN_PLATFORMS:
+        if host == suffix or host.endswith(f".{suffix}"):
+            return platform
+    return detect_platform(host)
+
+
+async def instrumented(chunks, platform, source):
+    """
+    Relaie un corps de réponse en mesurant octets, durée, débit et
+    déconnexions du client (fermeture ou annulation avant la fin).
+    """
+    active = PROXY_ACTIVE_STREAMS.labels(source)
+    bytes_sent = PROXY_BYTES.labels(platform, source)
+    active.inc()
+    started = time.monotonic()
+    sent = 0
+    outcome = 'error'
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                sent += len(chunk)
+                bytes_sent.inc(len(chunk))
+                yield chunk
+        outcome = 'completed'
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = 'aborted'
+        PROXY_CLIENT_ABORTS.labels(platform, source).inc()
+        raise
+    finally:
+        active.dec()
+        duration = time.monotonic() - started
+        PROXY_STREAM_DURATION.labels(platform, outcome).observe(duration)
+        if outcome == 'completed' and duration > 0:
+            PROXY_STREAM_THROUGHPUT.labels(platform).observe(sent / duration)
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Book',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('author', models.CharField(max_length=200)),
+                ('published_year', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DownloadOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_url', models.URLField()),
+                ('ip_address', models.GenericIPAddressField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DownloadStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_telechargement', models.URLField(help_text="L'URL de la vidéo Facebook téléchargée.", max_length=500, verbose_name='URL de Téléchargement')),
+                ('adresse_ip', models.GenericIPAddressField(help_text="L'adresse IP de l'utilisateur qui a initié le téléchargement.", verbose_name='Adresse IP')),
+                ('horodatage', models.DateTimeField(default=django.utils.timezone.now, help_text='Date et heure du téléchargement.', verbose_name='Horodatage')),
+                ('statut_telechargement', models.BooleanField(default=False, help_text='Indique si le téléchargement a réussi (True) ou échoué (False).', verbose_name='Statut du Téléchargement')),
+                ('message_erreur', models.TextField(blank=True, help_text="Description de l'erreur en cas d'échec du téléchargement.", null=True, verbose_name="Message d'Erreur")),
+                ('agent_utilisateur', models.TextField(blank=True, help_text="Chaîne User-Agent du navigateur de l'utilisateur.", verbose_name='Agent Utilisateur')),
+                ('referer', models.URLField(blank=True, help_text="L'URL de la page référente.", max_length=500, null=True, verbose_name='Référent')),
+                ('duree_video', models.IntegerField(blank=True, help_text='La durée de la vidéo téléchargée en secondes.', null=True, verbose_name='Durée de la Vidéo (secondes)')),
+                ('qualite_video', models.CharField(blank=True, help_text='La qualité de la vidéo téléchargée (ex: 720p, 1080p).', max_length=50, null=True, verbose_name='Qualité Vidéo')),
+                ('taille_fichier', models.BigIntegerField(blank=True, help_text='La taille du fichier téléchargé en octets.', null=True, verbose_name='Taille du Fichier (octets)')),
+                ('origine_video', models.CharField(blank=True, help_text="Origine de la vidéo (ex: 'Facebook', 'YouTube').", max_length=50, null=True, verbose_name='Origine de la Vidéo')),
+                ('direct_url', models.URLField(blank=True, help_text="L'URL directe du fichier vidéo téléchargé.", max_length=2000, null=True, verbose_name='URL Directe')),
+                ('pays_ip', models.CharField(blank=True, help_text="Le pays d'origine de l'adresse IP (nécessite une géolocalisation).", max_length=100, null=True, verbose_name="Pays de l'IP")),
+            ],
+            options={
+                'verbose_name': 'Statistique de Téléchargement',
+                'verbose_name_plural': 'Statistiques de Téléchargement',
+                'ordering': ['-horodatage'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadStatHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('heure', models.DateTimeField(help_text="Début de l'heure agrégée (UTC).", verbose_name='Heure')),
+                ('origine_video', models.CharField(blank=True, default='', max_length=50, verbose_name='Origine de la Vidéo')),
+                ('qualite_video', models.CharField(blank=True, default='', max_length=50, verbose_name='Qualité Vidéo')),
+                ('pays_ip', models.CharField(blank=True, default='', max_length=100, verbose_name="Pays de l'IP")),
+                ('statut_telechargement', models.BooleanField(verbose_name='Statut du Téléchargement')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Nombre de Téléchargements')),
+            ],
+            options={
+                'verbose_name': 'Statistique Horaire de Téléchargement',
+                'verbose_name_plural': 'Statistiques Horaires de Téléchargement',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='downloadstathourly',
+            constraint=models.UniqueConstraint(fields=('heure', 'origine_video', 'qualite_video', 'pays_ip', 'statut_telechargement'), name='downloadstathourly_unique_key'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+"""
+Partitionne books_downloadstat par mois sur `horodatage` (PostgreSQL
+uniquement, voir books/partitions.py).
+
+La table existante est recopiée dans une table partitionnée de même
+schéma. La clé primaire devient (id, horodatage), la colonne de partition
+devant en faire partie ; id reste unique par sa séquence et reste la clé
+primaire côté Django. Index : BRIN sur horodatage (parcours de plages des
+statistiques, presque gratuit à l'insertion) et B-tree partiels sur
+horodatage par statut (listes récentes des réussites ou des échecs).
+"""
+import datetime
+
+from django.db import migrations
+
+TABLE = 'books_downloadstat'
+LEGACY = 'books_downloadstat_legacy'
+# Mois créés d'avance ; ensuite tenus par la tâche maintain_stat_partitions
+PARTITIONS_AHEAD = 3
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition(cursor):
+    cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+    cursor.execute(
+        f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE (horodatage)'
+    )
+    cursor.execute(f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+
+    cursor.execute(f'SELECT min(horodatage) FROM "{LEGACY}"')
+    first = cursor.fetchone()[0] or datetime.datetime.now(datetime.timezone.utc)
+    month = first.astimezone(datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    last = add_months(now.replace(day=1, hour=0, minute=0, second=0, microsecond=0), PARTITIONS_AHEAD)
+    while month <= last:
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}_p{month.year:04d}_{month.month:02d}" PARTITION OF "{TABLE}" '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [month, add_months(month, 1)],
+        )
+        month = add_months(month, 1)
+
+    cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{LEGACY}"')
+    # Supprime aussi l'ancienne séquence d'identité et l'index de clé primaire
+    cursor.execute(f'DROP TABLE "{LEGACY}"')
+
+    cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, horodatage)')
+    cursor.execute(f'CREATE SEQUENCE "{TABLE}_id_seq" OWNED BY "{TABLE}".id')
+    cursor.execute(f"SELECT setval('\"{TABLE}_id_seq\"', coalesce(max(id), 0) + 1, false) FROM \"{TABLE}\"")
+    cursor.execute(f"ALTER TABLE \"{TABLE}\" ALTER COLUMN id SET DEFAULT nextval('\"{TABLE}_id_seq\"')")
+
+    cursor.execute(f'CREATE INDEX "{TABLE}_horodatage_brin" ON "{TABLE}" USING brin (horodatage)')
+    cursor.execute(
+        f'CREATE INDEX "{TABLE}_succes_horodatage" ON "{TABLE}" (horodatage DESC) WHERE statut_telechargement'
+    )
+    cursor.execute(
+        f'CREATE INDEX "{TABLE}_echec_horodatage" ON "{TABLE}" (horodatage DESC) WHERE NOT statut_telechargement'
+    )
+
+
+def forwards(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        partition(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_downloadstathourly'),
+    ]
+
+    operations = [
+        # Irréversible en pratique : la table partitionnée garde le même schéma pour Django
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
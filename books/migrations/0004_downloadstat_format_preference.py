@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_partition_downloadstat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadstat',
+            name='format_preference',
+            field=models.CharField(blank=True, help_text="Le format demandé par l'utilisateur (ex: 720p, best, ou un format yt-dlp), réutilisé pour rafraîchir l'URL directe.", max_length=255, null=True, verbose_name='Format Demandé'),
+        ),
+    ]
@@ -72,6 +72,13 @@ class DownloadStat(models.Model):
         verbose_name="Qualité Vidéo",
         help_text="La qualité de la vidéo téléchargée (ex: 720p, 1080p)."
     )
+    format_preference = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        verbose_name="Format Demandé",
+        help_text="Le format demandé par l'utilisateur (ex: 720p, best, ou un format yt-dlp), réutilisé pour rafraîchir l'URL directe."
+    )
     taille_fichier = models.BigIntegerField(
         blank=True,
         null=True,
@@ -107,3 +114,35 @@ class DownloadStat(models.Model):
 
     def __str__(self):
         return f"Téléchargement de {self.url_telechargement[:50]} par {self.adresse_ip} le {self.horodatage.strftime('%Y-%m-%d %H:%M')}"
+
+
+class DownloadStatHourly(models.Model):
+    """
+    Agrégat horaire de DownloadStat (voir books/rollups.py), lu par les
+    endpoints de statistiques à la place de la table brute.
+    """
+    heure = models.DateTimeField(
+        verbose_name="Heure",
+        help_text="Début de l'heure agrégée (UTC)."
+    )
+    origine_video = models.CharField(max_length=50, blank=True, default='', verbose_name="Origine de la Vidéo")
+    qualite_video = models.CharField(max_length=50, blank=True, default='', verbose_name="Qualité Vidéo")
+    pays_ip = models.CharField(max_length=100, blank=True, default='', verbose_name="Pays de l'IP")
+    statut_telechargement = models.BooleanField(verbose_name="Statut du Téléchargement")
+    total = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Nombre de Téléchargements"
+    )
+
+    class Meta:
+        verbose_name = "Statistique Horaire de Téléchargement"
+        verbose_name_plural = "Statistiques Horaires de Téléchargement"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['heure', 'origine_video', 'qualite_video', 'pays_ip', 'statut_telechargement'],
+                name='downloadstathourly_unique_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.heure.strftime('%Y-%m-%d %H:00')} {self.origine_video} {self.qualite_video} {self.pays_ip}: {self.total}"
@@ -0,0 +1,147 @@
+# mux.py
+"""
+Fusion à la volée des flux vidéo et audio séparés (formats DASH 'bestvideo+bestaudio').
+
+Les deux URLs directes sont téléchargées en parallèle par le client httpx
+partagé et écrites dans deux pipes lus par un processus ffmpeg (`pipe:N`,
+descripteurs transmis par pass_fds). ffmpeg recopie les pistes sans
+réencodage (-c copy) dans un MP4 fragmenté écrit sur sa sortie standard,
+relayée au client au fil de l'eau. Rien n'est écrit sur disque ; la mémoire
+par flux est bornée par les tampons des pipes et un bloc par source.
+
+Les sources doivent être lisibles séquentiellement (MP4 fragmenté ou WebM,
+cas des formats DASH des plateformes) : un pipe ne permet pas de seek.
+"""
+import asyncio
+import logging
+import os
+from contextlib import aclosing
+
+import httpx
+from django.conf import settings
+
+from .proxy import iter_upstream, open_upstream
+
+logger = logging.getLogger(__name__)
+
+
+class MuxError(Exception):
+    """ffmpeg est indisponible ou a échoué."""
+
+
+async def _open_pipe_writer(fd):
+    loop = asyncio.get_running_loop()
+    pipe = os.fdopen(fd, 'wb', buffering=0)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, pipe)
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+class StreamMuxer:
+    """
+    Usage :
+        muxer = StreamMuxer(video_url, audio_url)
+        await muxer.start()  # UpstreamError / MuxError avant tout envoi
+        StreamingHttpResponse(muxer.iter_output())
+    """
+
+    def __init__(self, video_url, audio_url):
+        self.urls = (video_url, audio_url)
+        self.process = None
+        self.stderr_tail = None
+        self.feeders = []
+        self.feed_errors = []
+
+    async def start(self):
+        upstreams = await asyncio.gather(*(open_upstream(url) for url in self.urls), return_exceptions=True)
+        failures = [u for u in upstreams if isinstance(u, BaseException)]
+        if failures:
+            for upstream in upstreams:
+                if not isinstance(upstream, BaseException):
+                    await upstream.aclose()
+            raise failures[0]
+
+        pipes = [os.pipe() for _ in upstreams]
+        read_fds = [read_fd for read_fd, _ in pipes]
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                settings.FFMPEG_BINARY, '-hide_banner', '-nostats', '-loglevel', 'error',
+                '-i', f"pipe:{read_fds[0]}", '-i', f"pipe:{read_fds[1]}",
+                '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+                # MP4 fragmenté : l'index (moov) en tête, lisible sans seek
+                '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+                '-f', 'mp4', 'pipe:1',
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                pass_fds=read_fds,
+            )
+        except OSError as e:
+            for _, write_fd in pipes:
+                os.close(write_fd)
+            for upstream in upstreams:
+                await upstream.aclose()
+            logger.error(f"ffmpeg introuvable ou non exécutable: {str(e)}")
+            raise MuxError(str(e)) from e
+        finally:
+            # Les extrémités de lecture appartiennent désormais à ffmpeg
+            for read_fd in read_fds:
+                os.close(read_fd)
+
+        self.stderr_tail = asyncio.ensure_future(self._read_stderr())
+        self.feeders = [
+            asyncio.ensure_future(self._feed(upstream, write_fd))
+            for upstream, (_, write_fd) in zip(upstreams, pipes)
+        ]
+
+    async def _feed(self, upstream, write_fd):
+        writer = await _open_pipe_writer(write_fd)
+        try:
+            async with aclosing(iter_upstream(upstream)) as chunks:
+                async for chunk in chunks:
+                    writer.write(chunk)
+                    # Attend que ffmpeg ait lu : c'est ce qui borne la mémoire
+                    await writer.drain()
+        except httpx.HTTPError as e:
+            # Source coupée : ffmpeg verra une fin de fichier prématurée
+            self.feed_errors.append(e)
+        except OSError:
+            pass  # ffmpeg a fermé le pipe (erreur signalée par son code de sortie)
+        finally:
+            writer.close()
+
+    async def _read_stderr(self):
+        """Vide stderr en continu (un pipe plein bloquerait ffmpeg) et garde la fin."""
+        tail = b''
+        while True:
+            data = await self.process.stderr.read(4096)
+            if not data:
+                return tail.decode(errors='replace')
+            tail = (tail + data)[-2000:]
+
+    async def iter_output(self, chunk_size=None):
+        chunk_size = chunk_size or settings.PROXY_CHUNK_SIZE
+        try:
+            while True:
+                chunk = await self.process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            returncode = await self.process.wait()
+            if returncode != 0:
+                logger.error(f"Fusion ffmpeg échouée ({returncode}): {await self.stderr_tail}")
+                # Interrompt la réponse (pas de Content-Length) : le client voit un flux incomplet
+                raise MuxError(f"ffmpeg exited with status {returncode}")
+            if self.feed_errors:
+                logger.warning(f"Source interrompue pendant la fusion: {self.feed_errors[0]}")
+                raise MuxError("Upstream stream interrupted during mux")
+        finally:
+            await self.close()
+
+    async def close(self):
+        tasks = self.feeders + ([self.stderr_tail] if self.stderr_tail else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
@@ -0,0 +1,184 @@
+# partitions.py
+"""
+Partitions mensuelles de la table de DownloadStat (PostgreSQL).
+
+La migration 0003 partitionne la table par plage sur `horodatage` : un mois
+UTC par partition (books_downloadstat_pAAAA_MM), plus une partition par
+défaut qui reçoit les lignes d'un mois pas encore créé. Les requêtes
+filtrées par date ne lisent que les partitions concernées, et supprimer un
+mois ancien revient à détacher puis supprimer sa partition, sans DELETE.
+
+ensure_partitions crée d'avance les mois à venir (tâche périodique
+maintain_stat_partitions) ; drop_expired_partitions applique la rétention
+(même tâche, et commande prune_stat_partitions). Les agrégats horaires
+(books/rollups.py) ne sont pas touchés : l'historique des statistiques
+survit aux partitions supprimées.
+
+ATTACH, DETACH et DROP prennent des verrous forts : s'ils attendaient
+derrière une longue transaction (un export), les INSERT feraient la queue
+derrière eux. Ils ne patientent donc que DOWNLOAD_STATS_PARTITION_LOCK_TIMEOUT
+millisecondes (lock_timeout) ; au-delà, l'opération est abandonnée et
+reprise à la prochaine exécution quotidienne.
+
+Sur une autre base (SQLite en développement), la table n'est pas
+partitionnée et ces fonctions ne font rien.
+"""
+import datetime
+import logging
+import re
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from .models import DownloadStat
+
+logger = logging.getLogger(__name__)
+
+TABLE = DownloadStat._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+# SQLSTATE lock_not_available (lock_timeout dépassé)
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def month_start(moment):
+    """Premier jour (UTC) du mois qui contient `moment`."""
+    moment = moment.astimezone(datetime.timezone.utc)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions():
+    """{mois: nom} des partitions mensuelles existantes."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=datetime.timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def _set_lock_timeout(cursor):
+    """Limite l'attente des verrous pour la transaction en cours (SET LOCAL)."""
+    cursor.execute(
+        "SELECT set_config('lock_timeout', %s, true)", [f"{settings.DOWNLOAD_STATS_PARTITION_LOCK_TIMEOUT}ms"]
+    )
+
+
+def _lock_timed_out(error):
+    return getattr(error.__cause__, 'pgcode', None) == LOCK_NOT_AVAILABLE
+
+
+def create_partition(month):
+    """
+    Crée la partition du mois. Les lignes du mois déjà tombées dans la
+    partition par défaut y sont déplacées avant l'attachement (sinon
+    PostgreSQL le refuse). Retourne None si un verrou n'a pu être obtenu à
+    temps (la partition sera créée à la prochaine exécution).
+    """
+    name = partition_name(month)
+    bounds = [month, add_months(month, 1)]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            _set_lock_timeout(cursor)
+            cursor.execute(f'CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE horodatage >= %s AND horodatage < %s RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved',
+                bounds,
+            )
+            if cursor.rowcount:
+                logger.warning(f"{cursor.rowcount} lignes déplacées de {DEFAULT_PARTITION} vers {name}")
+            # Les index de la table parente sont créés sur la partition à l'attachement
+            cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)', bounds)
+    except OperationalError as e:
+        if not _lock_timed_out(e):
+            raise
+        logger.warning(f"Partition {name} non créée, verrou indisponible ; reprise à la prochaine exécution")
+        return None
+    logger.info(f"Partition {name} créée")
+    return name
+
+
+def ensure_partitions(ahead=None):
+    """Crée les partitions du mois courant et des `ahead` mois suivants. Retourne les noms créés."""
+    if not is_partitioned():
+        return []
+    ahead = settings.DOWNLOAD_STATS_PARTITIONS_AHEAD if ahead is None else ahead
+    existing = list_partitions()
+    current = month_start(timezone.now())
+    created = []
+    for offset in range(ahead + 1):
+        month = add_months(current, offset)
+        if month in existing:
+            continue
+        name = create_partition(month)
+        if name:
+            created.append(name)
+    return created
+
+
+def retention_cutoff(retention_months):
+    """Premier mois conservé : les mois entièrement antérieurs sont supprimés."""
+    return add_months(month_start(timezone.now()), -retention_months)
+
+
+def expired_partitions(retention_months):
+    cutoff = retention_cutoff(retention_months)
+    return sorted(name for month, name in list_partitions().items() if month < cutoff)
+
+
+def drop_expired_partitions(retention_months=None):
+    """
+    Détache puis supprime les partitions antérieures à la fenêtre de
+    rétention (en mois, 0 = tout garder), et purge la partition par défaut
+    des mêmes dates. Retourne les noms des partitions supprimées ; celles
+    dont le verrou n'a pu être obtenu à temps le seront à la prochaine exécution.
+    """
+    retention_months = settings.DOWNLOAD_STATS_RETENTION_MONTHS if retention_months is None else retention_months
+    if not retention_months or not is_partitioned():
+        return []
+    dropped = []
+    for name in expired_partitions(retention_months):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                _set_lock_timeout(cursor)
+                cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+                cursor.execute(f'DROP TABLE "{name}"')
+        except OperationalError as e:
+            if not _lock_timed_out(e):
+                raise
+            logger.warning(f"Partition {name} non supprimée, verrou indisponible ; reprise à la prochaine exécution")
+            continue
+        logger.info(f"Partition {name} supprimée (rétention de {retention_months} mois)")
+        dropped.append(name)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE horodatage < %s', [retention_cutoff(retention_months)])
+    return dropped
@@ -0,0 +1,303 @@
+# proxy.py
+"""
+Client HTTP asynchrone partagé pour le proxy de téléchargement.
+
+Un seul httpx.AsyncClient par processus web (et par boucle d'événements) :
+les connexions vers les CDN des plateformes sont gardées en keep-alive et
+réutilisées d'un téléchargement à l'autre, dans la limite de
+PROXY_MAX_CONNECTIONS connexions simultanées.
+
+En mode PROXY_MODE='nginx', la vue ne relaie plus les octets : elle répond
+par un X-Accel-Redirect vers une location interne de nginx, qui télécharge
+la source lui-même (voir deploy/nginx/proxy-download.conf.example).
+
+Les URLs à relayer viennent du client : leur hôte est résolu et refusé s'il
+pointe vers une adresse privée, de bouclage ou lien-local, avant de confier
+l'URL à nginx ou à httpx (et à chaque redirection suivie par httpx), pour
+que le proxy ne serve pas de rebond vers le réseau interne.
+"""
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+
+from .metrics import PROXY_UPSTREAM_ERRORS, PROXY_UPSTREAM_TTFB, proxy_platform
+
+logger = logging.getLogger(__name__)
+
+# En-têtes de la requête client relayés à la source (reprise, lecture par segments)
+FORWARDED_REQUEST_HEADERS = {
+    'HTTP_RANGE': 'Range',
+    'HTTP_IF_RANGE': 'If-Range',
+}
+# En-têtes de la source recopiés sur la réponse au client
+FORWARDED_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+_client = None
+_client_loop = None
+
+
+class UpstreamError(Exception):
+    """La source (CDN) est injoignable ou a refusé la requête."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_http_client():
+    """Client partagé, recréé si la boucle d'événements a changé."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.PROXY_READ_TIMEOUT,
+                connect=settings.PROXY_CONNECT_TIMEOUT,
+                pool=settings.PROXY_POOL_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.PROXY_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.PROXY_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            follow_redirects=True,
+            event_hooks={'response': [_refuse_internal_redirect]},
+        )
+        _client_loop = loop
+    return _client
+
+
+def _is_internal_address(address):
+    ip = ipaddress.ip_address(address)
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast
+            or ip.is_reserved or ip.is_unspecified)
+
+
+async def _resolve_host(host):
+    """Adresses IP de `host`, résolues sans bloquer la boucle d'événements."""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+async def is_proxiable_url(url):
+    """
+    Seules les URLs http(s) absolues vers des adresses publiques sont relayées
+    (par httpx ou par nginx) : toutes les adresses de l'hôte doivent l'être.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return False
+    try:
+        addresses = await _resolve_host(parts.hostname)
+    except (OSError, UnicodeError):
+        return False
+    return bool(addresses) and not any(_is_internal_address(address) for address in addresses)
+
+
+async def _refuse_internal_redirect(response):
+    """Une redirection de la source ne doit pas mener au réseau interne."""
+    if response.has_redirect_location:
+        target = response.request.url.join(response.headers['location'])
+        if not await is_proxiable_url(str(target)):
+            raise httpx.RequestError(
+                f"Redirect to a non-public address refused: {target.host}", request=response.request
+            )
+
+
+def accel_redirect_headers(url):
+    """
+    En-têtes confiant le téléchargement de `url` à nginx : la location interne
+    lit la cible dans X-Proxy-Target (jamais renvoyé au client).
+    """
+    return {
+        'X-Accel-Redirect': settings.PROXY_ACCEL_LOCATION,
+        'X-Proxy-Target': url,
+    }
+
+
+def forwarded_request_headers(meta):
+    """En-têtes Range / If-Range de la requête Django (request.META) à relayer."""
+    return {name: meta[key] for key, name in FORWARDED_REQUEST_HEADERS.items() if meta.get(key)}
+
+
+def copy_response_headers(upstream, response):
+    """Recopie la taille, la plage et les validateurs de la source sur la réponse."""
+    for name in FORWARDED_RESPONSE_HEADERS:
+        if name in upstream.headers:
+            response[name] = upstream.headers[name]
+    # Corps recompressé par la source malgré identity : la taille ne correspond plus
+    if 'content-encoding' in upstream.headers and response.has_header('Content-Length'):
+        del response['Content-Length']
+    if upstream.status_code == 206 and not response.has_header('Accept-Ranges'):
+        response['Accept-Ranges'] = 'bytes'
+
+
+async def open_upstream(url, headers=None, method='GET'):
+    """
+    Ouvre la réponse de la source en streaming (corps non lu).
+    Lève UpstreamError si la source est injoignable ou répond en erreur ;
+    un 416 (plage hors du fichier) est rendu tel quel pour être relayé.
+    """
+    client = get_http_client()
+    platform = proxy_platform(url)
+    # Pas de compression : le corps est relayé tel quel, Content-Length compris
+    request_headers = {'Accept-Encoding': 'identity', **(headers or {})}
+    started = time.monotonic()
+    try:
+        upstream = await client.send(client.build_request(method, url, headers=request_headers), stream=True)
+        # Les URLs signées des CDN le sont souvent pour GET seulement : on relit
+        # alors les en-têtes d'un GET dont le corps n'est pas lu.
+        if method == 'HEAD' and upstream.status_code in (403, 405):
+            await upstream.aclose()
+            upstream = await client.send(client.build_request('GET', url, headers=request_headers), stream=True)
+    except httpx.HTTPError as e:
+        logger.warning(f"Source injoignable pour le proxy: {str(e)}")
+        PROXY_UPSTREAM_ERRORS.labels(platform, 'network').inc()
+        raise UpstreamError(str(e)) from e
+
+    PROXY_UPSTREAM_TTFB.labels(platform).observe(time.monotonic() - started)
+    if upstream.status_code >= 400 and upstream.status_code != 416:
+        PROXY_UPSTREAM_ERRORS.labels(platform, str(upstream.status_code)).inc()
+        await upstream.aclose()
+        raise UpstreamError(f"Upstream responded with HTTP {upstream.status_code}", upstream.status_code)
+    return upstream
+
+
+async def iter_upstream(upstream, chunk_size=None):
+    """
+    Relaie le corps de la source par blocs de PROXY_CHUNK_SIZE octets.
+    La connexion est rendue au pool (ou fermée) dès que l'itération s'arrête,
+    y compris quand le client se déconnecte et que la tâche est annulée.
+    """
+    try:
+        async for chunk in upstream.aiter_bytes(chunk_size or settings.PROXY_CHUNK_SIZE):
+            yield chunk
+    except httpx.HTTPError as e:
+        # Les en-têtes sont déjà partis : on ne peut qu'interrompre la réponse
+        logger.warning(f"Flux source interrompu: {str(e)}")
+        PROXY_UPSTREAM_ERRORS.labels(proxy_platform(str(upstream.url)), 'interrupted').inc()
+        raise
+    finally:
+        await upstream.aclose()
+
+
+async def iter_from_offset(url, offset, chunk_size=None):
+    """
+    Relaie la source à partir de l'octet `offset` (reprise après une coupure).
+    Si la source ignore Range et renvoie tout le fichier, le début est sauté.
+    """
+    upstream = await open_upstream(url, {'Range': f"bytes={offset}-"} if offset else None)
+    skip = offset if upstream.status_code == 200 else 0
+    async for chunk in iter_upstream(upstream, chunk_size):
+        if skip:
+            if len(chunk) <= skip:
+                skip -= len(chunk)
+                continue
+            chunk = chunk[skip:]
+            skip = 0
+        yield chunk
+
+
+class SegmentError(Exception):
+    """Un segment n'a pas été servi comme demandé (Range ignoré, source en erreur)."""
+
+
+def supports_segmented_fetch(upstream):
+    """
+    Le téléchargement par segments parallèles ne vaut que pour les gros
+    fichiers complets, non compressés, d'une source qui annonce les Range.
+    """
+    length = upstream.headers.get('content-length', '')
+    return (
+        settings.PROXY_SEGMENT_PARALLELISM > 1
+        and upstream.status_code == 200
+        and upstream.headers.get('accept-ranges', '').lower() == 'bytes'
+        and 'content-encoding' not in upstream.headers
+        and length.isdigit()
+        and int(length) >= settings.PROXY_SEGMENT_MIN_SIZE
+    )
+
+
+async def _fetch_segment(url, start, end):
+    client = get_http_client()
+    request = client.build_request(
+        'GET', url, headers={'Accept-Encoding': 'identity', 'Range': f"bytes={start}-{end}"}
+    )
+    response = await client.send(request, stream=True)
+    try:
+        # Un 200 serait le fichier entier : on ne le lit pas
+        if response.status_code != 206 or not response.headers.get('content-range', '').startswith(f"bytes {start}-"):
+            raise SegmentError(f"Segment {start}-{end}: HTTP {response.status_code}")
+        data = await response.aread()
+    finally:
+        await response.aclose()
+    if len(data) != end - start + 1:
+        raise SegmentError(f"Segment {start}-{end}: {len(data)} bytes received")
+    return data
+
+
+async def iter_segmented(url, upstream, chunk_size=None):
+    """
+    Télécharge le fichier en segments de PROXY_SEGMENT_SIZE octets, dont
+    PROXY_SEGMENT_PARALLELISM en parallèle (une connexion du pool chacun),
+    et les relaie dans l'ordre. Au plus PROXY_SEGMENT_WINDOW segments sont
+    en mémoire en avance sur le client (tampon de réordonnancement borné).
+
+    `upstream` est la réponse déjà ouverte sur le fichier entier : elle sert
+    le premier segment. Si un segment échoue, la suite est relayée en un
+    seul flux depuis le premier octet non envoyé.
+    """
+    chunk_size = chunk_size or settings.PROXY_CHUNK_SIZE
+    size = int(upstream.headers['content-length'])
+    segment_size = settings.PROXY_SEGMENT_SIZE
+    count = -(-size // segment_size)
+    window = max(settings.PROXY_SEGMENT_WINDOW, settings.PROXY_SEGMENT_PARALLELISM)
+    slots = asyncio.Semaphore(settings.PROXY_SEGMENT_PARALLELISM)
+
+    async def fetch(index):
+        start = index * segment_size
+        end = min(size, start + segment_size) - 1
+        async with slots:
+            if index == 0:
+                data = bytearray()
+                async for chunk in upstream.aiter_bytes(chunk_size):
+                    data += chunk
+                    if len(data) >= end + 1:
+                        break
+                await upstream.aclose()
+                if len(data) < end + 1:
+                    raise SegmentError("First segment truncated")
+                return bytes(data[:end + 1])
+            return await _fetch_segment(url, start, end)
+
+    tasks = {index: asyncio.ensure_future(fetch(index)) for index in range(min(window, count))}
+    sent = 0
+    try:
+        for index in range(count):
+            try:
+                data = await tasks.pop(index)
+            except (SegmentError, httpx.HTTPError) as e:
+                logger.warning(f"Téléchargement par segments abandonné, flux unique à partir de l'octet {sent}: {str(e)}")
+                PROXY_UPSTREAM_ERRORS.labels(proxy_platform(url), 'segment').inc()
+                break
+            if index + window < count:
+                tasks[index + window] = asyncio.ensure_future(fetch(index + window))
+            for position in range(0, len(data), chunk_size):
+                yield data[position:position + chunk_size]
+            sent += len(data)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        await upstream.aclose()
+
+    if sent < size:
+        async for chunk in iter_from_offset(url, sent, chunk_size):
+            yield chunk
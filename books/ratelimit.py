@@ -0,0 +1,38 @@
+# ratelimit.py
+"""
+Backoff par plateforme quand yt-dlp signale une limitation de débit (HTTP 429...).
+
+Chaque limitation double le délai d'attente de la plateforme (jusqu'à un
+plafond) ; pendant ce délai, les tâches de la plateforme sont reprogrammées
+sans solliciter la plateforme. Le niveau retombe après une période calme.
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def note_rate_limited(platform):
+    """Enregistre une limitation et retourne le délai (secondes) avant le prochain essai."""
+    level_key = f"ratelimit:{platform.lower()}:level"
+    cache.add(level_key, 0, timeout=settings.RATE_LIMIT_RESET_AFTER)
+    level = cache.incr(level_key)
+    cache.touch(level_key, settings.RATE_LIMIT_RESET_AFTER)
+
+    delay = min(settings.RATE_LIMIT_BASE_BACKOFF * 2 ** (level - 1), settings.RATE_LIMIT_MAX_BACKOFF)
+    cache.set(f"ratelimit:{platform.lower()}:until", time.time() + delay, timeout=delay)
+    logger.warning(f"{platform} limite nos requêtes (niveau {level}), pause de {delay}s")
+    # Un peu d'aléa pour ne pas relancer toutes les tâches en attente au même instant
+    return delay + random.randint(0, max(1, delay // 10))
+
+
+def backoff_remaining(platform):
+    """Secondes restantes avant de pouvoir solliciter à nouveau la plateforme (0 si aucune)."""
+    until = cache.get(f"ratelimit:{platform.lower()}:until")
+    if not until:
+        return 0
+    return max(0, int(until - time.time()))
@@ -0,0 +1,214 @@
+# refresh.py
+"""
+Téléchargement par handle stable et rafraîchissement des URLs directes expirées.
+
+Le proxy accepte, à la place d'une URL directe signée, l'identifiant d'un
+téléchargement enregistré (DownloadStat) ou celui de la tâche qui l'a
+enregistré. L'URL directe en est tirée ; si elle est expirée (ou si la
+source répond 403/410), une nouvelle extraction est demandée au worker
+Celery (REFRESH_TASK, par nom : le processus web ne charge pas yt_dlp).
+
+Les rafraîchissements concurrents d'un même téléchargement sont fusionnés :
+le premier flux prend un bail dans le cache partagé et envoie la tâche, les
+autres attendent (asyncio.sleep) que la nouvelle URL y soit publiée. Un
+flux coupé en cours de route reprend ensuite à l'octet atteint (Range).
+"""
+import asyncio
+import logging
+import re
+import time
+from contextlib import aclosing
+
+import httpx
+from asgiref.sync import sync_to_async
+from celery import current_app
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import parse_url_expiry
+from .models import DownloadStat
+from .proxy import UpstreamError, iter_from_offset
+from .routing import REFRESH_TASK
+from .stat_buffer import is_stat_pending
+
+logger = logging.getLogger(__name__)
+
+# Réponses d'un CDN à une URL signée expirée
+EXPIRED_STATUSES = (403, 410)
+
+
+class HandleNotFound(Exception):
+    """Aucun téléchargement réussi ne correspond au handle."""
+
+
+class HandlePending(HandleNotFound):
+    """Téléchargement enregistré dans le tampon d'un worker, pas encore écrit (books/stat_buffer.py)."""
+
+
+class StreamHandle:
+    def __init__(self, download_id, video_url, format_preference, direct_url, requested_format=None):
+        self.download_id = download_id
+        self.video_url = video_url
+        self.format_preference = format_preference
+        self.direct_url = direct_url
+        # Format enregistré tel que demandé (None pour les lignes antérieures à la colonne)
+        self.requested_format = requested_format
+
+
+def _lease_key(download_id):
+    return f"proxy:refresh:{download_id}"
+
+
+def _result_key(download_id):
+    return f"proxy:refreshed:{download_id}"
+
+
+def refresh_format(stat):
+    """
+    Format à réextraire : celui demandé à l'origine. Les téléchargements
+    enregistrés avant que ce format soit conservé retombent sur la résolution
+    enregistrée, sinon sur le format par défaut de l'API.
+    """
+    if stat.format_preference:
+        return stat.format_preference
+    if stat.qualite_video and re.match(r"^\d{3,4}p$", stat.qualite_video):
+        return stat.qualite_video
+    return 'worst'
+
+
+def is_expiring(url):
+    expiry = parse_url_expiry(url)
+    return expiry is not None and expiry - time.time() < settings.EXTRACTION_CACHE_EXPIRY_MARGIN
+
+
+def _load_handle(download_id=None, task_id=None):
+    if task_id:
+        task_result = AsyncResult(task_id)
+        result = task_result.result if task_result.successful() else None
+        if not isinstance(result, dict) or not result.get('download_id'):
+            raise HandleNotFound(task_id)
+        download_id = result['download_id']
+    try:
+        stat = DownloadStat.objects.get(pk=download_id, statut_telechargement=True)
+    except (DownloadStat.DoesNotExist, ValueError):
+        if is_stat_pending(download_id):
+            raise HandlePending(download_id)
+        raise HandleNotFound(download_id)
+    return StreamHandle(
+        stat.pk, stat.url_telechargement, refresh_format(stat), stat.direct_url, stat.format_preference
+    )
+
+
+async def resolve_handle(download_id=None, task_id=None):
+    """
+    StreamHandle d'un téléchargement enregistré, avec une URL directe encore
+    valide. Lève HandleNotFound, ou UpstreamError si le rafraîchissement échoue.
+    """
+    load = sync_to_async(_load_handle)
+    deadline = time.monotonic() + settings.STAT_BUFFER_PENDING_TTL
+    while True:
+        try:
+            handle = await load(download_id, task_id)
+            break
+        except HandlePending:
+            # Seuls les identifiants marqués en attente d'écriture sont attendus ; les autres sont 404 aussitôt
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(settings.PROXY_REFRESH_POLL_INTERVAL)
+    if not handle.direct_url or is_expiring(handle.direct_url):
+        await refresh_direct_url(handle)
+    return handle
+
+
+def publish_refreshed_url(download_id, stale_url, direct_url=None, error=None):
+    """Appelé par REFRESH_TASK : réveille les flux qui attendent la nouvelle URL."""
+    cache.set(
+        _result_key(download_id),
+        {'stale_url': stale_url, 'direct_url': direct_url, 'error': error},
+        timeout=settings.PROXY_REFRESH_RESULT_TTL,
+    )
+    cache.delete(_lease_key(download_id))
+
+
+def _send_refresh(handle, stale_url):
+    current_app.send_task(REFRESH_TASK, kwargs=dict(
+        download_id=handle.download_id,
+        video_url=handle.video_url,
+        format_preference=handle.format_preference,
+        stale_url=stale_url,
+    ))
+
+
+async def refresh_direct_url(handle):
+    """
+    Remplace handle.direct_url par une URL fraîchement extraite. Un seul
+    rafraîchissement est lancé par téléchargement, quel que soit le nombre de
+    flux qui le demandent.
+    """
+    stale_url = handle.direct_url
+    if await cache.aadd(_lease_key(handle.download_id), stale_url, timeout=settings.PROXY_REFRESH_TIMEOUT):
+        logger.info(f"URL directe expirée pour le téléchargement {handle.download_id}, réextraction")
+        try:
+            await sync_to_async(_send_refresh, thread_sensitive=False)(handle, stale_url)
+        except Exception as e:
+            await cache.adelete(_lease_key(handle.download_id))
+            logger.error(f"Impossible d'envoyer la tâche de rafraîchissement: {str(e)}")
+            raise UpstreamError(f"Could not schedule direct URL refresh: {str(e)}") from e
+
+    deadline = time.monotonic() + settings.PROXY_REFRESH_TIMEOUT
+    while time.monotonic() < deadline:
+        published = await cache.aget(_result_key(handle.download_id))
+        if published and published['direct_url'] and published['direct_url'] != stale_url:
+            handle.direct_url = published['direct_url']
+            return handle.direct_url
+        if published and published['error'] and published['stale_url'] == stale_url:
+            raise UpstreamError(f"Direct URL refresh failed: {published['error']}")
+        await asyncio.sleep(settings.PROXY_REFRESH_POLL_INTERVAL)
+    raise UpstreamError("Direct URL refresh timed out")
+
+
+async def open_handle(handle, open_source):
+    """
+    Ouvre la source par `open_source(url)` ; si l'URL a expiré entre-temps
+    (403/410), la rafraîchit et réessaie une fois.
+    """
+    try:
+        return await open_source(handle.direct_url)
+    except UpstreamError as e:
+        if e.status_code not in EXPIRED_STATUSES:
+            raise
+    await refresh_direct_url(handle)
+    return await open_source(handle.direct_url)
+
+
+async def iter_resumable(handle, chunks, chunk_size=None):
+    """
+    Relaie le corps complet (200) d'un téléchargement par handle ; si la
+    source coupe en cours de route, reprend à l'octet atteint, avec une URL
+    rafraîchie si l'ancienne a expiré. Une seule reprise par flux.
+    """
+    sent = 0
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                sent += len(chunk)
+                yield chunk
+        return
+    except (httpx.HTTPError, UpstreamError) as e:
+        logger.info(f"Flux du téléchargement {handle.download_id} coupé à l'octet {sent}, reprise: {str(e)}")
+
+    async def open_from(url):
+        # Ouvre la reprise tout de suite : une URL expirée se voit avant le premier octet
+        resumed = iter_from_offset(url, sent, chunk_size)
+        try:
+            return await anext(resumed), resumed
+        except StopAsyncIteration:
+            return b'', resumed
+
+    first, resumed = await open_handle(handle, open_from)
+    if first:
+        yield first
+    async with aclosing(resumed):
+        async for chunk in resumed:
+            yield chunk
@@ -0,0 +1,61 @@
+# result_backend.py
+"""
+Backend de résultats Celery pour le mode TASK_RESULT_STORE='redis'.
+
+Les résultats vivent dans Redis, avec le TTL natif de result_expires : une
+fin de tâche est un SET, un poll de TaskStatusView un GET, et rien ne
+s'accumule. Le méta est réduit au nécessaire (pas de `children` vide ni de
+`traceback` nul, traceback des échecs tronqué).
+
+Seuls les résultats choisis (TASK_RESULT_PERSIST_TASKS, dans les états
+TASK_RESULT_PERSIST_STATES) sont aussi écrits dans la table de
+django_celery_results, pour être gardés au-delà du TTL.
+
+Configuré par CELERY_RESULT_BACKEND = 'books.result_backend:CompactRedisBackend+redis://...'
+(voir myproject/settings.py).
+"""
+import logging
+
+from celery.backends.redis import RedisBackend
+from django.conf import settings
+from kombu.utils.objects import cached_property
+
+logger = logging.getLogger(__name__)
+
+# Fin de traceback gardée pour un échec (le début n'est que la pile de Celery)
+TRACEBACK_MAX_LENGTH = 2000
+
+
+class CompactRedisBackend(RedisBackend):
+
+    def _get_result_meta(self, result, state, traceback, request, **kwargs):
+        meta = super()._get_result_meta(result, state, traceback, request, **kwargs)
+        if not meta.get('children'):
+            meta.pop('children', None)
+        if meta.get('traceback') is None:
+            meta.pop('traceback', None)
+        else:
+            meta['traceback'] = meta['traceback'][-TRACEBACK_MAX_LENGTH:]
+        return meta
+
+    @cached_property
+    def archive(self):
+        from django_celery_results.backends import DatabaseBackend
+
+        return DatabaseBackend(app=self.app)
+
+    def should_persist(self, state, request):
+        return (
+            state in settings.TASK_RESULT_PERSIST_STATES
+            and getattr(request, 'task', None) in settings.TASK_RESULT_PERSIST_TASKS
+        )
+
+    def store_result(self, task_id, result, state, traceback=None, request=None, **kwargs):
+        stored = super().store_result(task_id, result, state, traceback=traceback, request=request, **kwargs)
+        if self.should_persist(state, request):
+            try:
+                self.archive.store_result(task_id, result, state, traceback=traceback, request=request)
+            except Exception as e:
+                # Le résultat reste servi par Redis : seule l'archive manque
+                logger.warning(f"Archivage du résultat de la tâche {task_id} impossible: {str(e)}")
+        return stored
@@ -0,0 +1,124 @@
+# rollups.py
+"""
+Agrégats horaires des statistiques de téléchargement (DownloadStatHourly).
+
+Les endpoints de statistiques lisent ces agrégats, clés (heure, origine,
+qualité, pays, statut) : leur coût dépend de la période demandée, plus du
+nombre total de téléchargements enregistrés.
+
+Chaque DownloadStat créé incrémente son agrégat (add_to_rollups). La tâche
+périodique rebuild_recent_rollups recalcule depuis la table brute les
+dernières heures closes, ce qui rattrape un incrément perdu ou une ligne
+modifiée après coup ; la commande backfill_stat_rollups fait de même sur
+l'historique. Un recalcul remplace les agrégats de sa période : il est
+idempotent.
+"""
+import datetime
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import DownloadStat, DownloadStatHourly
+
+logger = logging.getLogger(__name__)
+
+# Dimensions d'un agrégat, en plus de l'heure (mêmes noms que dans DownloadStat)
+ROLLUP_FIELDS = ('origine_video', 'qualite_video', 'pays_ip', 'statut_telechargement')
+
+HOUR = datetime.timedelta(hours=1)
+
+
+def hour_start(moment):
+    """Début de l'heure (UTC) qui contient `moment`."""
+    return moment.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(day):
+    """Début (fuseau courant) du jour `day`, pour filtrer les agrégats par date."""
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _key(heure, origine_video, qualite_video, pays_ip, statut_telechargement):
+    # NULL et '' sont confondus, comme dans les statistiques
+    return heure, origine_video or '', qualite_video or '', pays_ip or '', statut_telechargement
+
+
+def _increment(key, count):
+    fields = dict(zip(('heure',) + ROLLUP_FIELDS, key))
+    if DownloadStatHourly.objects.filter(**fields).update(total=F('total') + count):
+        return
+    try:
+        with transaction.atomic():
+            DownloadStatHourly.objects.create(total=count, **fields)
+    except IntegrityError:
+        # Créé entre-temps par un autre worker
+        DownloadStatHourly.objects.filter(**fields).update(total=F('total') + count)
+
+
+def add_to_rollups(stats):
+    """
+    Compte des DownloadStat qui viennent d'être créés dans leurs agrégats.
+    Un échec n'est que journalisé : rebuild_recent_rollups le rattrape.
+    """
+    counts = Counter(
+        _key(hour_start(stat.horodatage), *(getattr(stat, field) for field in ROLLUP_FIELDS))
+        for stat in stats
+    )
+    try:
+        for key, count in counts.items():
+            _increment(key, count)
+    except DatabaseError as e:
+        logger.warning(f"Mise à jour des agrégats horaires impossible: {str(e)}")
+
+
+def rebuild_rollups(start, end):
+    """
+    Recalcule depuis DownloadStat les agrégats des heures comprises entre
+    `start` et `end` (arrondies à l'heure, `end` exclue) et remplace ceux
+    existants. Retourne le nombre de téléchargements agrégés.
+    """
+    start = hour_start(start)
+    end = end if hour_start(end) == end else hour_start(end) + HOUR
+    rows = (
+        DownloadStat.objects
+        .filter(horodatage__gte=start, horodatage__lt=end)
+        .annotate(heure=TruncHour('horodatage', tzinfo=datetime.timezone.utc))
+        .values('heure', *ROLLUP_FIELDS)
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        DownloadStatHourly.objects.filter(heure__gte=start, heure__lt=end).delete()
+        totals = Counter()
+        for row in rows:
+            totals[_key(row['heure'], *(row[field] for field in ROLLUP_FIELDS))] += row['total']
+        DownloadStatHourly.objects.bulk_create(
+            [DownloadStatHourly(total=total, **dict(zip(('heure',) + ROLLUP_FIELDS, key))) for key, total in totals.items()],
+            batch_size=1000,
+        )
+    return sum(totals.values())
+
+
+def rebuild_recent_rollups(hours=None):
+    """
+    Recalcule les `hours` dernières heures closes. L'heure en cours n'est
+    tenue que par les incréments : un recalcul concurrent pourrait compter
+    deux fois un téléchargement enregistré pendant qu'il tourne.
+    """
+    hours = hours or settings.STATS_ROLLUP_REBUILD_HOURS
+    end = hour_start(timezone.now())
+    return rebuild_rollups(end - hours * HOUR, end)
+
+
+def rollup_counts(rollups):
+    """Total et réussites d'un ensemble d'agrégats."""
+    counts = rollups.aggregate(
+        downloads=Sum('total'),
+        successful=Sum('total', filter=Q(statut_telechargement=True)),
+    )
+    return counts['downloads'] or 0, counts['successful'] or 0
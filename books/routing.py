@@ -0,0 +1,46 @@
+# routing.py
+"""
+Routage des tâches Celery vers une file par plateforme.
+
+Une panne ou un ralentissement d'une plateforme (TikTok, Instagram...) ne
+bloque ainsi que sa propre file. Dans chaque file, les recherches de formats
+(interactives) passent avant les enregistrements de téléchargement.
+"""
+from django.conf import settings
+
+from .utils import detect_platform
+
+# Noms des tâches : le processus web les envoie par nom (send_task) sans importer
+# books.tasks, donc sans charger yt_dlp.
+RESOLUTIONS_TASK = 'books.tasks.async_get_available_resolutions'
+RECORD_TASK = 'books.tasks.async_extract_metadata_and_save'
+REFRESH_TASK = 'books.tasks.async_refresh_direct_url'
+
+# Priorité RabbitMQ par tâche (plus élevé = servi en premier)
+TASK_PRIORITIES = {
+    RESOLUTIONS_TASK: 9,
+    RECORD_TASK: 4,
+    # Un client attend, flux ouvert, la nouvelle URL directe
+    REFRESH_TASK: 9,
+}
+
+
+def task_video_url(args, kwargs):
+    """Retrouve l'URL de la vidéo dans les arguments d'une tâche de books.tasks."""
+    args = args or ()
+    kwargs = kwargs or {}
+    request_data = kwargs.get('request_data') or (args[0] if args and isinstance(args[0], dict) else None)
+    if request_data is not None:
+        return request_data.get('video_url') or ''
+    return kwargs.get('video_url') or (args[0] if args else '')
+
+
+def route_by_platform(name, args, kwargs, options, task=None, **kw):
+    """Router Celery (voir CELERY_TASK_ROUTES)."""
+    if name not in TASK_PRIORITIES:
+        return None
+    platform = detect_platform(task_video_url(args, kwargs))
+    return {
+        'queue': settings.PLATFORM_QUEUES[platform]['queue'],
+        'priority': TASK_PRIORITIES[name],
+    }
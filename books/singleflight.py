@@ -0,0 +1,164 @@
+# singleflight.py
+"""
+Coalescence « single-flight » des travaux identiques entre workers Celery.
+
+Le premier worker qui prend le bail (clé courte durée dans le cache partagé)
+effectue le travail et publie son résultat ; les autres attendent ce résultat
+au lieu de refaire le travail. Si le détenteur du bail plante, le bail expire
+et un des workers en attente prend le relais.
+
+Le bail porte un jeton : seul son détenteur le prolonge (un fil le renouvelle
+tous les tiers de SINGLEFLIGHT_LEASE_TTL tant que le travail dure, même plus
+long que le TTL) et le rend (comparer-et-supprimer atomique, script Lua sur
+Redis). Les workers en attente espacent leurs lectures jusqu'à
+SINGLEFLIGHT_MAX_POLL_INTERVAL et n'occupent pas leur place de worker plus
+de SINGLEFLIGHT_WAIT_TIMEOUT secondes : au-delà, ils font le travail
+eux-mêmes. Sans REDIS_URL (développement), le bail vit dans le cache local
+du processus. Comme pour le cache d'extraction, Redis n'est qu'une
+optimisation : s'il est injoignable, le travail est fait directement, sans
+coalescence.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Ne touche au bail que s'il porte encore notre jeton
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_redis = None
+_scripts = {}
+_local_lock = threading.Lock()
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+        _scripts['release'] = _redis.register_script(RELEASE_SCRIPT)
+        _scripts['extend'] = _redis.register_script(EXTEND_SCRIPT)
+    return _redis
+
+
+class Lease:
+    """Bail d'un travail : pris, prolongé et rendu seulement par son détenteur (jeton)."""
+
+    def __init__(self, key):
+        self.key = f"singleflight:lease:{key}"
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        ttl = settings.SINGLEFLIGHT_LEASE_TTL
+        if settings.REDIS_URL:
+            return bool(_get_redis().set(self.key, self.token, nx=True, ex=ttl))
+        return cache.add(self.key, self.token, timeout=ttl)
+
+    def extend(self):
+        """Repousse l'expiration du bail ; False s'il a expiré et été repris entre-temps."""
+        ttl = settings.SINGLEFLIGHT_LEASE_TTL
+        if settings.REDIS_URL:
+            _get_redis()
+            return bool(_scripts['extend'](keys=[self.key], args=[self.token, ttl]))
+        with _local_lock:
+            return cache.get(self.key) == self.token and cache.touch(self.key, ttl)
+
+    def release(self):
+        if settings.REDIS_URL:
+            _get_redis()
+            _scripts['release'](keys=[self.key], args=[self.token])
+            return
+        with _local_lock:
+            if cache.get(self.key) == self.token:
+                cache.delete(self.key)
+
+
+def _keep_lease(lease, done):
+    """Fil du détenteur : prolonge le bail jusqu'à la fin du travail."""
+    while not done.wait(settings.SINGLEFLIGHT_LEASE_TTL / 3):
+        try:
+            if not lease.extend():
+                logger.warning(f"Bail single-flight perdu pendant le travail: {lease.key}")
+                return
+        except Exception as e:
+            logger.warning(f"Bail single-flight non prolongé: {str(e)}")
+
+
+def _without_coalescing(key, compute, error):
+    logger.warning(f"Cache partagé indisponible, extraction sans coalescence pour {key}: {str(error)}")
+    return compute()
+
+
+def single_flight(key, fetch_result, compute):
+    """
+    Exécute `compute()` une seule fois pour `key` à un instant donné.
+
+    `fetch_result()` doit retourner le résultat publié par `compute()`
+    (via le cache partagé), ou None tant qu'il n'est pas disponible.
+    """
+    error_key = f"singleflight:error:{key}"
+    started = time.time()
+    deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_TIMEOUT
+    poll_interval = settings.SINGLEFLIGHT_POLL_INTERVAL
+
+    while True:
+        result = fetch_result()
+        if result is not None:
+            return result
+
+        try:
+            # On ne retient que les erreurs du détenteur survenues pendant notre attente
+            error = cache.get(error_key)
+            lease = Lease(key)
+            acquired = lease.acquire()
+        except RedisError as e:
+            return _without_coalescing(key, compute, e)
+        if error is not None and error[0] >= started:
+            raise error[1]
+
+        if acquired:
+            done = threading.Event()
+            keeper = threading.Thread(target=_keep_lease, args=(lease, done), name='singleflight-lease', daemon=True)
+            keeper.start()
+            try:
+                return compute()
+            except Exception as e:
+                # L'exception elle-même est partagée, pour que les workers en attente lèvent la même erreur typée
+                try:
+                    cache.set(error_key, (time.time(), e), timeout=settings.SINGLEFLIGHT_ERROR_TTL)
+                except RedisError as share_error:
+                    logger.warning(f"Erreur single-flight non partagée pour {key}: {str(share_error)}")
+                raise
+            finally:
+                done.set()
+                keeper.join()
+                try:
+                    # On ne libère que notre propre bail (il a pu expirer et être repris)
+                    lease.release()
+                except RedisError as e:
+                    logger.warning(f"Bail single-flight non rendu, il expirera de lui-même: {str(e)}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"Attente single-flight expirée pour {key}, extraction locale")
+            return compute()
+        time.sleep(min(poll_interval, remaining))
+        poll_interval = min(poll_interval * 2, settings.SINGLEFLIGHT_MAX_POLL_INTERVAL)
@@ -0,0 +1,239 @@
+# stat_buffer.py
+"""
+Écriture différée (write-behind) des DownloadStat depuis les workers Celery.
+
+Au lieu d'un INSERT et d'un commit par tâche, chaque processus worker garde
+les enregistrements en mémoire et les écrit d'un bulk_create dès que
+STAT_BUFFER_SIZE lignes sont en attente, ou au plus tard après
+STAT_BUFFER_FLUSH_INTERVAL secondes (fil d'écriture du processus). Le
+tampon est vidé à l'arrêt du worker (worker_process_shutdown, voir
+books/tasks.py) : un crash ne perd que les lignes d'une fenêtre d'écriture.
+
+L'identifiant d'une ligne est réservé dans la séquence de la table avant
+son écriture (par blocs, une requête par STAT_BUFFER_SIZE lignes) : la
+tâche le renvoie aussitôt comme handle du proxy (download_id). Tant que la
+ligne n'est pas écrite, son identifiant est marqué dans le cache partagé
+(pour STAT_BUFFER_PENDING_TTL secondes au plus) : books/refresh.py n'attend
+que ces identifiants-là, et répond 404 tout de suite pour les autres. Hors
+PostgreSQL (pas de séquence à réserver), les lignes sont
+écrites immédiatement.
+
+Les valeurs venues du client (IP de X-Forwarded-For, plateforme...) sont
+ramenées au schéma avant la mise en tampon. Si l'écriture d'un lot échoue
+sur une ligne (DataError, IntegrityError), le lot est réécrit ligne par
+ligne et seules les lignes refusées sont abandonnées ; il n'est remis en
+attente que si la base est injoignable (OperationalError, InterfaceError).
+
+Les volumes écrits et la durée des écritures sont comptés dans le cache
+partagé, et exposés sur /metrics par StatBufferCollector (books/metrics.py).
+"""
+import ipaddress
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, InterfaceError, OperationalError, connection
+
+from .models import DownloadStat
+from .rollups import add_to_rollups
+
+logger = logging.getLogger(__name__)
+
+# Compteurs partagés entre workers (durées en microsecondes : cache.incr est entier)
+WRITTEN_KEY = 'stat-buffer:written'
+DROPPED_KEY = 'stat-buffer:dropped'
+FLUSHES_KEY = 'stat-buffer:flushes'
+FLUSH_MICROSECONDS_KEY = 'stat-buffer:flush-us'
+
+# Identifiant réservé, ligne pas encore écrite
+def _pending_key(download_id):
+    return f"stat-buffer:pending:{download_id}"
+
+
+# Adresse enregistrée quand celle du client est illisible (colonne inet non nulle)
+UNKNOWN_IP = '0.0.0.0'
+
+# Base injoignable : le lot est remis en attente
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+def _count(key, value):
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, value)
+    except Exception as e:
+        logger.debug(f"Compteur {key} non mis à jour: {str(e)}")
+
+
+def clean_stat(stat):
+    """Ramène les valeurs de `stat` aux contraintes des colonnes (longueurs, adresse IP)."""
+    try:
+        stat.adresse_ip = str(ipaddress.ip_address(str(stat.adresse_ip).strip()))
+    except ValueError:
+        stat.adresse_ip = UNKNOWN_IP
+    for field in DownloadStat._meta.concrete_fields:
+        value = getattr(stat, field.attname)
+        if field.max_length is None or not isinstance(value, str) or len(value) <= field.max_length:
+            continue
+        if field.name == 'direct_url':
+            # Une URL signée tronquée est inutilisable : le handle la réextraira
+            setattr(stat, field.attname, None)
+        else:
+            setattr(stat, field.attname, value[:field.max_length])
+    return stat
+
+
+def is_stat_pending(download_id):
+    """True si la ligne `download_id` est réservée dans le tampon d'un worker mais pas encore écrite."""
+    return bool(cache.get(_pending_key(download_id)))
+
+
+def _forget_pending(stats):
+    try:
+        cache.delete_many([_pending_key(stat.pk) for stat in stats])
+    except Exception as e:
+        logger.debug(f"Marques de lignes en attente non supprimées: {str(e)}")
+
+
+def _reserve_ids(count):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [DownloadStat._meta.db_table, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class StatBuffer:
+    """Tampon d'un processus worker."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Une seule écriture à la fois (fil de la tâche ou fil d'écriture)
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.ids = []
+        self.wakeup = threading.Event()
+        self.writer = None
+
+    def enabled(self):
+        return settings.STAT_BUFFER_SIZE > 1 and connection.vendor == 'postgresql'
+
+    def add(self, stat):
+        """Enregistre `stat` (DownloadStat non sauvegardé) et retourne son identifiant."""
+        clean_stat(stat)
+        if not self.enabled():
+            stat.save()
+            add_to_rollups([stat])
+            return stat.pk
+        with self.lock:
+            if not self.ids:
+                self.ids = _reserve_ids(settings.STAT_BUFFER_SIZE)
+            stat.pk = self.ids.pop(0)
+        try:
+            # Marquée avant la mise en tampon : jamais après son écriture
+            cache.set(_pending_key(stat.pk), True, timeout=settings.STAT_BUFFER_PENDING_TTL)
+        except Exception as e:
+            logger.debug(f"Ligne en attente {stat.pk} non marquée: {str(e)}")
+        with self.lock:
+            self.pending.append(stat)
+            full = len(self.pending) >= settings.STAT_BUFFER_SIZE
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self._write_periodically, name='stat-buffer', daemon=True)
+                self.writer.start()
+        if full:
+            self.flush()
+        return stat.pk
+
+    def flush(self):
+        """Écrit les lignes en attente ; retourne le nombre de lignes écrites."""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            started = time.monotonic()
+            try:
+                DownloadStat.objects.bulk_create(batch)
+                written = settled = batch
+            except CONNECTION_ERRORS as e:
+                self._requeue(batch, e)
+                return 0
+            except DatabaseError as e:
+                logger.warning(f"Écriture groupée de {len(batch)} statistiques refusée, reprise ligne par ligne: {str(e)}")
+                written, settled = self._write_rows(batch)
+            duration = time.monotonic() - started
+            # Lignes écrites ou abandonnées : plus rien à attendre
+            _forget_pending(settled)
+            if written:
+                add_to_rollups(written)
+        _count(WRITTEN_KEY, len(written))
+        _count(FLUSHES_KEY, 1)
+        _count(FLUSH_MICROSECONDS_KEY, int(duration * 1_000_000))
+        return len(written)
+
+    def _write_rows(self, batch):
+        """
+        Écrit `batch` ligne par ligne ; les lignes refusées sont journalisées et
+        abandonnées. Retourne (lignes écrites, lignes traitées, donc hors tampon).
+        """
+        written = []
+        settled = batch
+        for index, stat in enumerate(batch):
+            try:
+                DownloadStat.objects.bulk_create([stat])
+            except CONNECTION_ERRORS as e:
+                settled = batch[:index]
+                self._requeue(batch[index:], e)
+                break
+            except DatabaseError as e:
+                _count(DROPPED_KEY, 1)
+                logger.error(
+                    f"Statistique de téléchargement {stat.pk} abandonnée ({stat.url_telechargement}): {str(e)}"
+                )
+            else:
+                written.append(stat)
+        return written, settled
+
+    def _requeue(self, batch, error):
+        # Connexion sans doute perdue : rouverte à la prochaine écriture
+        connection.close()
+        with self.lock:
+            self.pending = batch + self.pending
+            dropped = len(self.pending) - settings.STAT_BUFFER_MAX_PENDING
+            if dropped > 0:
+                lost, self.pending = self.pending[:dropped], self.pending[dropped:]
+        if dropped > 0:
+            _forget_pending(lost)
+            _count(DROPPED_KEY, dropped)
+            logger.error(f"{dropped} statistiques de téléchargement abandonnées (tampon plein)")
+        logger.error(f"Écriture de {len(batch)} statistiques de téléchargement impossible: {str(error)}")
+
+    def _write_periodically(self):
+        while not self.wakeup.wait(settings.STAT_BUFFER_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Écriture périodique des statistiques échouée: {str(e)}")
+        connection.close()
+
+    def close(self):
+        """Arrêt du processus : arrête le fil d'écriture et vide le tampon."""
+        self.wakeup.set()
+        if self.writer is not None:
+            self.writer.join(timeout=settings.STAT_BUFFER_FLUSH_INTERVAL + 5)
+        self.flush()
+
+
+_buffer = StatBuffer()
+
+
+def buffer_stat(stat):
+    """Enregistre un DownloadStat par le tampon du processus ; retourne son identifiant."""
+    return _buffer.add(stat)
+
+
+def close_stat_buffer():
+    _buffer.close()
@@ -0,0 +1,209 @@
+# task_events.py
+"""
+Transitions d'état des tâches Celery poussées aux clients (SSE) par Redis pub/sub.
+
+Côté worker, les signaux des tâches (voir books/tasks.py) publient chaque
+transition (STARTED, RETRY, SUCCESS, FAILURE) sur le canal
+TASK_EVENTS_CHANNEL, et gardent le dernier état de chaque tâche sous
+`task-events:last:<task_id>` pour les clients qui se connectent après coup.
+
+Côté web, chaque processus tient un seul abonnement au canal (TaskEventHub)
+et distribue les messages aux connexions SSE qui attendent la tâche : pas
+de connexion Redis par client, et aucune interrogation du result backend
+en boucle. Sans REDIS_URL (développement), les publications sont ignorées
+et la vue retombe sur une lecture périodique du backend.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from celery.result import AsyncResult
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# États après lesquels la tâche ne change plus
+READY_STATES = ('SUCCESS', 'FAILURE')
+
+_redis = None
+
+
+def _last_key(task_id):
+    return f"task-events:last:{task_id}"
+
+
+def task_event(task_id, task_status, result=None, error=None):
+    """Même forme que la réponse de TaskStatusView."""
+    event = {"task_id": task_id, "task_status": task_status}
+    if task_status == 'SUCCESS':
+        event["result"] = result
+    elif task_status == 'FAILURE':
+        event["error_details"] = error
+    return event
+
+
+def publish_task_event(task_id, task_status, result=None, error=None):
+    """Publie une transition d'état (appelé depuis les workers Celery)."""
+    global _redis
+    if not settings.REDIS_URL:
+        return
+    import redis
+
+    payload = json.dumps(task_event(task_id, task_status, result, error), default=str)
+    try:
+        if _redis is None:
+            _redis = redis.Redis.from_url(settings.REDIS_URL)
+        pipe = _redis.pipeline(transaction=False)
+        pipe.set(_last_key(task_id), payload, ex=settings.CELERY_TASK_RESULT_EXPIRES)
+        pipe.publish(settings.TASK_EVENTS_CHANNEL, payload)
+        pipe.execute()
+    except redis.RedisError as e:
+        # Les clients retombent sur le backend à la reconnexion
+        logger.warning(f"Publication de l'état de la tâche {task_id} impossible: {str(e)}")
+
+
+class TaskEventHub:
+    """
+    Abonnement unique au canal des événements pour le processus web (et sa
+    boucle d'événements), partagé par toutes les connexions SSE.
+    """
+
+    def __init__(self):
+        import redis.asyncio
+
+        self.client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+        self.waiters = {}
+        self.reader = None
+
+    def subscribe(self, task_id):
+        queue = asyncio.Queue()
+        self.waiters.setdefault(task_id, set()).add(queue)
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.ensure_future(self._read())
+        return queue
+
+    def unsubscribe(self, task_id, queue):
+        queues = self.waiters.get(task_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.waiters[task_id]
+
+    async def last_event(self, task_id):
+        payload = await self.client.get(_last_key(task_id))
+        return json.loads(payload) if payload else None
+
+    def _dispatch(self, event):
+        for queue in self.waiters.get(event.get('task_id'), ()):
+            queue.put_nowait(event)
+
+    async def _read(self):
+        import redis
+
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(settings.TASK_EVENTS_CHANNEL)
+                # Rattrape les événements publiés pendant une coupure
+                for task_id in list(self.waiters):
+                    event = await self.last_event(task_id)
+                    if event is not None:
+                        self._dispatch(event)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._dispatch(json.loads(message['data']))
+            except redis.RedisError as e:
+                logger.warning(f"Abonnement aux événements des tâches perdu: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+_hub = None
+_hub_loop = None
+
+
+def get_event_hub():
+    """Hub du processus, recréé si la boucle d'événements a changé ; None sans Redis."""
+    global _hub, _hub_loop
+    if not settings.REDIS_URL:
+        return None
+    loop = asyncio.get_running_loop()
+    if _hub is None or _hub_loop is not loop:
+        _hub = TaskEventHub()
+        _hub_loop = loop
+    return _hub
+
+
+def _backend_event(task_id):
+    task_result = AsyncResult(task_id)
+    task_status = task_result.status
+    if task_status == 'SUCCESS':
+        return task_event(task_id, task_status, result=task_result.result)
+    if task_status == 'FAILURE':
+        return task_event(task_id, task_status, error=str(task_result.result))
+    return task_event(task_id, task_status)
+
+
+def format_sse(event):
+    return f"event: status\ndata: {json.dumps(event, default=str)}\n\n".encode('utf-8')
+
+
+async def iter_task_events(task_id):
+    """
+    Flux SSE des états d'une tâche : l'état courant, puis chaque transition,
+    jusqu'à SUCCESS / FAILURE ou TASK_EVENTS_TIMEOUT secondes (EventSource
+    se reconnecte alors de lui-même). Un commentaire est envoyé toutes les
+    TASK_EVENTS_HEARTBEAT secondes pour garder la connexion ouverte.
+    """
+    import redis
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.TASK_EVENTS_TIMEOUT
+    read_backend = sync_to_async(_backend_event)
+    hub = get_event_hub()
+    # Abonné avant de lire l'état courant : aucune transition ne peut se glisser entre les deux
+    queue = hub.subscribe(task_id) if hub is not None else None
+
+    async def next_event(timeout):
+        if queue is None:
+            # Sans Redis : lecture périodique du backend (développement)
+            await asyncio.sleep(min(timeout, settings.TASK_EVENTS_FALLBACK_POLL_INTERVAL))
+            return await read_backend(task_id)
+        try:
+            return await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    try:
+        yield f"retry: {settings.TASK_EVENTS_RETRY_MS}\n\n".encode('utf-8')
+        event = None
+        if hub is not None:
+            try:
+                event = await hub.last_event(task_id)
+            except redis.RedisError as e:
+                logger.warning(f"Dernier état de la tâche {task_id} illisible: {str(e)}")
+        if event is None:
+            # Aucun événement publié (tâche en file, ou expiré) : une seule lecture du backend
+            event = await read_backend(task_id)
+
+        last_status = None
+        last_write = loop.time()
+        while True:
+            if event is not None and event['task_status'] != last_status:
+                yield format_sse(event)
+                last_status = event['task_status']
+                last_write = loop.time()
+                if last_status in READY_STATES:
+                    return
+            now = loop.time()
+            if now >= deadline:
+                return
+            if now - last_write >= settings.TASK_EVENTS_HEARTBEAT:
+                yield b": keep-alive\n\n"
+                last_write = now
+            event = await next_event(min(deadline - now, settings.TASK_EVENTS_HEARTBEAT))
+    finally:
+        if queue is not None:
+            hub.unsubscribe(task_id, queue)
@@ -0,0 +1,151 @@
+# task_results.py
+"""
+Lecture groupée des statuts de tâches Celery dans le result backend.
+
+Au lieu d'un AsyncResult (une requête au backend) par tâche, les statuts
+de tout un lot sont lus en une fois : une requête SQL pour le backend
+django-db (django_celery_results), un MGET pour les backends clé/valeur
+(Redis...). Les autres backends retombent sur une lecture par tâche.
+
+L'empreinte (ETag) d'un lot ne dépend que des statuts et dates de fin : avec
+django-db, elle est calculée sur une requête réduite à ces colonnes, et les
+résultats ne sont lus et décodés que si le client n'a pas déjà cette version.
+
+La table de django_celery_results est purgée par lots (purge_stored_results,
+tâche périodique et commande purge_task_results).
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from celery import current_app
+from celery.backends.base import KeyValueStoreBackend
+from celery.result import AsyncResult
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .task_events import task_event
+
+logger = logging.getLogger(__name__)
+
+
+def _etag(states):
+    """states : {task_id: (statut, date de fin)}."""
+    fingerprint = '|'.join(f"{task_id}:{task_status}:{date_done}" for task_id, (task_status, date_done) in sorted(states.items()))
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:32]
+
+
+def _event_from_meta(task_id, meta):
+    if meta is None:
+        return task_event(task_id, 'PENDING')
+    task_status = meta['status']
+    if task_status == 'FAILURE':
+        return task_event(task_id, task_status, error=str(meta.get('result')))
+    return task_event(task_id, task_status, result=meta.get('result'))
+
+
+def _is_database_backend(backend):
+    try:
+        from django_celery_results.backends import DatabaseBackend
+    except ImportError:
+        return False
+    return isinstance(backend, DatabaseBackend)
+
+
+def _database_statuses(backend, task_ids, known_etags):
+    from django_celery_results.models import TaskResult
+
+    rows = TaskResult.objects.filter(task_id__in=task_ids)
+    states = {task_id: ('PENDING', None) for task_id in task_ids}
+    states.update({
+        task_id: (task_status, date_done)
+        for task_id, task_status, date_done in rows.values_list('task_id', 'status', 'date_done')
+    })
+    etag = _etag(states)
+    if etag in known_etags:
+        return etag, None
+
+    metas = {}
+    for obj in rows.only('task_id', 'status', 'result', 'content_type', 'content_encoding'):
+        metas[obj.task_id] = backend.meta_from_decoded({
+            'status': obj.status,
+            'result': backend.decode_content(obj, obj.result),
+        })
+    return etag, [_event_from_meta(task_id, metas.get(task_id)) for task_id in task_ids]
+
+
+def _key_value_statuses(backend, task_ids):
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = backend.mget(keys)
+    if hasattr(values, 'items'):
+        # Certains clients (memcached) renvoient un dict clé -> valeur
+        values = [values.get(key) for key in keys]
+    metas = {
+        task_id: backend.decode_result(value)
+        for task_id, value in zip(task_ids, values)
+        if value is not None
+    }
+    states = {}
+    for task_id in task_ids:
+        meta = metas.get(task_id)
+        states[task_id] = (meta['status'], meta.get('date_done')) if meta else ('PENDING', None)
+    return _etag(states), [_event_from_meta(task_id, metas.get(task_id)) for task_id in task_ids]
+
+
+def _generic_statuses(task_ids):
+    metas = {}
+    for task_id in task_ids:
+        task_result = AsyncResult(task_id)
+        metas[task_id] = {'status': task_result.status, 'result': task_result.result, 'date_done': task_result.date_done}
+    states = {task_id: (meta['status'], meta['date_done']) for task_id, meta in metas.items()}
+    return _etag(states), [_event_from_meta(task_id, metas[task_id]) for task_id in task_ids]
+
+
+def batch_task_statuses(task_ids, known_etags=()):
+    """
+    Retourne (etag, statuts) pour une liste d'identifiants de tâches, statuts
+    au format de TaskStatusView dans l'ordre demandé. Si l'empreinte du lot
+    figure dans `known_etags` (If-None-Match), les statuts valent None.
+    """
+    backend = current_app.backend
+    if _is_database_backend(backend):
+        return _database_statuses(backend, task_ids, known_etags)
+    if isinstance(backend, KeyValueStoreBackend):
+        etag, statuses = _key_value_statuses(backend, task_ids)
+    else:
+        etag, statuses = _generic_statuses(task_ids)
+    return etag, (None if etag in known_etags else statuses)
+
+
+def result_retention():
+    """Âge (secondes) au-delà duquel une ligne de django_celery_results est purgée."""
+    if settings.TASK_RESULT_STORE == 'redis':
+        # La table ne contient plus que les résultats archivés volontairement
+        return settings.TASK_RESULT_PERSIST_RETENTION
+    return settings.CELERY_RESULT_EXPIRES
+
+
+def purge_stored_results(max_age=None, batch_size=None, vacuum=False):
+    """
+    Supprime par lots les résultats plus vieux que `max_age` secondes de la
+    table de django_celery_results (pas de longue transaction ni de verrou
+    sur toute la table), puis la compacte (VACUUM ANALYZE, PostgreSQL) si
+    demandé. Retourne le nombre de lignes supprimées.
+    """
+    from django_celery_results.models import TaskResult
+
+    max_age = result_retention() if max_age is None else max_age
+    batch_size = batch_size or settings.TASK_RESULT_PURGE_BATCH_SIZE
+    expired = TaskResult.objects.filter(date_done__lt=timezone.now() - timedelta(seconds=max_age))
+    deleted = 0
+    while True:
+        ids = list(expired.order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += TaskResult.objects.filter(pk__in=ids).delete()[0]
+    if vacuum and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"VACUUM (ANALYZE) {TaskResult._meta.db_table}")
+    logger.info(f"{deleted} résultats de tâches purgés")
+    return deleted
@@ -1,34 +1,109 @@
 from celery import shared_task
-from .utils import get_available_resolutions, extract_video_metadata, build_yt_dlp_format
+from celery.signals import (
+    task_failure, task_prerun, task_retry, task_success, worker_process_init, worker_process_shutdown, worker_shutdown,
+)
+from .utils import (
+    get_available_resolutions, extract_video_metadata, canonicalize_video_url, matrix_handle,
+    TransientExtractionError, RateLimitedError,
+)
 from .models import DownloadStat
+from .cache import drop_cached_extraction, get_cached_matrix
+from .geoip import country_for_ip
+from .partitions import drop_expired_partitions, ensure_partitions
+from .refresh import publish_refreshed_url
+from .rollups import rebuild_recent_rollups
+from .routing import RECORD_TASK, RESOLUTIONS_TASK
+from .stat_buffer import buffer_stat, close_stat_buffer
+from .task_events import publish_task_event
+from .task_results import purge_stored_results
+from .ydl_pool import warm_pool
+from django.urls import reverse
 from django.utils import timezone
+from urllib.parse import urlencode
 import logging
-from yt_dlp.utils import ExtractorError
 
 logger = logging.getLogger(__name__)
 
-@shared_task(autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 60}, retry_backoff=True)
-def async_get_available_resolutions(video_url):
+MAX_RETRIES = 3
+
+# Seules les erreurs passagères sont retentées ; les limitations de débit sont
+# reprogrammées à la main selon le backoff de la plateforme (voir books/ratelimit.py).
+RETRY_OPTIONS = {
+    'autoretry_for': (TransientExtractionError,),
+    'dont_autoretry_for': (RateLimitedError,),
+    'retry_kwargs': {'max_retries': MAX_RETRIES, 'countdown': 60},
+    'retry_backoff': True,
+}
+
+
+@worker_process_init.connect
+def warm_worker(**kwargs):
+    """Prépare les instances YoutubeDL avant la première tâche du processus."""
+    warm_pool()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_stats(**kwargs):
+    """Écrit les statistiques encore en attente avant l'arrêt du processus."""
+    close_stat_buffer()
+
+
+# Tâches dont les clients suivent le statut (downloads/task-events/)
+CLIENT_TASKS = (RESOLUTIONS_TASK, RECORD_TASK)
+
+
+@task_prerun.connect
+def announce_started(sender=None, task_id=None, **kwargs):
+    if sender.name in CLIENT_TASKS:
+        publish_task_event(task_id, 'STARTED')
+
+
+@task_retry.connect
+def announce_retry(sender=None, request=None, **kwargs):
+    if sender.name in CLIENT_TASKS:
+        publish_task_event(request.id, 'RETRY')
+
+
+@task_success.connect
+def announce_success(sender=None, result=None, **kwargs):
+    # Envoyé après l'enregistrement du résultat : task-status/ le voit déjà
+    if sender.name in CLIENT_TASKS:
+        publish_task_event(sender.request.id, 'SUCCESS', result=result)
+
+
+@task_failure.connect
+def announce_failure(sender=None, task_id=None, exception=None, **kwargs):
+    if sender.name in CLIENT_TASKS:
+        publish_task_event(task_id, 'FAILURE', error=str(exception))
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def async_get_available_resolutions(self, video_url):
     """Tâche pour récupérer les résolutions de manière asynchrone"""
     try:
         return get_available_resolutions(video_url)
+    except RateLimitedError as e:
+        raise self.retry(exc=e, countdown=e.retry_after, max_retries=MAX_RETRIES)
     except Exception as e:
         logger.error(f"Erreur dans async_get_available_resolutions: {str(e)}")
         raise
 
-@shared_task(autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 60}, retry_backoff=True, retry_for=(Exception,))
-def async_extract_metadata_and_save(request_data, client_ip, user_agent, referer):
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def async_extract_metadata_and_save(self, request_data, client_ip, user_agent, referer):
     """Tâche pour extraire les métadonnées et sauvegarder les stats"""
     
     video_url = request_data.get('video_url')
     origine = request_data.get('origine_video')
     format_preference = request_data.get('format_preference', 'worst')
-    yt_dlp_format = build_yt_dlp_format(format_preference)
     
     try:
-        metadata = extract_video_metadata(video_url, yt_dlp_format)
+        # Servi par la matrice des formats si la vidéo a déjà été extraite
+        metadata = extract_video_metadata(video_url, format_preference)
         
-        DownloadStat.objects.create(
+        # Écrite par lots (books/stat_buffer.py) ; l'identifiant est réservé dès maintenant
+        download_id = buffer_stat(DownloadStat(
             url_telechargement=video_url,
             adresse_ip=client_ip,
             horodatage=timezone.now(),
@@ -37,41 +112,87 @@ def async_extract_metadata_and_save(request_data, client_ip, user_agent, referer
             referer=referer,
             duree_video=metadata.get('duration'),
             qualite_video=metadata.get('format'),
+            format_preference=format_preference,
             taille_fichier=metadata.get('filesize'),
             origine_video=origine,
-            direct_url=metadata.get('direct_url')
-        )
+            direct_url=metadata.get('direct_url'),
+            pays_ip=country_for_ip(client_ip),
+        ))
         
-        return {
+        result = {
             "download_url": metadata.get('direct_url'),
-            "format": metadata.get('format')
+            "format": metadata.get('format'),
+            # Handle stable pour downloads/proxy/ : l'URL directe y est rafraîchie si elle expire
+            "download_id": download_id,
         }
-    except ExtractorError as e:
-        if 'NsfwViewerHasNoStatedAge' in str(e):
-            # Enregistre l’erreur, mais ne retry pas
-            logger.error("Contenu NSFW non accessible pour ce tweet.")
-            DownloadStat.objects.create(
+        if metadata.get('needs_merge') and metadata.get('audio_stream_url'):
+            # Vidéo et audio séparés : lien vers la fusion à la volée
+            result["needs_merge"] = True
+            result["mux_url"] = f"{reverse('mux_download')}?" + urlencode({
+                'video': metadata['video_stream_url'],
+                'audio': metadata['audio_stream_url'],
+            })
+        return result
+    except Exception as e:
+        # Un seul enregistrement d'échec par demande : pas tant qu'un retry est prévu
+        will_retry = isinstance(e, TransientExtractionError) and self.request.retries < MAX_RETRIES
+        if not will_retry:
+            buffer_stat(DownloadStat(
                 url_telechargement=video_url,
                 adresse_ip=client_ip,
                 horodatage=timezone.now(),
                 statut_telechargement=False,
                 agent_utilisateur=user_agent,
                 referer=referer,
-                message_erreur="Contenu NSFW non accessible",
+                message_erreur=str(e),
+                format_preference=format_preference,
                 origine_video=origine,
-            )
-            return  # On ne raise pas, donc pas de retry
+                pays_ip=country_for_ip(client_ip),
+            ))
+        logger.error(f"Erreur dans async_extract_metadata_and_save: {str(e)}")
+        if isinstance(e, RateLimitedError):
+            raise self.retry(exc=e, countdown=e.retry_after, max_retries=MAX_RETRIES)
         raise
+
+
+@shared_task
+def async_refresh_direct_url(download_id, video_url, format_preference, stale_url):
+    """Tâche pour réextraire l'URL directe expirée d'un téléchargement relayé par le proxy"""
+    try:
+        canonical_url = canonicalize_video_url(video_url)
+        matrix = get_cached_matrix(matrix_handle(video_url))
+        entry = (matrix or {}).get('formats', {}).get(format_preference)
+        if entry is None or entry.get('direct_url') == stale_url:
+            # Le CDN a refusé une URL que le cache croyait encore valide
+            drop_cached_extraction(canonical_url)
+        metadata = extract_video_metadata(video_url, format_preference)
+        direct_url = metadata.get('direct_url')
+        if not direct_url:
+            raise ValueError("No single direct URL for this format.")
+
+        DownloadStat.objects.filter(pk=download_id).update(direct_url=direct_url)
+        publish_refreshed_url(download_id, stale_url, direct_url=direct_url)
+        return {"download_id": download_id, "download_url": direct_url}
     except Exception as e:
-        DownloadStat.objects.create(
-            url_telechargement=video_url,
-            adresse_ip=client_ip,
-            horodatage=timezone.now(),
-            statut_telechargement=False,
-            agent_utilisateur=user_agent,
-            referer=referer,
-            message_erreur=str(e),
-            origine_video=origine,
-        )
-        logger.error(f"Erreur dans async_extract_metadata_and_save: {str(e)}")
-        raise
\ No newline at end of file
+        # Pas de retry : les flux en attente abandonnent après PROXY_REFRESH_TIMEOUT
+        publish_refreshed_url(download_id, stale_url, error=str(e))
+        logger.error(f"Erreur dans async_refresh_direct_url: {str(e)}")
+        raise
+
+
+@shared_task
+def purge_task_results():
+    """Tâche périodique : purge des résultats expirés de la table de django_celery_results"""
+    return purge_stored_results()
+
+
+@shared_task
+def rebuild_stat_rollups():
+    """Tâche périodique : recalcul des agrégats horaires des dernières heures closes"""
+    return rebuild_recent_rollups()
+
+
+@shared_task
+def maintain_stat_partitions():
+    """Tâche périodique : partitions des mois à venir et rétention des téléchargements"""
+    return {"created": ensure_partitions(), "dropped": drop_expired_partitions()}
@@ -1,3 +1,590 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.db import OperationalError
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+
+from . import proxy
+from .content_cache import TOTAL_BYTES_KEY, CacheEntry, content_key, evict, track_size
+from .export import export_chunks
+from .models import DownloadStat
+from .refresh import HandleNotFound, StreamHandle, resolve_handle
+from .singleflight import Lease, single_flight
+from .stat_buffer import UNKNOWN_IP, StatBuffer, _pending_key, clean_stat, is_stat_pending
+from .proxy import UpstreamError, _refuse_internal_redirect, is_proxiable_url, open_upstream
+from .throttle import _acquire_slot, _take_grant
+from .utils import (
+    PermanentExtractionError, RateLimitedError, TransientExtractionError, _classify_download_error, _extract_info,
+    get_trusted_client_ip,
+)
+from .views import ProxyDownloadView, limit_streams
+
+
+PUBLIC_ADDRESS = '93.184.215.14'
+
+
+class ContentKeyTests(SimpleTestCase):
+
+    def test_direct_url_keeps_query(self):
+        # Même chemin, vidéos différentes : pas de collision
+        self.assertNotEqual(
+            content_key('https://cdn.example.com/videoplayback?id=1&sig=a'),
+            content_key('https://cdn.example.com/videoplayback?id=2&sig=a'),
+        )
+        self.assertEqual(
+            content_key('https://CDN.example.com/download.php?id=1'),
+            content_key('https://cdn.example.com/download.php?id=1'),
+        )
+
+    def test_handle_ignores_signature(self):
+        first = StreamHandle(1, 'https://www.youtube.com/watch?v=abc', '720p', 'https://cdn/x?sig=1', '720p')
+        renewed = StreamHandle(1, 'https://www.youtube.com/watch?v=abc', '720p', 'https://cdn/x?sig=2', '720p')
+        other_quality = StreamHandle(2, 'https://www.youtube.com/watch?v=abc', '360p', 'https://cdn/x?sig=1', '360p')
+        self.assertEqual(content_key(first.direct_url, first), content_key(renewed.direct_url, renewed))
+        self.assertNotEqual(content_key(first.direct_url, first), content_key(other_quality.direct_url, other_quality))
+        # Une URL directe seule ne retombe pas sur l'entrée d'un handle
+        self.assertNotEqual(content_key(first.direct_url, first), content_key(first.direct_url))
+
+    def test_handle_keyed_on_requested_format(self):
+        # Même libellé de qualité ('unknown'), formats demandés différents : entrées distinctes
+        best = StreamHandle(1, 'https://x.com/u/status/1', 'best', 'https://cdn/x?sig=1', 'best')
+        worst = StreamHandle(2, 'https://x.com/u/status/1', 'worst', 'https://cdn/y?sig=1', 'worst')
+        self.assertNotEqual(content_key(best.direct_url, best), content_key(worst.direct_url, worst))
+        # Ligne sans format enregistré : clé de l'URL directe exacte
+        legacy = StreamHandle(3, 'https://x.com/u/status/1', 'worst', 'https://cdn/y?sig=1')
+        self.assertEqual(content_key(legacy.direct_url, legacy), content_key(legacy.direct_url))
+
+
+def make_stat(pk, **fields):
+    values = dict(
+        url_telechargement=f"https://www.youtube.com/watch?v={pk}",
+        adresse_ip='203.0.113.7',
+        statut_telechargement=True,
+        qualite_video='720p',
+        origine_video='YouTube',
+    )
+    values.update(fields)
+    return DownloadStat(pk=pk, **values)
+
+
+@override_settings(STAT_BUFFER_MAX_PENDING=100)
+class StatBufferFlushTests(TransactionTestCase):
+
+    def test_bad_row_is_dropped_alone(self):
+        buffer = StatBuffer()
+        buffer.pending = [make_stat(1), make_stat(2, url_telechargement=None), make_stat(3)]
+        with self.assertLogs('books.stat_buffer', 'ERROR') as logs:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertIn('abandonnée', logs.output[-1])
+        self.assertEqual(sorted(DownloadStat.objects.values_list('pk', flat=True)), [1, 3])
+        self.assertEqual(buffer.pending, [])
+
+    def test_connection_error_requeues_batch(self):
+        buffer = StatBuffer()
+        batch = [make_stat(1), make_stat(2)]
+        buffer.pending = list(batch)
+        with mock.patch.object(DownloadStat.objects, 'bulk_create', side_effect=OperationalError('server closed')), \
+                self.assertLogs('books.stat_buffer', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending, batch)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(DownloadStat.objects.count(), 2)
+
+
+@override_settings(STAT_BUFFER_PENDING_TTL=5, PROXY_REFRESH_POLL_INTERVAL=0.02)
+class ResolveHandleTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_unknown_id_is_not_awaited(self):
+        started = time.monotonic()
+        with self.assertRaises(HandleNotFound):
+            await resolve_handle(download_id=404)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    async def test_pending_id_is_awaited_until_written(self):
+        buffer = StatBuffer()
+        stat = make_stat(7, direct_url='https://cdn.example.com/v.mp4')
+        await sync_to_async(cache.set)(_pending_key(7), True)
+        buffer.pending = [stat]
+        resolving = asyncio.ensure_future(resolve_handle(download_id=7))
+        await asyncio.sleep(0.1)
+        self.assertFalse(resolving.done())
+        await sync_to_async(buffer.flush)()
+        handle = await asyncio.wait_for(resolving, 1)
+        self.assertEqual(handle.direct_url, 'https://cdn.example.com/v.mp4')
+        self.assertFalse(is_stat_pending(7))
+
+
+class ExportTests(TransactionTestCase):
+
+    def test_csv_neutralizes_formulas(self):
+        DownloadStat.objects.create(
+            url_telechargement='https://www.youtube.com/watch?v=1', adresse_ip='203.0.113.7',
+            agent_utilisateur='=HYPERLINK("https://evil.example","x")', referer='@SUM(1+1)',
+            origine_video='-2+3', qualite_video='\t720p', taille_fichier=-1,
+        )
+        data = b''.join(export_chunks(DownloadStat.objects.all(), 'csv')).decode('utf-8')
+        row = data.splitlines()[1]
+        self.assertIn('"\'=HYPERLINK(""https://evil.example"",""x"")"', row)
+        self.assertIn("'@SUM(1+1)", row)
+        self.assertIn("'-2+3", row)
+        self.assertIn("'\t720p", row)
+        self.assertIn(',-1,', row)
+
+
+class RefreshFormatTests(TransactionTestCase):
+
+    async def test_handle_keeps_the_requested_format(self):
+        await sync_to_async(make_stat(8, qualite_video='unknown', format_preference='best', direct_url='https://cdn.example.com/8.mp4').save)()
+        await sync_to_async(make_stat(9, qualite_video='unknown', direct_url='https://cdn.example.com/9.mp4').save)()
+        self.assertEqual((await resolve_handle(download_id=8)).format_preference, 'best')
+        # Ligne enregistrée avant la colonne : repli historique
+        self.assertEqual((await resolve_handle(download_id=9)).format_preference, 'worst')
+
+
+class CleanStatTests(SimpleTestCase):
+
+    def test_client_values_fit_the_columns(self):
+        stat = clean_stat(make_stat(1, adresse_ip=' 198.51.100.4', origine_video='x' * 80, direct_url='https://cdn/' + 'a' * 2100))
+        self.assertEqual(stat.adresse_ip, '198.51.100.4')
+        self.assertEqual(len(stat.origine_video), 50)
+        self.assertIsNone(stat.direct_url)
+        self.assertEqual(clean_stat(make_stat(1, adresse_ip='unknown')).adresse_ip, UNKNOWN_IP)
+        self.assertEqual(clean_stat(make_stat(1, adresse_ip=None)).adresse_ip, UNKNOWN_IP)
+
+
+@override_settings(PROXY_MAX_STREAMS_PER_IP=1, PROXY_BANDWIDTH_PER_IP=0)
+class StreamSlotTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.request = AsyncRequestFactory().get('/proxy/', REMOTE_ADDR='198.51.100.9')
+
+    async def open_stream(self):
+        view = ProxyDownloadView()
+
+        async def body():
+            yield b'video'
+
+        async def handler():
+            return view.stream_response(body())
+
+        return await limit_streams(view, self.request, handler)
+
+    async def test_disconnect_before_first_chunk_releases_slot(self):
+        response = await self.open_stream()
+        self.assertEqual((await self.open_stream()).status_code, 429)
+        # Client parti avant le premier bloc : la réponse est fermée sans que le corps soit lu
+        await sync_to_async(response.close)()
+        self.assertTrue((await self.open_stream()).streaming)
+
+    async def test_slot_released_once(self):
+        response = await self.open_stream()
+        self.assertEqual([chunk async for chunk in response], [b'video'])
+        await sync_to_async(response.close)()
+        second = await self.open_stream()
+        self.assertTrue(second.streaming)
+        self.assertEqual((await self.open_stream()).status_code, 429)
+        await sync_to_async(second.close)()
+
+    async def test_forged_forwarded_for_shares_the_proxy_address(self):
+        view = ProxyDownloadView()
+
+        async def handler():
+            async def body():
+                yield b'video'
+            return view.stream_response(body())
+
+        factory = AsyncRequestFactory()
+        first = await limit_streams(view, factory.get('/proxy/', headers={'X-Forwarded-For': '10.0.0.1, 198.51.100.9'}), handler)
+        # Le client change le premier élément à chaque requête : même IP pour la limite
+        forged = factory.get('/proxy/', headers={'X-Forwarded-For': '10.0.0.2, 198.51.100.9'})
+        self.assertEqual((await limit_streams(view, forged, handler)).status_code, 429)
+        other_client = factory.get('/proxy/', headers={'X-Forwarded-For': '10.0.0.2, 198.51.100.10'})
+        second = await limit_streams(view, other_client, handler)
+        self.assertTrue(second.streaming)
+        await sync_to_async(first.close)()
+        await sync_to_async(second.close)()
+
+    @override_settings(PROXY_MAX_STREAMS_PER_IP=2, PROXY_STREAM_SLOT_TTL=60)
+    def test_leaked_slot_expires_on_its_own(self):
+        with mock.patch('books.throttle.time.time', return_value=1000):
+            self.assertTrue(_acquire_slot('198.51.100.9', 'leaked'))
+        # Les prises suivantes ne prolongent pas la place perdue
+        with mock.patch('books.throttle.time.time', return_value=1050):
+            self.assertTrue(_acquire_slot('198.51.100.9', 'second'))
+            self.assertFalse(_acquire_slot('198.51.100.9', 'third'))
+        with mock.patch('books.throttle.time.time', return_value=1070):
+            self.assertTrue(_acquire_slot('198.51.100.9', 'third'))
+
+
+class TrustedClientIpTests(SimpleTestCase):
+
+    def test_proxy_address_wins_over_client_supplied_hops(self):
+        factory = RequestFactory()
+        request = factory.get('/', HTTP_X_FORWARDED_FOR='10.0.0.1, 203.0.113.5', REMOTE_ADDR='172.18.0.2')
+        self.assertEqual(get_trusted_client_ip(request), '203.0.113.5')
+        request = factory.get('/', HTTP_X_REAL_IP='198.51.100.7', HTTP_X_FORWARDED_FOR='10.0.0.1, 203.0.113.5')
+        self.assertEqual(get_trusted_client_ip(request), '198.51.100.7')
+        self.assertEqual(get_trusted_client_ip(factory.get('/', REMOTE_ADDR='172.18.0.2')), '172.18.0.2')
+
+
+@override_settings(PROXY_BANDWIDTH_BURST=1)
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def take(self, at, buckets, amount=500):
+        with mock.patch('books.throttle.time.time', return_value=at):
+            return _take_grant(buckets, amount)
+
+    def test_bucket_refills_at_its_rate(self):
+        bucket = [('ip:198.51.100.9', 1000)]
+        # Seau plein au départ : une rafale d'une seconde de débit
+        self.assertEqual(self.take(1000, bucket), 0)
+        self.assertEqual(self.take(1000, bucket), 0)
+        self.assertAlmostEqual(self.take(1000, bucket), 0.5)
+        self.assertAlmostEqual(self.take(1000.25, bucket), 0.25)
+        self.assertEqual(self.take(1000.5, bucket), 0)
+
+    def test_take_is_all_or_nothing(self):
+        self.assertEqual(self.take(1000, [('global', 500)]), 0)
+        self.assertAlmostEqual(self.take(1000, [('ip:198.51.100.9', 1000), ('global', 500)]), 1)
+        # Le seau de l'IP n'a pas été débité par la prise refusée
+        self.assertEqual(self.take(1000, [('ip:198.51.100.9', 1000)], amount=1000), 0)
+
+
+class ProxyTargetTests(SimpleTestCase):
+
+    async def test_internal_addresses_are_refused(self):
+        for address in ('127.0.0.1', '10.0.0.5', '169.254.169.254', '::1', 'fe80::1', '::ffff:192.168.1.1'):
+            with mock.patch('books.proxy._resolve_host', return_value=[address]):
+                self.assertFalse(await is_proxiable_url('https://cdn.example.com/v.mp4'), address)
+        # Une seule adresse interne parmi celles de l'hôte suffit à le refuser
+        with mock.patch('books.proxy._resolve_host', return_value=[PUBLIC_ADDRESS, '10.0.0.5']):
+            self.assertFalse(await is_proxiable_url('https://cdn.example.com/v.mp4'))
+        with mock.patch('books.proxy._resolve_host', return_value=[PUBLIC_ADDRESS]):
+            self.assertTrue(await is_proxiable_url('https://cdn.example.com/v.mp4'))
+        self.assertFalse(await is_proxiable_url('file:///etc/passwd'))
+
+    @override_settings(PROXY_MODE='nginx', PROXY_MAX_STREAMS_PER_IP=0, PROXY_CACHE_MAX_BYTES=0)
+    async def test_nginx_never_gets_an_internal_target(self):
+        response = await AsyncClient().get('/api/downloads/proxy/', {'url': 'http://127.0.0.1:8000/admin/'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('X-Accel-Redirect'))
+
+    async def test_redirect_to_internal_address_is_refused(self):
+        def upstream(request):
+            return httpx.Response(302, headers={'location': 'http://169.254.169.254/latest/meta-data/'})
+
+        proxy._client = httpx.AsyncClient(
+            transport=httpx.MockTransport(upstream), follow_redirects=True,
+            event_hooks={'response': [_refuse_internal_redirect]},
+        )
+        proxy._client_loop = asyncio.get_running_loop()
+        with mock.patch('books.proxy._resolve_host', side_effect=lambda host: [host]), \
+                self.assertLogs('books.proxy', 'WARNING'):
+            with self.assertRaises(UpstreamError):
+                await open_upstream('https://93.184.215.14/v.mp4')
+
+
+VIDEO = os.urandom(200_000)
+
+
+class ProxyCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.upstream_requests = []
+        settings_override = override_settings(
+            PROXY_CACHE_DIR=self.cache_dir, PROXY_CACHE_MAX_BYTES=10 * len(VIDEO), PROXY_MODE='python',
+            PROXY_MAX_STREAMS_PER_IP=0, PROXY_BANDWIDTH_PER_IP=0, PROXY_BANDWIDTH_GLOBAL=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        resolver = mock.patch('books.proxy._resolve_host', return_value=[PUBLIC_ADDRESS])
+        resolver.start()
+        self.addCleanup(resolver.stop)
+
+    def upstream(self, request):
+        self.upstream_requests.append(request.headers.get('range'))
+        return httpx.Response(
+            200, headers={'content-type': 'video/mp4', 'content-length': str(len(VIDEO))}, content=VIDEO
+        )
+
+    async def get(self, url, **headers):
+        proxy._client = httpx.AsyncClient(transport=httpx.MockTransport(self.upstream))
+        proxy._client_loop = asyncio.get_running_loop()
+        response = await AsyncClient().get('/api/downloads/proxy/', {'url': url}, secure=True, headers=headers)
+        body = b''.join([chunk async for chunk in response.streaming_content]) if response.streaming else response.content
+        await sync_to_async(response.close)()
+        return response, body
+
+    async def test_fill_then_hit(self):
+        url = 'https://cdn.example.com/videoplayback?id=1'
+        response, body = await self.get(url)
+        self.assertEqual(body, VIDEO)
+        entry = CacheEntry(content_key(url))
+        self.assertTrue(os.path.exists(entry.path))
+        self.assertEqual(cache.get(TOTAL_BYTES_KEY), len(VIDEO))
+
+        response, body = await self.get(url)
+        self.assertEqual(body, VIDEO)
+        self.assertEqual(response['ETag'], entry.etag({'size': len(VIDEO)}))
+        self.assertEqual(len(self.upstream_requests), 1)
+
+    async def test_partial_range_from_cache(self):
+        url = 'https://cdn.example.com/videoplayback?id=2'
+        await self.get(url)
+        response, body = await self.get(url, Range='bytes=1000-1999')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 1000-1999/{len(VIDEO)}")
+        self.assertEqual(body, VIDEO[1000:2000])
+        response, body = await self.get(url, Range=f"bytes={len(VIDEO)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(len(self.upstream_requests), 1)
+
+    async def test_eviction_keeps_recent_entries(self):
+        urls = [f'https://cdn.example.com/download.php?id={index}' for index in range(3)]
+        with override_settings(PROXY_CACHE_MAX_BYTES=2 * len(VIDEO), PROXY_CACHE_EVICT_TARGET=1):
+            for url in urls:
+                await self.get(url)
+        kept = [os.path.exists(CacheEntry(content_key(url)).path) for url in urls]
+        self.assertEqual(kept, [False, True, True])
+        self.assertEqual(cache.get(TOTAL_BYTES_KEY), 2 * len(VIDEO))
+
+
+@override_settings(REDIS_URL=None, SINGLEFLIGHT_LEASE_TTL=1, SINGLEFLIGHT_POLL_INTERVAL=0.02)
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_callers_compute_once(self):
+        published = {}
+        calls = []
+
+        def compute():
+            calls.append(threading.get_ident())
+            # Plus long que le TTL du bail : il doit être prolongé
+            time.sleep(1.5)
+            published['result'] = 'info'
+            return 'info'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(single_flight('video', lambda: published.get('result'), compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['info'] * 5)
+        self.assertIsNone(cache.get('singleflight:lease:video'))
+
+    def test_release_keeps_a_lease_taken_over(self):
+        expired = Lease('video')
+        self.assertTrue(expired.acquire())
+        cache.delete(expired.key)  # expiré
+        current = Lease('video')
+        self.assertTrue(current.acquire())
+        expired.release()
+        self.assertFalse(expired.extend())
+        self.assertEqual(cache.get(current.key), current.token)
+
+    def test_redis_outage_computes_without_coalescing(self):
+        import redis
+
+        with mock.patch.object(Lease, 'acquire', side_effect=redis.ConnectionError('Connection refused')), \
+                self.assertLogs('books.singleflight', 'WARNING'):
+            self.assertEqual(single_flight('video', lambda: None, lambda: 'direct'), 'direct')
+        with mock.patch('books.singleflight.cache.get', side_effect=redis.TimeoutError('Timeout')), \
+                self.assertLogs('books.singleflight', 'WARNING'):
+            self.assertEqual(single_flight('video', lambda: None, lambda: 'direct'), 'direct')
+
+    @override_settings(SINGLEFLIGHT_WAIT_TIMEOUT=0.2)
+    def test_wait_is_capped(self):
+        holder = Lease('video')
+        self.assertTrue(holder.acquire())
+        started = time.monotonic()
+        with self.assertLogs('books.singleflight', 'WARNING'):
+            self.assertEqual(single_flight('video', lambda: None, lambda: 'local'), 'local')
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class MuxHeadTests(SimpleTestCase):
+
+    async def test_head_does_not_start_ffmpeg(self):
+        params = {'video': 'https://cdn.example.com/v.mp4', 'audio': 'https://cdn.example.com/a.m4a'}
+        with mock.patch('books.views.StreamMuxer') as muxer, \
+                mock.patch('books.proxy._resolve_host', return_value=[PUBLIC_ADDRESS]):
+            response = await AsyncClient().head('/api/downloads/mux/', params, secure=True)
+            missing = await AsyncClient().head('/api/downloads/mux/', {'video': params['video']}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(missing.status_code, 400)
+        muxer.assert_not_called()
+
+
+class StalledWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def test_stalled_writer_does_not_publish_another_fill(self):
+        with override_settings(PROXY_CACHE_DIR=self.cache_dir, PROXY_CACHE_STALL_TIMEOUT=0):
+            entry = CacheEntry(content_key('https://cdn.example.com/videoplayback?id=9'))
+            slow = entry.claim()
+            slow.start('video/mp4', len(VIDEO))
+            # Client lent : l'écrivain est jugé mort et l'entrée réservée par un autre
+            os.utime(entry.part_path, (0, 0))
+            self.assertIsNone(entry.filling_meta())
+            fast = entry.claim()
+            fast.start('video/mp4', len(VIDEO))
+            fast.write(VIDEO[:1000])
+
+            slow.write(VIDEO)
+            slow.commit()
+            self.assertFalse(os.path.exists(entry.path))
+            self.assertTrue(os.path.exists(entry.part_path))
+
+            fast.write(VIDEO[1000:])
+            fast.commit()
+            with open(entry.path, 'rb') as f:
+                self.assertEqual(f.read(), VIDEO)
+
+
+class EvictionTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def add_entry(self, name, size, mtime):
+        path = os.path.join(self.cache_dir, name[:2], name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_disk_walked_only_over_budget(self):
+        with override_settings(PROXY_CACHE_DIR=self.cache_dir, PROXY_CACHE_MAX_BYTES=300, PROXY_CACHE_EVICT_TARGET=0.7):
+            oldest = self.add_entry('aa01', 100, 1000)
+            self.add_entry('bb02', 100, 2000)
+            track_size(100)  # total inconnu : mesuré sur disque
+            self.assertEqual(cache.get(TOTAL_BYTES_KEY), 200)
+            newest = self.add_entry('cc03', 100, 3000)
+            with mock.patch('books.content_cache.os.walk', side_effect=AssertionError('walk')):
+                track_size(100)
+            self.add_entry('dd04', 100, 4000)
+            track_size(100)
+            # 400 > 300 : les plus anciennes partent jusqu'à 210 octets
+            self.assertFalse(os.path.exists(oldest))
+            self.assertTrue(os.path.exists(newest))
+            self.assertEqual(cache.get(TOTAL_BYTES_KEY), 200)
+            self.assertEqual(evict(0), 0)
+
+
+def wrapped_download_error(cause):
+    """DownloadError telle que la lève YoutubeDL.extract_info pour une erreur de l'extracteur causée par `cause`."""
+    from yt_dlp.utils import DownloadError, ExtractorError
+
+    try:
+        try:
+            raise cause
+        except Exception as e:
+            raise ExtractorError('Unable to download webpage', cause=e)
+    except ExtractorError as e:
+        return DownloadError(f"ERROR: {e}", sys.exc_info())
+
+
+class ClassifyDownloadErrorTests(SimpleTestCase):
+
+    def test_timeout_is_transient(self):
+        from yt_dlp.networking.exceptions import TransportError
+
+        for platform in ('TikTok', 'Twitter', 'Instagram', 'Facebook', 'Other'):
+            error = _classify_download_error(platform, wrapped_download_error(TransportError('The read operation timed out')))
+            self.assertIs(type(error), TransientExtractionError, platform)
+
+    def test_http_status(self):
+        from yt_dlp.networking import Response
+        from yt_dlp.networking.exceptions import HTTPError
+
+        def http_error(status):
+            return HTTPError(Response(io.BytesIO(b''), 'https://www.tiktok.com/@a/video/1', {}, status=status))
+
+        self.assertIs(type(_classify_download_error('TikTok', wrapped_download_error(http_error(503)))), TransientExtractionError)
+        self.assertIsInstance(_classify_download_error('TikTok', wrapped_download_error(http_error(429))), RateLimitedError)
+        self.assertIsInstance(_classify_download_error('TikTok', wrapped_download_error(http_error(404))), PermanentExtractionError)
+
+    def test_content_error_stays_permanent(self):
+        from yt_dlp.utils import DownloadError, ExtractorError
+
+        try:
+            raise ExtractorError('Private video', expected=True)
+        except ExtractorError:
+            error = DownloadError('ERROR: Private video', sys.exc_info())
+        self.assertIsInstance(_classify_download_error('TikTok', error), PermanentExtractionError)
+
+
+@override_settings(REDIS_URL=None)
+class ExtractionBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['extraction'].clear()
+
+    def extract(self, url, error):
+        ydl = mock.Mock()
+        ydl.extract_info.side_effect = error
+        with mock.patch('books.utils.CircuitBreaker') as breaker_class:
+            with self.assertRaises(Exception) as raised:
+                _extract_info(ydl, url)
+        return breaker_class.return_value, raised.exception
+
+    def test_timeout_counts_as_failure(self):
+        from yt_dlp.networking.exceptions import TransportError
+
+        breaker, error = self.extract(
+            'https://www.tiktok.com/@a/video/1', wrapped_download_error(TransportError('The read operation timed out'))
+        )
+        self.assertIsInstance(error, TransientExtractionError)
+        breaker.record_failure.assert_called_once()
+        breaker.record_success.assert_not_called()
+
+    def test_only_answered_content_errors_count_as_success(self):
+        from yt_dlp.utils import DownloadError, ExtractorError
+
+        def content_error(message):
+            try:
+                raise ExtractorError(message, expected=True)
+            except ExtractorError:
+                return DownloadError(f"ERROR: {message}", sys.exc_info())
+
+        breaker, _ = self.extract('https://www.tiktok.com/@a/video/2', content_error('Private video'))
+        breaker.record_success.assert_called_once()
+        breaker, _ = self.extract('https://example.com/page', content_error('Unsupported URL: https://example.com/page'))
+        breaker.record_success.assert_not_called()
+        breaker.record_failure.assert_not_called()
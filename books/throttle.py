@@ -0,0 +1,247 @@
+# throttle.py
+"""
+Limites du proxy par adresse IP : nombre de téléchargements simultanés et
+débit (seau à jetons), plus un débit global pour tout le service.
+
+Les compteurs vivent dans le cache partagé (Redis en production), donc
+valent pour tous les workers web. Les flux en cours d'une IP sont un
+ensemble trié Redis de jetons horodatés : chaque place expire d'elle-même
+PROXY_STREAM_SLOT_TTL secondes après sa prise, si un worker tué ne l'a pas
+libérée (un seul TTL pour toute la clé serait prolongé à chaque nouveau
+flux). Sans REDIS_URL (développement), l'ensemble est tenu dans le cache
+local du processus. Le débit passe par des seaux à jetons (un par IP, un
+global) : chacun se remplit au débit autorisé jusqu'à PROXY_BANDWIDTH_BURST
+secondes de débit, et la prise est atomique et tout ou rien sur les seaux
+d'un flux (script Lua sur Redis). Pour ne pas solliciter le cache à chaque
+bloc, un flux y réserve son débit par grosses tranches
+(PROXY_BANDWIDTH_GRANT octets) ; si un seau n'en contient pas assez, il
+attend avec asyncio.sleep le temps qu'il se remplisse. Les appels au cache passent par un thread (sync_to_async,
+thread_sensitive=False) et l'attente n'occupe ni la boucle ni un thread.
+
+La place d'un flux est libérée à la fermeture de la réponse (closer
+enregistré par la vue), que son corps ait été lu ou non : un client qui se
+déconnecte avant le premier bloc ne la garde pas.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+import uuid
+from contextlib import aclosing
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+# Prise d'une place, atomique : purge des places expirées, compte, ajout du jeton
+ACQUIRE_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Prise d'une tranche dans des seaux à jetons (KEYS, débits ARGV[4..]), tout ou
+# rien : retourne 0 si accordée, sinon l'attente en ms avant qu'elle le soit
+TAKE_GRANT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local amount = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[3 + i])
+    local capacity = rate * burst
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = capacity
+    if state[1] then
+        tokens = math.min(capacity, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+    end
+    levels[i] = tokens
+    if tokens < amount then
+        wait = math.max(wait, (amount - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return math.ceil(wait * 1000)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', levels[i] - amount, 'updated', now)
+    redis.call('EXPIRE', key, math.ceil(burst) + 1)
+end
+return 0
+"""
+
+_redis = None
+_acquire_script = None
+_take_grant_script = None
+_local_lock = threading.Lock()
+
+
+def _streams_key(client_ip):
+    return f"proxy:streams:{client_ip}"
+
+
+def _get_redis():
+    global _redis, _acquire_script, _take_grant_script
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+        _acquire_script = _redis.register_script(ACQUIRE_SLOT_SCRIPT)
+        _take_grant_script = _redis.register_script(TAKE_GRANT_SCRIPT)
+    return _redis
+
+
+def _acquire_slot(client_ip, token):
+    key = _streams_key(client_ip)
+    ttl = settings.PROXY_STREAM_SLOT_TTL
+    now = time.time()
+    if settings.REDIS_URL:
+        _get_redis()
+        return bool(_acquire_script(keys=[key], args=[now, ttl, settings.PROXY_MAX_STREAMS_PER_IP, token]))
+    with _local_lock:
+        slots = {held: taken for held, taken in (cache.get(key) or {}).items() if taken > now - ttl}
+        if len(slots) >= settings.PROXY_MAX_STREAMS_PER_IP:
+            return False
+        slots[token] = now
+        cache.set(key, slots, timeout=ttl)
+    return True
+
+
+def _release_slot(client_ip, token):
+    key = _streams_key(client_ip)
+    if settings.REDIS_URL:
+        _get_redis().zrem(key, token)
+        return
+    with _local_lock:
+        slots = cache.get(key) or {}
+        if slots.pop(token, None) is not None:
+            cache.set(key, slots, timeout=settings.PROXY_STREAM_SLOT_TTL)
+
+
+class StreamSlot:
+    """
+    Place de téléchargement simultané d'une IP, libérée une seule fois : à
+    la fin du flux ou à la fermeture de la réponse, au premier des deux.
+    """
+
+    def __init__(self, client_ip, held=True):
+        self.client_ip = client_ip
+        self.token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._released = not held
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            _release_slot(self.client_ip, self.token)
+        except Exception as e:
+            logger.warning(f"Compteur de flux indisponible: {str(e)}")
+
+    async def arelease(self):
+        if not self._released:
+            await sync_to_async(self.release, thread_sensitive=False)()
+
+
+async def acquire_stream_slot(client_ip):
+    """Réserve une place de téléchargement simultané pour l'IP ; None si la limite est atteinte."""
+    if not settings.PROXY_MAX_STREAMS_PER_IP:
+        return StreamSlot(client_ip, held=False)
+    slot = StreamSlot(client_ip)
+    try:
+        acquired = await sync_to_async(_acquire_slot, thread_sensitive=False)(client_ip, slot.token)
+    except Exception as e:
+        # Le cache n'est qu'un garde-fou : on laisse passer plutôt que de tout bloquer
+        logger.warning(f"Compteur de flux indisponible: {str(e)}")
+        return StreamSlot(client_ip, held=False)
+    return slot if acquired else None
+
+
+def _take_grant(buckets, amount):
+    """
+    Prélève `amount` octets dans chaque seau (nom, débit en octets/s) ; tout
+    ou rien. Retourne 0 si la tranche est accordée, sinon le délai en secondes
+    avant que tous les seaux en contiennent assez.
+    """
+    now = time.time()
+    burst = settings.PROXY_BANDWIDTH_BURST
+    keys = [f"proxy:bandwidth:{name}" for name, _ in buckets]
+    if settings.REDIS_URL:
+        _get_redis()
+        return _take_grant_script(keys=keys, args=[now, amount, burst] + [rate for _, rate in buckets]) / 1000
+    with _local_lock:
+        states = cache.get_many(keys)
+        levels = []
+        wait = 0
+        for key, (_, rate) in zip(keys, buckets):
+            capacity = rate * burst
+            tokens, updated = states.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            levels.append(tokens)
+            if tokens < amount:
+                wait = max(wait, (amount - tokens) / rate)
+        if wait:
+            return wait
+        cache.set_many({key: (tokens - amount, now) for key, tokens in zip(keys, levels)}, timeout=math.ceil(burst) + 1)
+    return 0
+
+
+class BandwidthShaper:
+    """Débit d'un flux, prélevé sur le seau de son IP et sur le seau global."""
+
+    def __init__(self, client_ip):
+        self.buckets = []
+        if settings.PROXY_BANDWIDTH_PER_IP:
+            self.buckets.append((f"ip:{client_ip}", settings.PROXY_BANDWIDTH_PER_IP))
+        if settings.PROXY_BANDWIDTH_GLOBAL:
+            self.buckets.append(('global', settings.PROXY_BANDWIDTH_GLOBAL))
+        # Une tranche ne peut dépasser la capacité d'un seau
+        burst = settings.PROXY_BANDWIDTH_BURST
+        self.grant = int(min([settings.PROXY_BANDWIDTH_GRANT] + [rate * burst for _, rate in self.buckets]))
+        self.allowance = 0
+
+    async def consume(self, size):
+        if not self.buckets:
+            return
+        while self.allowance < size:
+            await self._wait_for_grant()
+        self.allowance -= size
+
+    async def _wait_for_grant(self):
+        while True:
+            try:
+                wait = await sync_to_async(_take_grant, thread_sensitive=False)(self.buckets, self.grant)
+            except Exception as e:
+                logger.warning(f"Seau de débit indisponible: {str(e)}")
+                wait = 0
+            if not wait:
+                self.allowance += self.grant
+                return
+            # Seau trop bas : attente non bloquante le temps qu'il se remplisse
+            await asyncio.sleep(max(0.01, wait))
+
+
+async def throttled(chunks, slot):
+    """
+    Relaie un corps de réponse au débit autorisé pour l'IP, et libère sa place
+    de téléchargement simultané dès la fin du flux.
+    """
+    shaper = BandwidthShaper(slot.client_ip)
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await shaper.consume(len(chunk))
+                yield chunk
+    finally:
+        await slot.arelease()
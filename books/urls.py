@@ -5,8 +5,13 @@ from .views import (
     DownloadStatsTimeSeriesAPIView,
     DownloadStatsByQualityAPIView,
     DownloadStatsByCountryAPIView,
+    DownloadStatsExportAPIView,
+    FormatMatrixView,
+    MuxDownloadView,
     ProxyDownloadView,
     RegisterAPIView,
+    TaskEventsView,
+    TaskStatusBatchView,
     TaskStatusView,
     get_formats_video
 )
@@ -21,15 +26,28 @@ urlpatterns = [
     # Endpoint pour les obtenir les formats disponibles (public)
     path('downloads/formats/', get_formats_video, name='get_formats_videos'),
 
+    # Endpoint pour lire la matrice des formats d'une vidéo déjà extraite (public)
+    path('downloads/formats/matrix/<str:matrix_id>/', FormatMatrixView.as_view(), name='format_matrix'),
+
+    # Endpoint pour vérifier le statut de plusieurs tâches en une requête, avec ETag (public)
+    path('downloads/task-status/', TaskStatusBatchView.as_view(), name='task_status_batch'),
+
     # Endpoint pour vérifier le statut d'une tâche (public)
     path('downloads/task-status/<str:task_id>/', TaskStatusView.as_view(), name='task_status'),
 
+    # Endpoint pour suivre le statut d'une tâche en Server-Sent Events (public)
+    path('downloads/task-events/<str:task_id>/', TaskEventsView.as_view(), name='task_events'),
+
     # Endpoint pour le téléchargement via un proxy (public)
     path('downloads/proxy/', ProxyDownloadView.as_view(), name='proxy_download'),
 
+    # Endpoint pour télécharger un format vidéo + audio fusionné à la volée (public)
+    path('downloads/mux/', MuxDownloadView.as_view(), name='mux_download'),
+
     # Endpoints pour les statistiques (protégés par authentification)
     path('stats/overview/', DownloadStatsOverviewAPIView.as_view(), name='stats_overview'),
     path('stats/timeseries/', DownloadStatsTimeSeriesAPIView.as_view(), name='stats_timeseries'),
     path('stats/by-quality/', DownloadStatsByQualityAPIView.as_view(), name='stats_by_quality'),
     path('stats/by-country/', DownloadStatsByCountryAPIView.as_view(), name='stats_by_country'),
+    path('stats/export/', DownloadStatsExportAPIView.as_view(), name='stats_export'),
 ]
\ No newline at end of file
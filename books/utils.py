@@ -1,143 +1,385 @@
 # utils.py
-import yt_dlp
-import re, logging
+# yt_dlp n'est importé qu'à l'usage (workers Celery) : le processus web importe
+# ce module pour les helpers légers sans charger tout l'arbre des extracteurs.
+import re, logging, copy
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .cache import (
+    url_digest, get_cached_info, set_cached_info, get_cached_failure, set_cached_failure,
+    get_cached_matrix, set_cached_matrix,
+)
+from .singleflight import single_flight
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .ratelimit import note_rate_limited, backoff_remaining
 
 logger = logging.getLogger(__name__)
 
-def get_available_resolutions(video_url):
+# Paramètres de requête qui identifient réellement une vidéo (les autres sont du tracking / partage)
+SIGNIFICANT_QUERY_PARAMS = {'v', 'id', 'fbid', 'story_fbid'}
+
+# Marqueurs yt-dlp d'une limitation de débit / d'un blocage temporaire par la plateforme
+RATE_LIMIT_MARKERS = ('HTTP Error 429', 'Too Many Requests', 'rate-limit', 'rate limit', 'rate_limit')
+
+
+# --- Taxonomie des erreurs d'extraction (pilote la politique de retry des tâches) ---
+class ExtractionError(Exception):
+    """Erreur d'extraction d'une vidéo."""
+
+    def __init__(self, message, platform=None):
+        super().__init__(message)
+        self.platform = platform
+
+
+class PermanentExtractionError(ExtractionError):
     """
-    Retourne la liste des résolutions disponibles pour une vidéo.
-    Exemple : ['144p', '360p', '720p']
+    Erreur définitive (vidéo privée, NSFW, connexion requise...) : aucun retry.
+    `platform_answered` est faux quand la plateforme n'a pas été interrogée
+    (lien non supporté) : l'erreur ne dit rien de sa disponibilité.
     """
-    ydl_opts = {
-        'quiet': True,
-        'skip_download': True,
-        'no_warnings': True,
-        'socket_timeout': 10,
-        'format': 'bestvideo*+bestaudio/best',
-    }
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    def __init__(self, message, platform=None, platform_answered=True):
+        super().__init__(message, platform)
+        self.platform_answered = platform_answered
+
+
+class TransientExtractionError(ExtractionError):
+    """Erreur passagère (réseau, timeout, 5xx) : retry avec backoff."""
+
+
+class RateLimitedError(TransientExtractionError):
+    """La plateforme nous limite : retry après le backoff de la plateforme."""
+
+    def __init__(self, message, platform=None, retry_after=None):
+        super().__init__(message, platform)
+        self.retry_after = retry_after
+
+
+def canonicalize_video_url(video_url):
+    """
+    Normalise une URL de vidéo pour l'utiliser comme clé de cache.
+    Exemple : 'https://www.TikTok.com/@u/video/1?is_from_webapp=1#x' -> 'https://tiktok.com/@u/video/1'
+    """
+    parts = urlsplit(video_url.strip())
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query) if key in SIGNIFICANT_QUERY_PARAMS
+    ))
+    return urlunsplit(('https', host, path, query, ''))
+
+
+def detect_platform(url):
+    """
+    Retourne la plateforme d'origine d'une URL de vidéo.
+    Exemple : 'https://x.com/u/status/1' -> 'Twitter'
+    """
+    url = url.lower()
+    if "twitter.com" in url or "x.com" in url:
+        return "Twitter"
+    if "tiktok.com" in url:
+        return "TikTok"
+    if "instagram.com" in url:
+        return "Instagram"
+    if "facebook.com" in url or "fb.watch" in url:
+        return "Facebook"
+    if "youtube.com" in url or "youtu.be" in url:
+        return "YouTube"
+    return "Other"
+
+
+def _strip_selected_format(info):
+    """
+    Retire du dict d'infos les champs recopiés depuis le format sélectionné,
+    pour qu'une nouvelle sélection (autre format_preference) reparte de zéro.
+    """
+    format_keys = set().union(*(fmt.keys() for fmt in info.get('formats') or []))
+    format_keys |= {'format', 'format_id', 'requested_formats', 'resolution'}
+    format_keys -= {'formats', 'id', 'title', 'duration', 'language'}
+    return {key: value for key, value in info.items() if key not in format_keys}
+
+
+def _network_failure(original):
+    """
+    Exception réseau à l'origine de l'erreur (timeout, connexion coupée, 5xx
+    ou 429), ou None. yt-dlp marque ces erreurs « expected » comme celles du
+    contenu : seule la cause permet de les distinguer.
+    """
+    from yt_dlp.networking.exceptions import HTTPError, TransportError
+
+    seen = set()
+    pending = [original]
+    while pending:
+        cause = pending.pop()
+        if cause is None or id(cause) in seen:
+            continue
+        seen.add(id(cause))
+        if isinstance(cause, TransportError):
+            return cause
+        if isinstance(cause, HTTPError) and (cause.status >= 500 or cause.status == 429):
+            return cause
+        exc_info = getattr(cause, 'exc_info', None)
+        pending += [getattr(cause, 'cause', None), exc_info[1] if exc_info else None, cause.__cause__, cause.__context__]
+    return None
+
+
+def _classify_download_error(platform, error):
+    """
+    Convertit une DownloadError yt-dlp en erreur typée, avec un message
+    en anglais adapté à la plateforme.
+    """
+    import yt_dlp
+
+    err_str = str(error)
+    original = error.exc_info[1] if getattr(error, 'exc_info', None) else None
+
+    if any(marker in err_str for marker in RATE_LIMIT_MARKERS):
+        return RateLimitedError(f"{platform} is limiting our requests. Please try again later.", platform)
+
+    network_error = _network_failure(original)
+    if network_error is not None and platform != "YouTube":
+        if getattr(network_error, 'status', None) == 429:
+            return RateLimitedError(f"{platform} is limiting our requests. Please try again later.", platform)
+        return TransientExtractionError(f"{platform} could not be reached. Please try again later.", platform)
+
+    # yt-dlp marque comme « expected » les erreurs liées au contenu (privé, supprimé, login...)
+    expected = isinstance(original, yt_dlp.utils.ExtractorError) and original.expected
+    error_class = PermanentExtractionError if expected else TransientExtractionError
+
+    # Custom error messages in English
+    if platform == "Twitter":
+        if "NsfwViewerHasNoStatedAge" in err_str:
+            return PermanentExtractionError("This tweet contains sensitive (NSFW) content and cannot be downloaded without authentication.", platform)
+        if "Requested tweet is unavailable" in err_str:
+            return PermanentExtractionError("The requested tweet is unavailable or private.", platform)
+        return error_class("Unable to download this Twitter video. Please check that the tweet is public and accessible.", platform)
+    elif platform == "TikTok":
+        if "Video unavailable" in err_str or "Private video" in err_str:
+            return PermanentExtractionError("The TikTok video is private or unavailable.", platform)
+        return error_class("Unable to download this TikTok video. Please check the video is public and accessible.", platform)
+    elif platform == "Instagram":
+        if "login required" in err_str:
+            return PermanentExtractionError("Instagram video requires login to download.", platform)
+        return error_class("Unable to download this Instagram video. Please check the video is public and accessible.", platform)
+    elif platform == "Facebook":
+        if "login required" in err_str:
+            return PermanentExtractionError("Facebook video requires login to download.", platform)
+        return error_class("Unable to download this Facebook video. Please check the video is public and accessible.", platform)
+    elif platform == "YouTube":
+        return PermanentExtractionError("YouTube downloading is not supported on this platform.", platform, platform_answered=False)
+    else:
+        if "Unsupported URL" in err_str:
+            return PermanentExtractionError(
+                "This link is not supported. Please check the link or platform.", platform, platform_answered=False
+            )
+        return error_class("Error extracting video. Please check the link or platform.", platform)
+
+
+def _extract_info(ydl, video_url):
+    """
+    Retourne le dict d'infos complet de la vidéo, servi par le cache partagé
+    quand une extraction récente existe pour la même URL canonique.
+    Les extractions simultanées d'une même URL sont coalescées entre workers.
+    Lève une ExtractionError typée (ou CircuitOpenError) en cas d'échec.
+    """
+    import yt_dlp
+
+    canonical_url = canonicalize_video_url(video_url)
+    platform = detect_platform(video_url)
+    info = get_cached_info(canonical_url)
+    if info is not None:
+        return info
+
+    # Lien déjà en échec définitif récemment : inutile de rappeler la plateforme
+    failure = get_cached_failure(canonical_url)
+    if failure is not None:
+        raise PermanentExtractionError(failure, platform)
+
+    remaining = backoff_remaining(platform)
+    if remaining:
+        raise RateLimitedError(f"{platform} is limiting our requests. Please try again later.", platform, remaining)
+
+    # Plateforme en panne : on échoue tout de suite au lieu d'attendre socket_timeout
+    breaker = CircuitBreaker(platform)
+    breaker.check()
+
+    def extract():
+        try:
             info = ydl.extract_info(video_url, download=False)
+        except yt_dlp.utils.DownloadError as e:
+            error = _classify_download_error(platform, e)
+        except Exception as e:
+            error = TransientExtractionError(f"Unexpected error while extracting video metadata: {str(e)}", platform)
+        else:
+            breaker.record_success()
+            info = _strip_selected_format(ydl.sanitize_info(info, remove_private_keys=True))
+            set_cached_info(canonical_url, info)
+            return info
+
+        if isinstance(error, PermanentExtractionError):
+            if error.platform_answered:
+                # La plateforme a répondu (contenu privé, supprimé...) : elle est disponible
+                breaker.record_success()
+            set_cached_failure(canonical_url, str(error))
+        else:
+            breaker.record_failure()
+            if isinstance(error, RateLimitedError):
+                error.retry_after = note_rate_limited(platform)
+        raise error
+
+    return single_flight(canonical_url, lambda: get_cached_info(canonical_url), extract)
+
+
+# Formats toujours résolus dans la matrice, en plus des résolutions listées
+MATRIX_EXTRA_FORMATS = ('worst', 'best')
+
 
-        formats = info.get("formats", [])
-        resolutions = set()
+def matrix_handle(video_url):
+    """Handle de la matrice des formats d'une vidéo (calculable sans extraction)."""
+    return url_digest(canonicalize_video_url(video_url))
 
-        for fmt in formats:
-            height = fmt.get("height")
-            note = fmt.get("format_note") or (f"{height}p" if height else "")
-            cleaned = sanitize_format(note)
-            if cleaned != "unknown":
-                resolutions.add(cleaned)
 
-        return sorted(resolutions, key=lambda x: int(x.replace("p", "")))  # tri croissant
+def list_resolutions(info):
+    """Résolutions annoncées par les formats du dict d'infos, triées par ordre croissant."""
+    resolutions = set()
 
+    for fmt in info.get("formats", []):
+        height = fmt.get("height")
+        note = fmt.get("format_note") or (f"{height}p" if height else "")
+        cleaned = sanitize_format(note)
+        if cleaned != "unknown":
+            resolutions.add(cleaned)
+
+    return sorted(resolutions, key=lambda x: int(x.replace("p", "")))  # tri croissant
+
+
+def _select_format(ydl, info, format_preference, platform):
+    """Sélection du format en local sur le dict d'infos (éventuellement issu du cache)."""
+    import yt_dlp
+    from .ydl_pool import set_ydl_format
+
+    try:
+        set_ydl_format(ydl, build_yt_dlp_format(format_preference))
+        return ydl.process_ie_result(copy.deepcopy(info), download=False)
+    except (yt_dlp.utils.ExtractorError, SyntaxError):
+        raise PermanentExtractionError("The requested quality is not available for this video.", platform)
+    except Exception as e:
+        raise TransientExtractionError(f"Unexpected error while extracting video metadata: {str(e)}", platform)
+
+
+def _matrix_entry(selected):
+    """Entrée de la matrice pour un format sélectionné par yt-dlp."""
+    requested = selected.get('requested_formats') or []
+    filesize = selected.get('filesize') or selected.get('filesize_approx')
+    if filesize is None and requested:
+        sizes = [fmt.get('filesize') or fmt.get('filesize_approx') for fmt in requested]
+        filesize = sum(sizes) if all(sizes) else None
+
+    return {
+        'format': sanitize_format(selected.get('format_note')),
+        'direct_url': selected.get('url'),
+        'filesize': filesize,
+        'ext': selected.get('ext'),
+        'vcodec': selected.get('vcodec'),
+        'acodec': selected.get('acodec'),
+        # Format séparé vidéo + audio : pas d'URL directe unique, fusion nécessaire
+        'needs_merge': bool(requested),
+        'video_url': requested[0].get('url') if requested else None,
+        'audio_url': requested[1].get('url') if len(requested) > 1 else None,
+    }
+
+
+def build_format_matrix(ydl, info, platform):
+    """
+    Résout, sur un seul dict d'infos, l'URL directe, la taille et les codecs
+    de chaque résolution disponible.
+    """
+    matrix = {
+        'duration': info.get('duration'),
+        'resolutions': list_resolutions(info),
+        'formats': {},
+    }
+    for format_preference in matrix['resolutions'] + list(MATRIX_EXTRA_FORMATS):
+        try:
+            matrix['formats'][format_preference] = _matrix_entry(
+                _select_format(ydl, info, format_preference, platform)
+            )
+        except PermanentExtractionError:
+            continue  # Résolution annoncée mais non sélectionnable
+    return matrix
+
+
+def get_format_matrix(video_url, profile):
+    """
+    Retourne la matrice des formats de la vidéo : une seule extraction sert
+    ensuite toutes les demandes (formats puis record, quelle que soit la résolution).
+    """
+    from .ydl_pool import pooled_ydl
+
+    handle = matrix_handle(video_url)
+    matrix = get_cached_matrix(handle)
+    if matrix is not None:
+        return matrix
+
+    with pooled_ydl(profile) as ydl:
+        info = _extract_info(ydl, video_url)
+        matrix = build_format_matrix(ydl, info, detect_platform(video_url))
+    set_cached_matrix(handle, matrix, info)
+    return matrix
+
+
+def get_available_resolutions(video_url):
+    """
+    Retourne la liste des résolutions disponibles pour une vidéo.
+    Exemple : ['144p', '360p', '720p']
+    """
+    try:
+        return get_format_matrix(video_url, 'formats')['resolutions']
+    except (ExtractionError, CircuitOpenError) as e:
+        logger.error(f"Erreur yt_dlp: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Erreur yt_dlp: {str(e)}")
-        raise RuntimeError("Impossible d’extraire les formats disponibles.")
+        raise TransientExtractionError("Impossible d’extraire les formats disponibles.")
 
 
 def extract_video_metadata(video_url: str, format_preference: str = 'worst'):
     """
     Extracts video metadata and returns a dict with the info.
-    Raises a custom error message in English depending on platform and error type.
+    format_preference is a simple format ('720p', 'best', 'worst'), served from
+    the format matrix, or any yt-dlp format string.
+    Raises a typed ExtractionError (permanent, transient or rate-limited) with
+    a custom error message in English depending on platform and error type.
     """
     if not video_url:
         raise ValueError("Video URL cannot be empty.")
 
-    def detect_platform(url):
-        url = url.lower()
-        if "twitter.com" in url or "x.com" in url:
-            return "Twitter"
-        if "tiktok.com" in url:
-            return "TikTok"
-        if "instagram.com" in url:
-            return "Instagram"
-        if "facebook.com" in url or "fb.watch" in url:
-            return "Facebook"
-        if "youtube.com" in url or "youtu.be" in url:
-            return "YouTube"
-        return "Other"
-
     platform = detect_platform(video_url)
+    matrix = get_format_matrix(video_url, 'metadata')
+    entry = matrix['formats'].get(format_preference)
 
-    ydl_opts = {
-        'quiet': True,
-        'skip_download': True,
-        'format': format_preference,
-        'noplaylist': True,
-        'forcejson': True,
-        'extract_flat': False,
-        'extractor_args': {
-            'tiktok': {
-                'app_version': '29.9.9',
-                'manifest_app_version': '299900',
-                'version_code': '299900',
-            }
-        },
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Referer': 'https://www.tiktok.com/',
-            'Origin': 'https://www.tiktok.com',
-            'Authority': 'www.tiktok.com',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'TE': 'trailers',
-        },
-        'socket_timeout': 30,
-        'source_address': '0.0.0.0',
-    }
+    if entry is None:
+        if re.match(r"^\d{3,4}p$", format_preference):
+            raise PermanentExtractionError("The requested quality is not available for this video.", platform)
+        # Format yt-dlp libre : sélection directe sur le dict d'infos
+        from .ydl_pool import pooled_ydl
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            info_dict = ydl.extract_info(video_url, download=False)
-            direct_url = info_dict.get('url')
-            video_format = sanitize_format(info_dict.get('format_note'))
-            duration = info_dict.get('duration')
-            filesize = info_dict.get('filesize') or info_dict.get('filesize_approx')
-
-            return {
-                'direct_url': direct_url,
-                'format': video_format,
-                'duration': duration,
-                'filesize': filesize,
-            }
-        except yt_dlp.utils.DownloadError as e:
-            err_str = str(e)
-            # Custom error messages in English
-            if platform == "Twitter":
-                if "NsfwViewerHasNoStatedAge" in err_str:
-                    raise Exception("This tweet contains sensitive (NSFW) content and cannot be downloaded without authentication.")
-                if "Requested tweet is unavailable" in err_str:
-                    raise Exception("The requested tweet is unavailable or private.")
-                raise Exception("Unable to download this Twitter video. Please check that the tweet is public and accessible.")
-            elif platform == "TikTok":
-                if "Video unavailable" in err_str or "Private video" in err_str:
-                    raise Exception("The TikTok video is private or unavailable.")
-                raise Exception("Unable to download this TikTok video. Please check the video is public and accessible.")
-            elif platform == "Instagram":
-                if "login required" in err_str:
-                    raise Exception("Instagram video requires login to download.")
-                raise Exception("Unable to download this Instagram video. Please check the video is public and accessible.")
-            elif platform == "Facebook":
-                if "login required" in err_str:
-                    raise Exception("Facebook video requires login to download.")
-                raise Exception("Unable to download this Facebook video. Please check the video is public and accessible.")
-            elif platform == "YouTube":
-                raise Exception("YouTube downloading is not supported on this platform.")
-            else:
-                raise Exception("Error extracting video. Please check the link or platform.")
-        except Exception as e:
-            raise Exception(f"Unexpected error while extracting video metadata: {str(e)}")
+        with pooled_ydl('metadata') as ydl:
+            entry = _matrix_entry(_select_format(ydl, _extract_info(ydl, video_url), format_preference, platform))
+
+    return {
+        'direct_url': entry['direct_url'],
+        'format': entry['format'],
+        'duration': matrix['duration'],
+        'filesize': entry['filesize'],
+        # Format séparé : pas d'URL directe, les deux flux sont fusionnés par downloads/mux/
+        'needs_merge': entry['needs_merge'],
+        'video_stream_url': entry['video_url'],
+        'audio_stream_url': entry['audio_url'],
+    }
 
 
 def sanitize_format(format_note):
@@ -154,6 +396,25 @@ def get_client_ip(request):
     return request.META.get('REMOTE_ADDR')
 
 
+def get_trusted_client_ip(request):
+    """
+    Adresse du client vue par notre proxy (nginx), pour les limites par IP.
+
+    Le premier élément de X-Forwarded-For est fourni par le client et se
+    falsifie librement : on retient X-Real-IP posé par nginx, sinon le
+    dernier saut de X-Forwarded-For (ajouté par nginx), sinon REMOTE_ADDR.
+    """
+    x_real_ip = request.META.get('HTTP_X_REAL_IP', '').strip()
+    if x_real_ip:
+        return x_real_ip
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        last_hop = x_forwarded_for.split(',')[-1].strip()
+        if last_hop:
+            return last_hop
+    return request.META.get('REMOTE_ADDR')
+
+
 def build_yt_dlp_format(format_str: str) -> str:
     """
     Convertit un format simple (ex: '360p') en syntaxe yt-dlp.
@@ -4,22 +4,62 @@ from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import StreamingHttpResponse
-import requests # type: ignore
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import parse_etags, quote_etag
+from django.views import View
+from asgiref.sync import sync_to_async
 
-from .models import DownloadStat
+from .models import DownloadStat, DownloadStatHourly
 from .serializers import DownloadStatSerializer, RegisterSerializer
-from .utils import get_client_ip
-from books.tasks import async_get_available_resolutions, async_extract_metadata_and_save
-
-from django.db.models import Count, Q
+from .utils import get_client_ip, get_trusted_client_ip, detect_platform, matrix_handle
+from .cache import get_cached_matrix
+from .circuit_breaker import CircuitBreaker, OPEN
+from .export import FORMATS as EXPORT_FORMATS, aexport_chunks
+from .routing import RESOLUTIONS_TASK, RECORD_TASK
+from .proxy import (
+    UpstreamError, accel_redirect_headers, copy_response_headers, forwarded_request_headers,
+    is_proxiable_url, iter_segmented, iter_upstream, open_upstream, supports_segmented_fetch,
+)
+from .metrics import instrumented, proxy_platform
+from .mux import MuxError, StreamMuxer
+from .refresh import HandleNotFound, iter_resumable, open_handle, resolve_handle
+from .rollups import day_start, rollup_counts
+from .task_events import iter_task_events
+from .task_results import batch_task_statuses
+from .throttle import acquire_stream_slot, throttled
+from .content_cache import (
+    UNSATISFIABLE, CacheEntry, content_key, iter_and_fill, iter_file, iter_filling, parse_range
+)
+
+from django.db.models import Q, Sum
 from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
 from django.utils import timezone
 from datetime import timedelta
+from celery import current_app
 from celery.result import AsyncResult
 
-# Import pour la géolocalisation d'IP (optionnel, voir explication ci-dessous)
+
+def circuit_open_response(video_url):
+    """
+    Retourne une réponse 503 si le disjoncteur de la plateforme est ouvert,
+    None sinon (la tâche peut être lancée).
+    """
+    breaker = CircuitBreaker(detect_platform(video_url))
+    if breaker.state() != OPEN:
+        return None
+    retry_after = breaker.retry_after()
+    return Response(
+        {
+            "error": f"Les téléchargements {breaker.platform} sont temporairement indisponibles. Réessayez dans {retry_after} secondes.",
+            "retry_after": retry_after,
+        },
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': str(retry_after)},
+    )
+
 
 @permission_classes([permissions.AllowAny])
 @api_view(['POST'])
@@ -36,15 +76,37 @@ def get_formats_video(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    unavailable = circuit_open_response(video_url)
+    if unavailable:
+        return unavailable
+
     # Lancement de la tâche asynchrone
-    task = async_get_available_resolutions.delay(video_url)
+    task = current_app.send_task(RESOLUTIONS_TASK, args=[video_url])
     
+    # matrix_id : permet de relire la matrice des formats (URL directe par résolution)
     return Response(
-        {"task_id": task.id},
+        {"task_id": task.id, "matrix_id": matrix_handle(video_url), "events_url": reverse('task_events', args=[task.id])},
         status=status.HTTP_202_ACCEPTED
     )
 
 
+class FormatMatrixView(APIView):
+    """
+    API pour lire la matrice des formats produite par une extraction :
+    URL directe, taille, codecs et besoin de fusion vidéo+audio par résolution.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, matrix_id):
+        matrix = get_cached_matrix(matrix_id)
+        if matrix is None:
+            return Response(
+                {"error": "Matrice des formats inconnue ou expirée."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({"matrix_id": matrix_id, **matrix}, status=status.HTTP_200_OK)
+
+
 class DownloadStatCreateAPIView(generics.CreateAPIView):
     """
     Endpoint asynchrone pour le téléchargement
@@ -63,17 +125,26 @@ class DownloadStatCreateAPIView(generics.CreateAPIView):
                 {"error": "Les champs 'video_url', 'origine_video' et 'format_preference' sont requis."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if len(str(format_preference)) > DownloadStat._meta.get_field('format_preference').max_length:
+            return Response(
+                {"error": "Le champ 'format_preference' est trop long."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        unavailable = circuit_open_response(video_url)
+        if unavailable:
+            return unavailable
 
         # Lancement de la tâche asynchrone
-        task = async_extract_metadata_and_save.delay(
+        task = current_app.send_task(RECORD_TASK, kwargs=dict(
             request_data=request.data,
             client_ip=get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', ''),
             referer=request.META.get('HTTP_REFERER', '')
-        )
+        ))
         
         return Response(
-            {"task_id": task.id},
+            {"task_id": task.id, "events_url": reverse('task_events', args=[task.id])},
             status=status.HTTP_202_ACCEPTED
         )
 
@@ -101,22 +172,324 @@ class TaskStatusView(APIView):
         return Response(response_data, status=status.HTTP_200_OK)
     
 
-class ProxyDownloadView(APIView):
+class TaskStatusBatchView(APIView):
     """
-    API pour proxyfier le téléchargement d'une vidéo via son URL directe.
+    API pour vérifier le statut de plusieurs tâches Celery en une requête :
+    `?ids=<id1>,<id2>,...`. Les statuts sont lus en une fois dans le result
+    backend (books/task_results.py). La réponse porte un ETag : tant qu'aucune
+    tâche n'a changé, un GET avec If-None-Match reçoit un 304 sans corps.
     """
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        direct_url = request.GET.get('url')
+        task_ids = list(dict.fromkeys(
+            task_id.strip() for value in request.query_params.getlist('ids') for task_id in value.split(',') if task_id.strip()
+        ))
+        if not task_ids:
+            return Response({"error": "Le paramètre 'ids' est requis."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(task_ids) > settings.TASK_STATUS_BATCH_MAX:
+            return Response(
+                {"error": f"Au plus {settings.TASK_STATUS_BATCH_MAX} tâches par requête."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        known_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        etag, statuses = batch_task_statuses(task_ids, [etag.removeprefix('W/').strip('"') for etag in known_etags])
+        headers = {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
+        if statuses is None:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response({"tasks": statuses}, status=status.HTTP_200_OK, headers=headers)
+
+
+class TaskEventsView(View):
+    """
+    API pour suivre le statut d'une tâche Celery en Server-Sent Events
+    (books/task_events.py) : la connexion reste ouverte et chaque transition
+    (PENDING, STARTED, SUCCESS / FAILURE) est poussée dès qu'elle a lieu,
+    au lieu d'interroger downloads/task-status/ en boucle.
+    """
+
+    async def get(self, request, task_id):
+        response = StreamingHttpResponse(iter_task_events(task_id), content_type="text/event-stream")
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx ne doit pas retenir les événements
+        return response
+
+
+class ThrottledStreamMixin:
+    """
+    Téléchargements limités par IP (books/throttle.py) : nombre de flux
+    simultanés, et débit des corps relayés par Python. En mode nginx, le
+    débit par connexion est confié à nginx (X-Accel-Limit-Rate).
+
+    Les flux sont aussi mesurés pour Prometheus (books/metrics.py), par
+    plateforme et par source des octets : 'upstream', 'cache', 'filling'
+    (entrée du cache en cours de remplissage) ou 'mux'.
+    """
+    stream_slot = None
+    platform = 'Other'
+
+    def stream_response(self, body, source='upstream', **kwargs):
+        if self.stream_slot is not None:
+            body = throttled(body, self.stream_slot)
+        return StreamingHttpResponse(instrumented(body, self.platform, source), **kwargs)
+
+
+async def limit_streams(view, request, handler):
+    """Réserve une place de flux pour l'IP le temps du téléchargement, ou répond 429."""
+    slot = await acquire_stream_slot(get_trusted_client_ip(request))
+    if slot is None:
+        return JsonResponse(
+            {"error": "Trop de téléchargements simultanés. Réessayez quand un téléchargement sera terminé."},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={'Retry-After': str(settings.PROXY_STREAM_RETRY_AFTER)},
+        )
+    view.stream_slot = slot
+    response = None
+    try:
+        response = await handler()
+    finally:
+        if response is None or not response.streaming:
+            await slot.arelease()
+        else:
+            # Libérée à la fermeture de la réponse, même si le corps n'a jamais été lu
+            response._resource_closers.append(slot.release)
+    if response.has_header('X-Accel-Redirect') and settings.PROXY_BANDWIDTH_PER_IP:
+        response['X-Accel-Limit-Rate'] = str(settings.PROXY_BANDWIDTH_PER_IP)
+    return response
+
+
+class ProxyDownloadView(ThrottledStreamMixin, View):
+    """
+    API pour proxyfier le téléchargement d'une vidéo via son URL directe.
+    Vue asynchrone native : le flux est relayé depuis le client httpx partagé
+    sans bloquer de thread, et la requête vers la source est annulée si le
+    client se déconnecte. Les en-têtes Range / If-Range sont relayés à la
+    source (reprise, lecture avec avance rapide) et HEAD est supporté.
+
+    En mode PROXY_MODE='nginx', les GET sont confiés à nginx par X-Accel-Redirect :
+    la vue ne fait que valider la requête.
+
+    Les vidéos les plus demandées sont gardées sur disque (books/content_cache.py),
+    indexées par le téléchargement enregistré pour un handle, par l'URL
+    directe complète sinon. Le paramètre facultatif `video_url` ne sert qu'à
+    attribuer le flux à une plateforme dans les métriques.
+
+    À la place de `url`, le client peut passer un handle stable, `download_id`
+    ou `task_id` (books/refresh.py) : l'URL directe est alors relue et
+    réextraite si elle a expiré, avant ou pendant le téléchargement.
+    """
+
+    async def get(self, request):
+        return await limit_streams(self, request, lambda: self.proxy(request, 'GET'))
+
+    async def head(self, request):
+        return await self.proxy(request, 'HEAD')
+
+    async def proxy(self, request, method):
+        handle = None
+        if request.GET.get('download_id') or request.GET.get('task_id'):
+            try:
+                handle = await resolve_handle(request.GET.get('download_id'), request.GET.get('task_id'))
+            except HandleNotFound:
+                return JsonResponse({"error": "Téléchargement introuvable"}, status=status.HTTP_404_NOT_FOUND)
+            except UpstreamError:
+                return JsonResponse(
+                    {"error": "Impossible d'obtenir un nouveau lien pour cette vidéo."},
+                    status=status.HTTP_502_BAD_GATEWAY
+                )
+            if not handle.direct_url:
+                return JsonResponse({"error": "Aucun lien direct pour ce format"}, status=status.HTTP_409_CONFLICT)
+            direct_url = handle.direct_url
+            video_url = handle.video_url
+        else:
+            direct_url = request.GET.get('url')
+            video_url = request.GET.get('video_url')
         if not direct_url:
-            return Response({"error": "URL manquante"}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({"error": "URL manquante"}, status=status.HTTP_400_BAD_REQUEST)
+        if not await is_proxiable_url(direct_url):
+            return JsonResponse({"error": "URL invalide"}, status=status.HTTP_400_BAD_REQUEST)
+        self.platform = proxy_platform(direct_url, video_url)
+
+        entry = None
+        if settings.PROXY_CACHE_MAX_BYTES:
+            entry = CacheEntry(content_key(direct_url, handle))
+            meta = await sync_to_async(entry.hit, thread_sensitive=False)()
+            if meta:
+                return await self.cached_response(request, method, entry, meta)
+            if method == 'GET' and 'HTTP_RANGE' not in request.META:
+                meta = await sync_to_async(entry.filling_meta, thread_sensitive=False)()
+                if meta:
+                    # Un autre client remplit l'entrée : on la lit à mesure
+                    response = self.stream_response(
+                        iter_filling(entry, meta['size'], direct_url), source='filling',
+                        content_type=meta['content_type']
+                    )
+                    response['Content-Length'] = meta['size']
+                    response['Content-Disposition'] = 'attachment; filename="video.mp4"'
+                    return response
+
+        # Premier client d'une vidéo absente du cache : relayée par Python pour la remplir
+        writer = None
+        if (entry is not None and method == 'GET' and 'HTTP_RANGE' not in request.META
+                and not await entry.is_uncacheable()):
+            writer = await sync_to_async(entry.claim, thread_sensitive=False)()
+
+        if method == 'GET' and settings.PROXY_MODE == 'nginx' and writer is None:
+            response = HttpResponse(content_type="video/mp4")
+            for name, value in accel_redirect_headers(direct_url).items():
+                response[name] = value
+            response['Content-Disposition'] = 'attachment; filename="video.mp4"'
+            return response
+
+        def open_source(url):
+            return open_upstream(url, forwarded_request_headers(request.META), method=method)
+
+        try:
+            if handle is not None:
+                upstream = await open_handle(handle, open_source)
+                direct_url = handle.direct_url
+            else:
+                upstream = await open_source(direct_url)
+        except UpstreamError as e:
+            if writer:
+                await sync_to_async(writer.abort, thread_sensitive=False)()
+            return JsonResponse(
+                {"error": "La source de la vidéo est indisponible.", "upstream_status": e.status_code},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
 
-        r = requests.get(direct_url, stream=True)
-        
-        response = StreamingHttpResponse(r.iter_content(chunk_size=8192), content_type="video/mp4")
+        content_type = upstream.headers.get('content-type', '')
+        if not content_type.startswith(('video/', 'audio/')):
+            content_type = "video/mp4"
+
+        if upstream.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE:
+            # Plage hors du fichier : Content-Range indique la taille réelle
+            await upstream.aclose()
+            response = HttpResponse(status=upstream.status_code)
+            if 'content-range' in upstream.headers:
+                response['Content-Range'] = upstream.headers['content-range']
+            return response
+
+        if method == 'HEAD':
+            await upstream.aclose()
+            response = HttpResponse(status=upstream.status_code, content_type=content_type)
+        else:
+            body = iter_upstream(upstream)
+            if 'HTTP_RANGE' not in request.META and supports_segmented_fetch(upstream):
+                # CDN qui bride chaque connexion : segments Range en parallèle
+                body = iter_segmented(direct_url, upstream)
+            if handle is not None and upstream.status_code == status.HTTP_200_OK:
+                # Coupure en cours de route (URL expirée...) : reprise à l'octet atteint
+                body = iter_resumable(handle, body)
+            if writer and entry.is_cacheable(upstream):
+                await sync_to_async(writer.start, thread_sensitive=False)(
+                    content_type, int(upstream.headers['content-length'])
+                )
+                body = iter_and_fill(body, writer)
+            elif writer:
+                await sync_to_async(writer.abort, thread_sensitive=False)()
+                await entry.mark_uncacheable()
+            response = self.stream_response(body, status=upstream.status_code, content_type=content_type)
+        copy_response_headers(upstream, response)
+        response['Content-Disposition'] = 'attachment; filename="video.mp4"'
+
+        return response
+
+    async def cached_response(self, request, method, entry, meta):
+        """Sert une vidéo du cache disque : par nginx en mode nginx, sinon depuis le fichier (Range inclus)."""
+        if method == 'GET' and settings.PROXY_MODE == 'nginx':
+            response = HttpResponse(content_type=meta['content_type'])
+            response['X-Accel-Redirect'] = f"{settings.PROXY_CACHE_ACCEL_LOCATION}{entry.relative_path}"
+            response['Content-Disposition'] = 'attachment; filename="video.mp4"'
+            return response
+
+        size = meta['size']
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == entry.etag(meta):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is UNSATISFIABLE:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        status_code = status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK
+        if method == 'HEAD':
+            response = HttpResponse(status=status_code, content_type=meta['content_type'])
+        else:
+            try:
+                f = await sync_to_async(open, thread_sensitive=False)(entry.path, 'rb')
+            except FileNotFoundError:
+                # Évincé entre-temps : prochain appel servi par la source
+                return JsonResponse({"error": "Réessayez."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response = self.stream_response(
+                iter_file(f, start, end - start + 1), source='cache',
+                status=status_code, content_type=meta['content_type']
+            )
+        response['Content-Length'] = end - start + 1
+        if byte_range:
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = entry.etag(meta)
+        response['Content-Disposition'] = 'attachment; filename="video.mp4"'
+        return response
+
+class MuxDownloadView(ThrottledStreamMixin, View):
+    """
+    API pour télécharger un format séparé vidéo + audio (ex. 'bestvideo[height=720]+bestaudio')
+    fusionné à la volée en MP4 fragmenté par ffmpeg (voir books/mux.py).
+    Paramètres : `video` et `audio`, les URLs directes des deux flux.
+    HEAD valide la requête et renvoie les en-têtes sans lancer ffmpeg.
+    """
+
+    async def get(self, request):
+        return await limit_streams(self, request, lambda: self.mux(request))
+
+    async def head(self, request):
+        error = await self.invalid_params(request)
+        if error is not None:
+            return error
+        # Taille inconnue tant que la fusion n'a pas eu lieu : ni Content-Length, ni Range
+        response = HttpResponse(content_type="video/mp4")
+        response['Content-Disposition'] = 'attachment; filename="video.mp4"'
+        return response
+
+    async def invalid_params(self, request):
+        video_url = request.GET.get('video')
+        audio_url = request.GET.get('audio')
+        if not video_url or not audio_url:
+            return JsonResponse({"error": "Les paramètres 'video' et 'audio' sont requis."}, status=status.HTTP_400_BAD_REQUEST)
+        if not await is_proxiable_url(video_url) or not await is_proxiable_url(audio_url):
+            return JsonResponse({"error": "URL invalide"}, status=status.HTTP_400_BAD_REQUEST)
+        return None
+
+    async def mux(self, request):
+        error = await self.invalid_params(request)
+        if error is not None:
+            return error
+        video_url = request.GET.get('video')
+        audio_url = request.GET.get('audio')
+        self.platform = proxy_platform(video_url)
+
+        muxer = StreamMuxer(video_url, audio_url)
+        try:
+            await muxer.start()
+        except UpstreamError as e:
+            return JsonResponse(
+                {"error": "La source de la vidéo est indisponible.", "upstream_status": e.status_code},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        except MuxError:
+            return JsonResponse(
+                {"error": "La fusion vidéo + audio est temporairement indisponible."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        # Taille inconnue à l'avance : réponse chunked, sans Range
+        response = self.stream_response(muxer.iter_output(), source='mux', content_type="video/mp4")
         response['Content-Disposition'] = 'attachment; filename="video.mp4"'
-        
         return response
 
 # --- API pour l'authentification ---
@@ -170,13 +543,14 @@ class DownloadStatsOverviewAPIView(APIView):
     permission_classes = [permissions.IsAdminUser] # Changé de IsAuthenticated à IsAdminUser
 
     def get(self, request, *args, **kwargs):
-        total_downloads = DownloadStat.objects.count()
-        successful_downloads = DownloadStat.objects.filter(statut_telechargement=True).count()
+        # Agrégats horaires (books/rollups.py) : pas de parcours de la table brute
+        total_downloads, successful_downloads = rollup_counts(DownloadStatHourly.objects.all())
         failed_downloads = total_downloads - successful_downloads
         
         today = timezone.localdate()
-        downloads_today = DownloadStat.objects.filter(horodatage__date=today).count()
-        successful_downloads_today = DownloadStat.objects.filter(horodatage__date=today, statut_telechargement=True).count()
+        downloads_today, successful_downloads_today = rollup_counts(
+            DownloadStatHourly.objects.filter(heure__gte=day_start(today))
+        )
 
         return Response({
             'total_downloads': total_downloads,
@@ -199,12 +573,12 @@ class DownloadStatsTimeSeriesAPIView(APIView):
         end_date_str = request.query_params.get('end_date')
         start_date_str = request.query_params.get('start_date')
 
-        queryset = DownloadStat.objects.all()
+        queryset = DownloadStatHourly.objects.all()
 
         if end_date_str:
             try:
                 end_date = timezone.datetime.strptime(end_date_str, '%Y-%m-%d').date()
-                queryset = queryset.filter(horodatage__date__lte=end_date)
+                queryset = queryset.filter(heure__lt=day_start(end_date + timedelta(days=1)))
             except ValueError:
                 return Response({"error_details": "Format de date de fin invalide. Utilisez %Y-%MM-%DD."},
                                 status=status.HTTP_400_BAD_REQUEST)
@@ -214,7 +588,7 @@ class DownloadStatsTimeSeriesAPIView(APIView):
         if start_date_str:
             try:
                 start_date = timezone.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-                queryset = queryset.filter(horodatage__date__gte=start_date)
+                queryset = queryset.filter(heure__gte=day_start(start_date))
             except ValueError:
                 return Response({"error_details": "Format de date de début invalide. Utilisez %Y-%MM-%DD."},
                                 status=status.HTTP_400_BAD_REQUEST)
@@ -225,15 +599,15 @@ class DownloadStatsTimeSeriesAPIView(APIView):
                 start_date = end_date - timedelta(weeks=12)
             elif period == 'month':
                 start_date = end_date - timedelta(days=365)
-            queryset = queryset.filter(horodatage__date__gte=start_date)
+            queryset = queryset.filter(heure__gte=day_start(start_date))
 
 
         if period == 'day':
-            truncated_date = TruncDay('horodatage')
+            truncated_date = TruncDay('heure')
         elif period == 'week':
-            truncated_date = TruncWeek('horodatage')
+            truncated_date = TruncWeek('heure')
         elif period == 'month':
-            truncated_date = TruncMonth('horodatage')
+            truncated_date = TruncMonth('heure')
         else:
             return Response({"error_details": "Période invalide. Utilisez 'day', 'week' ou 'month'."},
                             status=status.HTTP_400_BAD_REQUEST)
@@ -241,9 +615,9 @@ class DownloadStatsTimeSeriesAPIView(APIView):
         time_series_data = queryset.annotate(
             date=truncated_date
         ).values('date').annotate(
-            total_downloads=Count('id'),
-            successful_downloads=Count('id', filter=Q(statut_telechargement=True)),
-            failed_downloads=Count('id', filter=Q(statut_telechargement=False))
+            total_downloads=Sum('total'),
+            successful_downloads=Sum('total', filter=Q(statut_telechargement=True)),
+            failed_downloads=Sum('total', filter=Q(statut_telechargement=False))
         ).order_by('date')
 
         formatted_data = []
@@ -252,8 +626,8 @@ class DownloadStatsTimeSeriesAPIView(APIView):
             formatted_data.append({
                 'date': formatted_date,
                 'total_downloads': entry['total_downloads'],
-                'successful_downloads': entry['successful_downloads'],
-                'failed_downloads': entry['failed_downloads'],
+                'successful_downloads': entry['successful_downloads'] or 0,
+                'failed_downloads': entry['failed_downloads'] or 0,
             })
         
         return Response(formatted_data)
@@ -267,8 +641,8 @@ class DownloadStatsByQualityAPIView(APIView):
     permission_classes = [permissions.IsAdminUser] # Changé de IsAuthenticated à IsAdminUser
 
     def get(self, request, *args, **kwargs):
-        stats_by_quality = DownloadStat.objects.exclude(qualite_video__isnull=True).exclude(qualite_video__exact='').values('qualite_video').annotate(
-            count=Count('id')
+        stats_by_quality = DownloadStatHourly.objects.exclude(qualite_video__exact='').values('qualite_video').annotate(
+            count=Sum('total')
         ).order_by('-count')
 
         return Response(stats_by_quality)
@@ -282,9 +656,59 @@ class DownloadStatsByCountryAPIView(APIView):
     permission_classes = [permissions.IsAdminUser] # Changé de IsAuthenticated à IsAdminUser
 
     def get(self, request, *args, **kwargs):
-        stats_by_country = DownloadStat.objects.exclude(pays_ip__isnull=True).exclude(pays_ip__exact='').values('pays_ip').annotate(
-            count=Count('id')
+        stats_by_country = DownloadStatHourly.objects.exclude(pays_ip__exact='').values('pays_ip').annotate(
+            count=Sum('total')
         ).order_by('-count')
         
         return Response(stats_by_country)
 
+
+class DownloadStatsExportAPIView(APIView):
+    """
+    API pour exporter les téléchargements bruts en CSV ou NDJSON, en flux
+    (voir books/export.py), quel que soit le nombre de lignes.
+    Filtres : start_date / end_date (inclus), platform, status ('success' ou 'failed').
+    output=csv|ndjson, gzip=1 pour un fichier compressé à la volée.
+    Nécessite une authentification et que l'utilisateur soit un admin.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({"error_details": "Format invalide. Utilisez 'csv' ou 'ndjson'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = DownloadStat.objects.order_by('pk')
+        try:
+            start_date_str = request.query_params.get('start_date')
+            if start_date_str:
+                start_date = timezone.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+                queryset = queryset.filter(horodatage__gte=day_start(start_date))
+            end_date_str = request.query_params.get('end_date')
+            if end_date_str:
+                end_date = timezone.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+                queryset = queryset.filter(horodatage__lt=day_start(end_date + timedelta(days=1)))
+        except ValueError:
+            return Response({"error_details": "Format de date invalide. Utilisez %Y-%MM-%DD."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        platform = request.query_params.get('platform')
+        if platform:
+            queryset = queryset.filter(origine_video__iexact=platform)
+        download_status = request.query_params.get('status')
+        if download_status:
+            if download_status not in ('success', 'failed'):
+                return Response({"error_details": "Statut invalide. Utilisez 'success' ou 'failed'."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(statut_telechargement=download_status == 'success')
+
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        filename = f"telechargements.{output}" + ('.gz' if compress else '')
+        response = StreamingHttpResponse(
+            aexport_chunks(queryset, output, compress),
+            content_type='application/gzip' if compress else EXPORT_FORMATS[output],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
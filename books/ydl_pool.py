@@ -0,0 +1,138 @@
+# ydl_pool.py
+"""
+Pool, par processus worker, d'instances yt_dlp.YoutubeDL préconfigurées.
+
+Construire un YoutubeDL coûte cher (registre des extracteurs, cookie jar,
+sessions HTTP) : les instances sont créées une fois par profil d'options
+puis réutilisées d'une tâche à l'autre, ce qui conserve aussi les
+connexions keep-alive vers les plateformes. Le pool est préchauffé au
+démarrage de chaque processus worker (worker_process_init, voir tasks.py).
+"""
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+import yt_dlp
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Profils d'options yt-dlp. Le format de chaque profil est celui utilisé pour
+# l'extraction ; la sélection d'un autre format se fait ensuite sur le dict d'infos.
+YDL_PROFILES = {
+    # Liste des résolutions (downloads/formats/)
+    'formats': {
+        'quiet': True,
+        'skip_download': True,
+        'no_warnings': True,
+        'socket_timeout': 10,
+        'format': 'bestvideo*+bestaudio/best',
+    },
+    # URL directe et métadonnées (downloads/record/)
+    'metadata': {
+        'quiet': True,
+        'skip_download': True,
+        'format': 'worst',
+        'noplaylist': True,
+        'forcejson': True,
+        'extract_flat': False,
+        'extractor_args': {
+            'tiktok': {
+                'app_version': '29.9.9',
+                'manifest_app_version': '299900',
+                'version_code': '299900',
+            }
+        },
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Referer': 'https://www.tiktok.com/',
+            'Origin': 'https://www.tiktok.com',
+            'Authority': 'www.tiktok.com',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'none',
+            'Sec-Fetch-User': '?1',
+            'TE': 'trailers',
+        },
+        'socket_timeout': 30,
+        'source_address': '0.0.0.0',
+    },
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(profile):
+    with _pools_lock:
+        if profile not in _pools:
+            _pools[profile] = queue.LifoQueue(maxsize=settings.YDL_POOL_SIZE)
+        return _pools[profile]
+
+
+def _create(profile):
+    ydl = yt_dlp.YoutubeDL(dict(YDL_PROFILES[profile]))
+    ydl._pool_uses = 0
+    return ydl
+
+
+def set_ydl_format(ydl, format_spec):
+    """Change le format sélectionné par une instance (sans la reconstruire)."""
+    if ydl.params.get('format') != format_spec:
+        ydl.params['format'] = format_spec
+        ydl.format_selector = ydl.build_format_selector(format_spec)
+
+
+@contextmanager
+def pooled_ydl(profile):
+    """
+    Emprunte une instance YoutubeDL du profil donné, remise au format du
+    profil, et la rend au pool en sortie.
+    """
+    pool = _get_pool(profile)
+    try:
+        ydl = pool.get_nowait()
+    except queue.Empty:
+        ydl = _create(profile)
+    set_ydl_format(ydl, YDL_PROFILES[profile]['format'])
+
+    try:
+        yield ydl
+    finally:
+        ydl._pool_uses += 1
+        # Recyclage périodique pour borner l'état accumulé (cookies, caches internes)
+        if ydl._pool_uses >= settings.YDL_POOL_MAX_USES:
+            ydl.close()
+        else:
+            try:
+                pool.put_nowait(ydl)
+            except queue.Full:
+                ydl.close()
+
+
+def warm_pool():
+    """Crée une instance par profil (chargement des extracteurs inclus)."""
+    for profile in YDL_PROFILES:
+        pool = _get_pool(profile)
+        if pool.empty():
+            try:
+                pool.put_nowait(_create(profile))
+            except queue.Full:
+                pass
+    logger.info(f"Pool YoutubeDL préchauffé ({', '.join(YDL_PROFILES)})")
+
+
+def clear_pool():
+    for pool in _pools.values():
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
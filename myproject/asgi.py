@@ -7,10 +7,70 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
-application = get_asgi_application()
+
+class DisconnectAwareASGIHandler(ASGIHandler):
+    """
+    Handler ASGI qui annule la vue quand le client se déconnecte.
+
+    Django 4.2 n'écoute plus `receive` une fois le corps de la requête lu :
+    une réponse en streaming (proxy de téléchargement) continuerait de lire
+    la source jusqu'au bout pour un client parti. Ici, la déconnexion annule
+    la tâche de la requête, ce qui ferme l'itérateur de la réponse et donc
+    la connexion vers la source.
+    """
+
+    async def handle(self, scope, receive, send):
+        body_received = asyncio.Event()
+
+        async def receive_body():
+            message = await receive()
+            if message['type'] == 'http.disconnect' or not message.get('more_body', False):
+                body_received.set()
+            return message
+
+        request_task = asyncio.ensure_future(super().handle(scope, receive_body, send))
+        disconnect_task = asyncio.ensure_future(self.listen_for_disconnect(receive, body_received))
+        await asyncio.wait([request_task, disconnect_task], return_when=asyncio.FIRST_COMPLETED)
+
+        for task in (request_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if not request_task.cancelled():
+            request_task.result()
+
+    async def listen_for_disconnect(self, receive, body_received):
+        await body_received.wait()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def send_response(self, response, send):
+        try:
+            await super().send_response(response, send)
+        except asyncio.CancelledError:
+            # Le générateur asynchrone du corps n'est pas fermé par response.close() :
+            # on le ferme explicitement pour libérer la source tout de suite.
+            iterator = getattr(response, '_iterator', None)
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+            # Fermeture normale de la réponse (signal request_finished inclus)
+            await sync_to_async(response.close, thread_sensitive=True)()
+            raise
+
+
+django.setup(set_prefix=False)
+application = DisconnectAwareASGIHandler()
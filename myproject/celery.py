@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
@@ -13,6 +14,19 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@celeryd_init.connect
+def select_platform_queue(sender=None, instance=None, options=None, **kwargs):
+    """
+    Un worker dédié (WORKER_PLATFORM) ne consomme que la file
+    de sa plateforme, sauf si -Q est passé explicitement.
+    """
+    from django.conf import settings
+
+    if settings.WORKER_PLATFORM and not (options or {}).get('queues'):
+        queue = settings.PLATFORM_QUEUES[settings.WORKER_PLATFORM]['queue']
+        instance.app.amqp.queues.select([queue])
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 
+from kombu import Queue
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -138,6 +140,111 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# --- Cache (Redis partagé entre le web et les workers Celery) ---
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        # Éviction LRU assurée par Redis (maxmemory-policy, voir docker-compose.yml)
+        'extraction': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'extraction',
+        },
+    }
+else:
+    # En local : cache mémoire par processus, non partagé entre workers
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'extraction': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'extraction',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', 500))},
+        },
+    }
+
+# Cache des extractions yt-dlp (dicts d'infos complets, par URL canonique)
+EXTRACTION_CACHE_ALIAS = 'extraction'
+EXTRACTION_CACHE_DEFAULT_TTL = int(os.environ.get('EXTRACTION_CACHE_DEFAULT_TTL', 15 * 60))  # URLs sans expiration connue
+EXTRACTION_CACHE_MAX_TTL = int(os.environ.get('EXTRACTION_CACHE_MAX_TTL', 6 * 60 * 60))
+EXTRACTION_CACHE_EXPIRY_MARGIN = 60  # On considère l'URL signée expirée 1 minute avant l'heure annoncée
+EXTRACTION_NEGATIVE_CACHE_TTL = int(os.environ.get('EXTRACTION_NEGATIVE_CACHE_TTL', 10 * 60))  # Erreurs définitives
+
+# Backoff par plateforme en cas de limitation de débit (HTTP 429)
+RATE_LIMIT_BASE_BACKOFF = int(os.environ.get('RATE_LIMIT_BASE_BACKOFF', 30))
+RATE_LIMIT_MAX_BACKOFF = int(os.environ.get('RATE_LIMIT_MAX_BACKOFF', 15 * 60))
+RATE_LIMIT_RESET_AFTER = 30 * 60  # Retour au délai de base après 30 minutes sans limitation
+
+# Coalescence des extractions identiques entre workers (single-flight)
+SINGLEFLIGHT_LEASE_TTL = int(os.environ.get('SINGLEFLIGHT_LEASE_TTL', 45))  # prolongé tant que l'extraction dure ; délai de reprise si le détenteur meurt
+SINGLEFLIGHT_WAIT_TIMEOUT = int(os.environ.get('SINGLEFLIGHT_WAIT_TIMEOUT', 60))  # attente max d'un worker avant d'extraire lui-même
+SINGLEFLIGHT_POLL_INTERVAL = 0.25  # première attente, doublée à chaque lecture
+SINGLEFLIGHT_MAX_POLL_INTERVAL = 2
+SINGLEFLIGHT_ERROR_TTL = 30
+
+# Pool d'instances YoutubeDL par processus worker (voir books/ydl_pool.py)
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 2))  # instances gardées par profil
+YDL_POOL_MAX_USES = int(os.environ.get('YDL_POOL_MAX_USES', 500))  # recyclage d'une instance
+
+# Disjoncteur par plateforme (taux d'échec calculé sur une fenêtre glissante, tous workers confondus)
+CIRCUIT_BREAKER_WINDOW = int(os.environ.get('CIRCUIT_BREAKER_WINDOW', 120))  # secondes
+CIRCUIT_BREAKER_BUCKET_SIZE = 10  # secondes par compteur de la fenêtre
+CIRCUIT_BREAKER_MIN_REQUESTS = int(os.environ.get('CIRCUIT_BREAKER_MIN_REQUESTS', 10))
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.environ.get('CIRCUIT_BREAKER_FAILURE_RATE', 0.5))
+CIRCUIT_BREAKER_OPEN_DURATION = int(os.environ.get('CIRCUIT_BREAKER_OPEN_DURATION', 60))
+CIRCUIT_BREAKER_HALF_OPEN_TRIALS = 2
+
+# --- Proxy de téléchargement (voir books/proxy.py) ---
+# 'python' : les octets sont relayés par le worker ASGI ;
+# 'nginx' : relais confié à nginx par X-Accel-Redirect (deploy/nginx/proxy-download.conf.example)
+PROXY_MODE = os.environ.get('PROXY_MODE', 'python')
+PROXY_ACCEL_LOCATION = os.environ.get('PROXY_ACCEL_LOCATION', '/_proxy_download/')
+PROXY_CHUNK_SIZE = int(os.environ.get('PROXY_CHUNK_SIZE', 64 * 1024))  # octets par bloc relayé
+PROXY_CONNECT_TIMEOUT = int(os.environ.get('PROXY_CONNECT_TIMEOUT', 10))
+PROXY_READ_TIMEOUT = int(os.environ.get('PROXY_READ_TIMEOUT', 30))  # silence maximal de la source
+PROXY_POOL_TIMEOUT = 10  # attente d'une connexion libre quand le pool est plein
+PROXY_MAX_CONNECTIONS = int(os.environ.get('PROXY_MAX_CONNECTIONS', 200))  # par processus web
+PROXY_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('PROXY_MAX_KEEPALIVE_CONNECTIONS', 50))
+
+# Téléchargement par segments Range parallèles pour les CDN qui brident chaque connexion
+PROXY_SEGMENT_PARALLELISM = int(os.environ.get('PROXY_SEGMENT_PARALLELISM', 1))  # 1 = flux unique
+PROXY_SEGMENT_SIZE = int(os.environ.get('PROXY_SEGMENT_SIZE', 2 * 1024 ** 2))
+PROXY_SEGMENT_WINDOW = int(os.environ.get('PROXY_SEGMENT_WINDOW', 2 * PROXY_SEGMENT_PARALLELISM))  # segments en mémoire
+PROXY_SEGMENT_MIN_SIZE = int(os.environ.get('PROXY_SEGMENT_MIN_SIZE', 8 * 1024 ** 2))  # en dessous : flux unique
+
+# Limites par IP du proxy (voir books/throttle.py), partagées entre workers via le cache
+PROXY_MAX_STREAMS_PER_IP = int(os.environ.get('PROXY_MAX_STREAMS_PER_IP', 4))  # 0 = illimité
+PROXY_BANDWIDTH_PER_IP = int(os.environ.get('PROXY_BANDWIDTH_PER_IP', 8 * 1024 ** 2))  # octets/s, 0 = illimité
+PROXY_BANDWIDTH_GLOBAL = int(os.environ.get('PROXY_BANDWIDTH_GLOBAL', 0))  # octets/s pour tout le service, 0 = illimité
+PROXY_BANDWIDTH_BURST = 1  # capacité du seau à jetons, en secondes de débit (rafale)
+PROXY_BANDWIDTH_GRANT = 256 * 1024  # octets réservés par appel au cache
+PROXY_STREAM_SLOT_TTL = 60 * 60  # libère les places d'un worker tué
+PROXY_STREAM_RETRY_AFTER = 10
+
+# Fusion à la volée des formats vidéo + audio séparés (voir books/mux.py)
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# Cache disque des vidéos relayées (voir books/content_cache.py), partagé avec nginx via media_volume
+PROXY_CACHE_DIR = MEDIA_ROOT / 'proxy_cache'
+PROXY_CACHE_MAX_BYTES = int(os.environ.get('PROXY_CACHE_MAX_BYTES', 5 * 1024 ** 3))  # 0 = désactivé
+PROXY_CACHE_EVICT_TARGET = 0.9  # fraction du budget visée par une éviction (le disque n'est pas reparcouru à chaque remplissage)
+PROXY_CACHE_MAX_OBJECT_BYTES = int(os.environ.get('PROXY_CACHE_MAX_OBJECT_BYTES', 512 * 1024 ** 2))
+PROXY_CACHE_STALL_TIMEOUT = 30  # secondes sans progression avant d'abandonner un remplissage
+PROXY_CACHE_POLL_INTERVAL = 0.05  # attente des lecteurs d'une entrée en cours de remplissage
+PROXY_CACHE_SKIP_TTL = 60 * 60  # vidéos non cachables (taille inconnue ou trop grande)
+PROXY_CACHE_ACCEL_LOCATION = os.environ.get('PROXY_CACHE_ACCEL_LOCATION', '/_proxy_cache/')
+
+# Rafraîchissement des URLs directes expirées des téléchargements par handle (voir books/refresh.py)
+PROXY_REFRESH_TIMEOUT = int(os.environ.get('PROXY_REFRESH_TIMEOUT', 30))  # attente maximale d'une réextraction
+PROXY_REFRESH_POLL_INTERVAL = 0.25
+PROXY_REFRESH_RESULT_TTL = 10 * 60  # nouvelle URL gardée pour les flux qui arrivent en retard
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -171,11 +278,119 @@ CELERY_CACHE_BACKEND = 'default'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes max par tâche
 CELERY_TASK_RESULT_EXPIRES = 30 * 60  # 30 minutes max pour le résultat d'une tâche
+CELERY_RESULT_EXPIRES = CELERY_TASK_RESULT_EXPIRES  # nom lu par Celery 5 (l'ancien nom est ignoré)
+
+# Stockage des résultats (voir books/result_backend.py) :
+# 'database' : CELERY_RESULT_BACKEND tel quel (django_celery_results, une écriture Postgres par tâche) ;
+# 'redis' : résultats dans Redis avec TTL natif, seuls les résultats choisis sont archivés en base.
+TASK_RESULT_STORE = os.environ.get('TASK_RESULT_STORE', 'database')
+# Idéalement une instance dédiée : avec volatile-lru, un Redis plein évince aussi les résultats
+TASK_RESULT_REDIS_URL = os.environ.get('TASK_RESULT_REDIS_URL', REDIS_URL)
+if TASK_RESULT_STORE == 'redis':
+    CELERY_RESULT_BACKEND = f"books.result_backend:CompactRedisBackend+{TASK_RESULT_REDIS_URL}"
+TASK_RESULT_PERSIST_TASKS = [name for name in os.environ.get('TASK_RESULT_PERSIST_TASKS', '').split(',') if name]
+TASK_RESULT_PERSIST_STATES = ('SUCCESS', 'FAILURE')
+TASK_RESULT_PERSIST_RETENTION = int(os.environ.get('TASK_RESULT_PERSIST_RETENTION', 30 * 24 * 60 * 60))
+TASK_RESULT_PURGE_BATCH_SIZE = 5000  # lignes supprimées par requête lors de la purge
+
+TASK_STATUS_BATCH_MAX = int(os.environ.get('TASK_STATUS_BATCH_MAX', 50))  # tâches par requête de downloads/task-status/
+
+# --- Tâches périodiques (celery beat, service celery_beat de docker-compose.yml) ---
+CELERY_BEAT_SCHEDULE = {
+    'purge-task-results': {
+        'task': 'books.tasks.purge_task_results',
+        'schedule': 60 * 60,
+    },
+    'rebuild-stat-rollups': {
+        'task': 'books.tasks.rebuild_stat_rollups',
+        'schedule': 15 * 60,
+    },
+    'maintain-stat-partitions': {
+        'task': 'books.tasks.maintain_stat_partitions',
+        'schedule': 24 * 60 * 60,
+    },
+}
+
+# Agrégats horaires des statistiques (voir books/rollups.py)
+STATS_ROLLUP_REBUILD_HOURS = int(os.environ.get('STATS_ROLLUP_REBUILD_HOURS', 3))  # heures closes recalculées par rebuild-stat-rollups
+STATS_EXPORT_CHUNK_SIZE = int(os.environ.get('STATS_EXPORT_CHUNK_SIZE', 2000))  # lignes lues par lot par stats/export/ (books/export.py)
+
+# Écriture différée des DownloadStat par les workers (voir books/stat_buffer.py)
+STAT_BUFFER_SIZE = int(os.environ.get('STAT_BUFFER_SIZE', 100))  # lignes par bulk_create (1 = écriture immédiate)
+STAT_BUFFER_FLUSH_INTERVAL = float(os.environ.get('STAT_BUFFER_FLUSH_INTERVAL', 1.0))  # secondes max en attente
+STAT_BUFFER_MAX_PENDING = 10000  # lignes gardées si la base refuse les écritures, les plus anciennes ensuite abandonnées
+STAT_BUFFER_PENDING_TTL = 10  # secondes pendant lesquelles le proxy attend une ligne réservée mais pas encore écrite
+
+# Géolocalisation hors ligne des IP (voir books/geoip.py) : fichier produit par `manage.py build_geoip_db <csv>`
+GEOIP_DATABASE_PATH = os.environ.get('GEOIP_DATABASE_PATH', str(BASE_DIR / 'geoip' / 'ip-country.bin'))
+
+# Partitions mensuelles de DownloadStat, PostgreSQL (voir books/partitions.py)
+DOWNLOAD_STATS_PARTITIONS_AHEAD = int(os.environ.get('DOWNLOAD_STATS_PARTITIONS_AHEAD', 3))  # mois créés d'avance
+DOWNLOAD_STATS_RETENTION_MONTHS = int(os.environ.get('DOWNLOAD_STATS_RETENTION_MONTHS', 0))  # mois complets gardés avant le mois courant (0 = tous)
+DOWNLOAD_STATS_PARTITION_LOCK_TIMEOUT = int(os.environ.get('DOWNLOAD_STATS_PARTITION_LOCK_TIMEOUT', 5000))  # ms d'attente d'un verrou (ATTACH, DETACH, DROP), sinon reporté à la prochaine exécution
+
+# Statut des tâches poussé aux clients en SSE via Redis pub/sub (voir books/task_events.py)
+TASK_EVENTS_CHANNEL = 'task-events'
+TASK_EVENTS_TIMEOUT = int(os.environ.get('TASK_EVENTS_TIMEOUT', 120))  # durée max d'une connexion SSE
+TASK_EVENTS_HEARTBEAT = 15  # secondes entre deux commentaires keep-alive
+TASK_EVENTS_RETRY_MS = 2000  # délai de reconnexion annoncé à EventSource
+TASK_EVENTS_FALLBACK_POLL_INTERVAL = 2  # sans Redis : lecture du backend toutes les N secondes
 
 # Facultatif pour éviter les timezone warnings
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
+# --- Files Celery par plateforme (voir books/routing.py et myproject/celery.py) ---
+# Chaque file a son propre worker, avec sa concurrence et son prefetch.
+# Un prefetch de 1 permet aux priorités (formats avant record) de s'appliquer.
+CELERY_TASK_ROUTES = ('books.routing.route_by_platform',)
+PLATFORM_QUEUE_MAX_PRIORITY = 10
+
+PLATFORM_QUEUES = {
+    'Twitter': {
+        'queue': 'twitter',
+        'concurrency': int(os.environ.get('CELERY_TWITTER_CONCURRENCY', 4)),
+        'prefetch_multiplier': int(os.environ.get('CELERY_TWITTER_PREFETCH', 1)),
+    },
+    'TikTok': {
+        'queue': 'tiktok',
+        'concurrency': int(os.environ.get('CELERY_TIKTOK_CONCURRENCY', 2)),
+        'prefetch_multiplier': int(os.environ.get('CELERY_TIKTOK_PREFETCH', 1)),
+    },
+    'Instagram': {
+        'queue': 'instagram',
+        'concurrency': int(os.environ.get('CELERY_INSTAGRAM_CONCURRENCY', 2)),
+        'prefetch_multiplier': int(os.environ.get('CELERY_INSTAGRAM_PREFETCH', 1)),
+    },
+    'Facebook': {
+        'queue': 'facebook',
+        'concurrency': int(os.environ.get('CELERY_FACEBOOK_CONCURRENCY', 4)),
+        'prefetch_multiplier': int(os.environ.get('CELERY_FACEBOOK_PREFETCH', 1)),
+    },
+    # YouTube n'est pas supporté : ses tâches échouent vite, file partagée avec les autres
+    'YouTube': {
+        'queue': 'other',
+        'concurrency': int(os.environ.get('CELERY_OTHER_CONCURRENCY', 2)),
+        'prefetch_multiplier': int(os.environ.get('CELERY_OTHER_PREFETCH', 1)),
+    },
+    'Other': {
+        'queue': 'other',
+        'concurrency': int(os.environ.get('CELERY_OTHER_CONCURRENCY', 2)),
+        'prefetch_multiplier': int(os.environ.get('CELERY_OTHER_PREFETCH', 1)),
+    },
+}
+
+CELERY_TASK_QUEUES = [Queue('celery')] + [
+    Queue(name, routing_key=name, queue_arguments={'x-max-priority': PLATFORM_QUEUE_MAX_PRIORITY})
+    for name in sorted({conf['queue'] for conf in PLATFORM_QUEUES.values()})
+]
+
+# Plateforme servie par ce worker ('Other' pour le worker générique, vide = réglages Celery par défaut)
+WORKER_PLATFORM = os.environ.get('CELERY_WORKER_PLATFORM')
+if WORKER_PLATFORM:
+    CELERY_WORKER_CONCURRENCY = PLATFORM_QUEUES[WORKER_PLATFORM]['concurrency']
+    CELERY_WORKER_PREFETCH_MULTIPLIER = PLATFORM_QUEUES[WORKER_PLATFORM]['prefetch_multiplier']
+
 # Pour les liens générés par Django
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')